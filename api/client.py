@@ -73,13 +73,15 @@ class QdrantRAGClient:
     
     def ingest(
         self,
-        directory: str,
+        directory: Optional[str] = None,
         collection: str = "project_docs",
         project_id: Optional[str] = None,
         file_extensions: Optional[List[str]] = None,
-        sync: bool = False
+        sync: bool = False,
+        archive: Optional[str] = None,
+        include_globs: Optional[List[str]] = None
     ) -> Dict[str, Any]:
-        """Ingest documents from a directory.
+        """Ingest documents from a directory or a tar/zip archive.
         
         Args:
             directory: Path to directory to ingest
@@ -87,6 +89,9 @@ class QdrantRAGClient:
             project_id: Project identifier for filtering
             file_extensions: File extensions to include
             sync: Whether to wait for completion (True) or run async (False)
+            archive: Archive path (on the API host) to ingest instead of a
+                directory; members are streamed, never extracted
+            include_globs: Archive member globs to include
             
         Returns:
             Dictionary with ingestion status
@@ -95,10 +100,15 @@ class QdrantRAGClient:
             file_extensions = [".md", ".txt", ".py", ".js", ".ts", ".json", ".yaml", ".yml"]
         
         payload = {
-            "directory": str(directory),
             "collection": collection,
             "file_extensions": file_extensions
         }
+        if archive:
+            payload["archive"] = str(archive)
+        else:
+            payload["directory"] = str(directory)
+        if include_globs:
+            payload["include_globs"] = include_globs
         
         if project_id:
             payload["project_id"] = project_id
@@ -164,11 +174,12 @@ def main():
     
     # Ingest command
     ingest_parser = subparsers.add_parser("ingest", help="Ingest documents")
-    ingest_parser.add_argument("directory", help="Directory to ingest")
+    ingest_parser.add_argument("directory", help="Directory (or .tar.gz/.zip archive) to ingest")
     ingest_parser.add_argument("--collection", default="project_docs", help="Collection name")
     ingest_parser.add_argument("--project-id", help="Project identifier")
     ingest_parser.add_argument("--sync", action="store_true", help="Wait for completion")
     ingest_parser.add_argument("--extensions", nargs="+", help="File extensions to include")
+    ingest_parser.add_argument("--include", nargs="+", help="Archive member globs to include")
     
     # Collections command
     collections_parser = subparsers.add_parser("collections", help="List collections")
@@ -209,12 +220,18 @@ def main():
                 print()
         
         elif args.command == "ingest":
+            is_archive = args.directory.lower().endswith(
+                (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2",
+                 ".tar.xz", ".txz", ".zip")
+            )
             result = client.ingest(
-                directory=args.directory,
+                directory=None if is_archive else args.directory,
                 collection=args.collection,
                 project_id=args.project_id,
                 file_extensions=args.extensions,
-                sync=args.sync
+                sync=args.sync,
+                archive=args.directory if is_archive else None,
+                include_globs=args.include
             )
             print(json.dumps(result, indent=2))
         
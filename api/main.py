@@ -5,10 +5,15 @@ without needing individual server.py files.
 """
 
 import os
+import time
 import logging
+import threading
 import uuid
+import fnmatch
+import tarfile
+import zipfile
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, File, UploadFile
@@ -31,6 +36,13 @@ logger = logging.getLogger(__name__)
 # Global variables for embeddings and client
 embeddings_instance = None
 qdrant_client = None
+embedding_dim = None
+
+# Per-process collection metadata (exists, size, distance, payload indexes),
+# refreshed after COLLECTION_META_TTL seconds or on invalidation
+collection_meta: Dict[str, Dict[str, Any]] = {}
+collection_meta_lock = threading.Lock()
+COLLECTION_META_TTL = float(os.getenv("COLLECTION_META_TTL", "60"))
 
 # -------------------- Embeddings Classes --------------------
 class Embeddings:
@@ -100,13 +112,25 @@ class QueryRequest(BaseModel):
     project_id: Optional[str] = Field(None, description="Project identifier")
 
 class IngestRequest(BaseModel):
-    directory: str = Field(..., description="Directory to ingest")
+    directory: Optional[str] = Field(None, description="Directory to ingest")
+    archive: Optional[str] = Field(
+        None, description="tar/tar.gz/tar.bz2/tar.xz/zip archive to ingest "
+        "(streamed, never extracted to disk)"
+    )
     collection: str = Field("project_docs", description="Collection name")
     project_id: Optional[str] = Field(None, description="Project identifier")
     file_extensions: List[str] = Field(
         [".md", ".txt", ".py", ".js", ".ts", ".json", ".yaml", ".yml"],
         description="File extensions to include"
     )
+    include_globs: Optional[List[str]] = Field(
+        None, description="Archive member globs to include "
+        "(default: by file_extensions)"
+    )
+    exclude_globs: List[str] = Field(
+        ["**/.git/**", "**/node_modules/**", "**/.venv/**"],
+        description="Archive member globs to exclude"
+    )
 
 class DocumentResponse(BaseModel):
     id: str
@@ -171,21 +195,241 @@ app.add_middleware(
 )
 
 # -------------------- Helper Functions --------------------
-def ensure_collection_exists(collection_name: str, vector_size: int = 384):
-    """Ensure collection exists, create if it doesn't."""
+def embedding_size() -> int:
+    """Vector size of the loaded embeddings model (probed once)."""
+    global embedding_dim
+    if embedding_dim is None:
+        embedding_dim = len(embeddings_instance.embed(["dimension probe"])[0])
+    return embedding_dim
+
+
+def fetch_collection_meta(collection_name: str) -> Dict[str, Any]:
     try:
-        qdrant_client.get_collection(collection_name)
-        logger.info(f"Collection '{collection_name}' already exists")
+        info = qdrant_client.get_collection(collection_name)
     except Exception:
-        logger.info(f"Creating collection '{collection_name}'...")
-        qdrant_client.create_collection(
-            collection_name=collection_name,
-            vectors_config=qm.VectorParams(
-                size=vector_size,
-                distance=qm.Distance.COSINE
+        # Only a missing collection counts as "not found"; network and
+        # server errors propagate
+        names = {c.name for c in qdrant_client.get_collections().collections}
+        if collection_name in names:
+            raise
+        return {"exists": False, "fetched": time.monotonic()}
+    vectors = info.config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors.get("") or next(iter(vectors.values()), None)
+    return {
+        "exists": True,
+        "size": getattr(vectors, "size", None),
+        "distance": getattr(vectors, "distance", None),
+        "payload_indexes": set(info.payload_schema or {}),
+        "fetched": time.monotonic(),
+    }
+
+
+def get_collection_meta(collection_name: str) -> Dict[str, Any]:
+    """Cached collection metadata; one get_collection per TTL."""
+    meta = collection_meta.get(collection_name)
+    if (meta is None
+            or time.monotonic() - meta["fetched"] > COLLECTION_META_TTL):
+        meta = collection_meta[collection_name] = fetch_collection_meta(
+            collection_name
+        )
+    return meta
+
+
+def invalidate_collection_meta(collection_name: str):
+    with collection_meta_lock:
+        collection_meta.pop(collection_name, None)
+
+
+def ensure_collection_exists(collection_name: str,
+                             vector_size: Optional[int] = None
+                             ) -> Dict[str, Any]:
+    """Ensure collection exists, create if it doesn't.
+
+    Uses the metadata cache, so repeated calls cost no round-trip, and
+    checks ``vector_size`` locally: a mismatch is a 400, never a recreate.
+    """
+    with collection_meta_lock:
+        meta = get_collection_meta(collection_name)
+        if not meta["exists"]:
+            size = vector_size or embedding_size()
+            logger.info(f"Creating collection '{collection_name}'...")
+            try:
+                qdrant_client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config=qm.VectorParams(
+                        size=size,
+                        distance=qm.Distance.COSINE
+                    )
+                )
+                logger.info(f"✅ Collection '{collection_name}' created")
+            except Exception:
+                # Created concurrently by another process
+                if not fetch_collection_meta(collection_name)["exists"]:
+                    raise
+            meta = collection_meta[collection_name] = fetch_collection_meta(
+                collection_name
+            )
+        if vector_size and meta["size"] and meta["size"] != vector_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Vector size {vector_size} does not match collection "
+                f"'{collection_name}' (size {meta['size']}); the embeddings "
+                "model differs from the one used to create it"
             )
+        return meta
+
+
+def upsert_batch(docs: List[str], metadata: List[Dict[str, Any]],
+                 collection: str) -> int:
+    """Embed one batch of documents and upsert it; returns points added."""
+    vectors = embeddings_instance.embed(docs)
+    ensure_collection_exists(collection, len(vectors[0]))
+    points = [
+        qm.PointStruct(
+            id=str(uuid.uuid4()),
+            vector=vectors[i],
+            payload=metadata[i]
         )
-        logger.info(f"✅ Collection '{collection_name}' created")
+        for i in range(len(docs))
+    ]
+    try:
+        qdrant_client.upsert(
+            collection_name=collection,
+            points=points
+        )
+    except Exception:
+        # Collection dropped/recreated elsewhere: refetch its metadata
+        invalidate_collection_meta(collection)
+        raise
+    return len(points)
+
+
+def iter_archive_members(archive: str, file_extensions: List[str],
+                         include_globs: Optional[List[str]] = None,
+                         exclude_globs: Optional[List[str]] = None
+                         ) -> Iterator[Tuple[str, int, bytes]]:
+    """Yield (name, size, content) for matching regular-file members.
+
+    Members are read one at a time from the archive stream (tar is opened
+    with ``r|*``), so nothing is extracted to disk and only the current
+    member is held in memory.
+    """
+    def wanted(name: str) -> bool:
+        if name.startswith("/") or ".." in name.split("/"):
+            return False
+        if any(fnmatch.fnmatch(name, p) for p in exclude_globs or []):
+            return False
+        if include_globs:
+            return any(fnmatch.fnmatch(name, p) for p in include_globs)
+        return Path(name).suffix in file_extensions
+
+    if archive.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                if not info.is_dir() and wanted(name):
+                    yield name, info.file_size, zf.read(info)
+        return
+    with tarfile.open(archive, mode="r|*") as tf:
+        for member in tf:
+            name = member.name
+            while name.startswith("./"):
+                name = name[2:]
+            if member.isfile() and wanted(name):
+                yield name, member.size, tf.extractfile(member).read()
+
+
+def ingest_archive(archive: str, collection: str, project_id: str = None,
+                   file_extensions: List[str] = None,
+                   include_globs: Optional[List[str]] = None,
+                   exclude_globs: Optional[List[str]] = None
+                   ) -> Dict[str, Any]:
+    """Ingest the members of a tar/zip archive without extracting it."""
+    if file_extensions is None:
+        file_extensions = [
+            ".md", ".txt", ".py", ".js", ".ts", ".json", ".yaml", ".yml"
+        ]
+    
+    if not Path(archive).is_file():
+        raise HTTPException(
+            status_code=404, detail=f"Archive not found: {archive}"
+        )
+    
+    files_processed = 0
+    points_added = 0
+    batch_size = 100
+    batch_docs = []
+    batch_metadata = []
+    
+    try:
+        for name, size, data in iter_archive_members(
+            archive, file_extensions, include_globs, exclude_globs
+        ):
+            content = data.decode("utf-8", errors="ignore")
+            if len(content.strip()) == 0:
+                continue
+            batch_docs.append(content)
+            batch_metadata.append({
+                "file_path": name,
+                "full_path": f"{archive}!{name}",
+                "archive": archive,
+                "file_extension": Path(name).suffix,
+                "file_size": size,
+                "project_id": project_id or "default"
+            })
+            files_processed += 1
+            
+            if len(batch_docs) >= batch_size:
+                points_added += upsert_batch(
+                    batch_docs, batch_metadata, collection
+                )
+                logger.info(
+                    f"Added batch of {len(batch_docs)} points to {collection}"
+                )
+                batch_docs = []
+                batch_metadata = []
+    except (tarfile.TarError, zipfile.BadZipFile) as e:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid archive {archive}: {e}"
+        )
+    
+    if batch_docs:
+        points_added += upsert_batch(batch_docs, batch_metadata, collection)
+        logger.info(
+            f"Added final batch of {len(batch_docs)} points to {collection}"
+        )
+    
+    return {
+        "files_processed": files_processed,
+        "points_added": points_added,
+        "collection": collection,
+        "archive": archive
+    }
+
+
+def ingest_source(request: IngestRequest) -> Dict[str, Any]:
+    """Ingest the request's archive if given, otherwise its directory."""
+    if request.archive:
+        return ingest_archive(
+            request.archive,
+            request.collection,
+            request.project_id,
+            request.file_extensions,
+            request.include_globs,
+            request.exclude_globs
+        )
+    if not request.directory:
+        raise HTTPException(
+            status_code=400, detail="Either directory or archive is required"
+        )
+    return ingest_directory(
+        request.directory,
+        request.collection,
+        request.project_id,
+        request.file_extensions
+    )
+
 
 def ingest_directory(directory: str, collection: str, project_id: str = None,
                     file_extensions: List[str] = None) -> Dict[str, Any]:
@@ -214,7 +458,6 @@ def ingest_directory(directory: str, collection: str, project_id: str = None,
     # Process files in batches
     batch_size = 100
     batch_docs = []
-    batch_ids = []
     batch_metadata = []
     
     for file_path in all_files:
@@ -225,7 +468,6 @@ def ingest_directory(directory: str, collection: str, project_id: str = None,
             if len(content.strip()) == 0:
                 continue
                 
-            doc_id = str(uuid.uuid4())
             metadata = {
                 "file_path": str(file_path.relative_to(directory_path)),
                 "full_path": str(file_path),
@@ -235,34 +477,20 @@ def ingest_directory(directory: str, collection: str, project_id: str = None,
             }
             
             batch_docs.append(content)
-            batch_ids.append(doc_id)
             batch_metadata.append(metadata)
             files_processed += 1
             
             # Process batch when full
             if len(batch_docs) >= batch_size:
-                vectors = embeddings_instance.embed(batch_docs)
-                
-                points = [
-                    qm.PointStruct(
-                        id=batch_ids[i],
-                        vector=vectors[i],
-                        payload=batch_metadata[i]
-                    )
-                    for i in range(len(batch_docs))
-                ]
-                
-                qdrant_client.upsert(
-                    collection_name=collection,
-                    points=points
+                points_added += upsert_batch(
+                    batch_docs, batch_metadata, collection
+                )
+                logger.info(
+                    f"Added batch of {len(batch_docs)} points to {collection}"
                 )
-                
-                points_added += len(points)
-                logger.info(f"Added batch of {len(points)} points to {collection}")
                 
                 # Reset batch
                 batch_docs = []
-                batch_ids = []
                 batch_metadata = []
         
         except Exception as e:
@@ -271,24 +499,10 @@ def ingest_directory(directory: str, collection: str, project_id: str = None,
     
     # Process remaining batch
     if batch_docs:
-        vectors = embeddings_instance.embed(batch_docs)
-        
-        points = [
-            qm.PointStruct(
-                id=batch_ids[i],
-                vector=vectors[i],
-                payload=batch_metadata[i]
-            )
-            for i in range(len(batch_docs))
-        ]
-        
-        qdrant_client.upsert(
-            collection_name=collection,
-            points=points
+        points_added += upsert_batch(batch_docs, batch_metadata, collection)
+        logger.info(
+            f"Added final batch of {len(batch_docs)} points to {collection}"
         )
-        
-        points_added += len(points)
-        logger.info(f"Added final batch of {len(points)} points to {collection}")
     
     return {
         "files_processed": files_processed,
@@ -323,12 +537,12 @@ async def health_check():
 async def query_documents(request: QueryRequest):
     """Search for documents using semantic similarity."""
     try:
-        # Ensure collection exists
-        ensure_collection_exists(request.collection)
-        
         # Generate embedding for query
         query_vector = embeddings_instance.embed([request.text])[0]
         
+        # Ensure collection exists (cached) and matches the vector size
+        ensure_collection_exists(request.collection, len(query_vector))
+        
         # Build search filter
         search_filter = None
         if request.path_prefix or request.project_id:
@@ -376,33 +590,36 @@ async def query_documents(request: QueryRequest):
             collection=request.collection
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Query error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/ingest")
 async def ingest_documents(request: IngestRequest, background_tasks: BackgroundTasks):
-    """Ingest documents from a directory into Qdrant."""
+    """Ingest documents from a directory or archive into Qdrant."""
+    if not (request.directory or request.archive):
+        raise HTTPException(
+            status_code=400, detail="Either directory or archive is required"
+        )
     try:
-        # Ensure collection exists
-        ensure_collection_exists(request.collection)
+        # Ensure collection exists and fits the model's vectors (cached)
+        ensure_collection_exists(request.collection, embedding_size())
         
         # Add ingestion task to background
-        background_tasks.add_task(
-            ingest_directory,
-            request.directory,
-            request.collection,
-            request.project_id,
-            request.file_extensions
-        )
+        background_tasks.add_task(ingest_source, request)
         
         return {
             "message": "Ingestion started",
             "directory": request.directory,
+            "archive": request.archive,
             "collection": request.collection,
             "status": "processing"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ingest error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -411,16 +628,11 @@ async def ingest_documents(request: IngestRequest, background_tasks: BackgroundT
 async def ingest_documents_sync(request: IngestRequest):
     """Ingest documents synchronously (wait for completion)."""
     try:
-        # Ensure collection exists
-        ensure_collection_exists(request.collection)
+        # Ensure collection exists and fits the model's vectors (cached)
+        ensure_collection_exists(request.collection, embedding_size())
         
         # Ingest documents
-        result = ingest_directory(
-            request.directory,
-            request.collection,
-            request.project_id,
-            request.file_extensions
-        )
+        result = ingest_source(request)
         
         return {
             "message": "Ingestion completed",
@@ -428,6 +640,8 @@ async def ingest_documents_sync(request: IngestRequest):
             "status": "completed"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Sync ingest error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -471,6 +685,7 @@ async def delete_collection(collection_name: str):
     """Delete a collection and all its data."""
     try:
         qdrant_client.delete_collection(collection_name)
+        invalidate_collection_meta(collection_name)
         return {"message": f"Collection '{collection_name}' deleted successfully"}
         
     except Exception as e:
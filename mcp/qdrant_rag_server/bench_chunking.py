@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos chunkers: janelas fixas ("chars") × cortes sintáticos ("syntax").
+
+Percorre um diretório (default: a raiz deste repositório) com os globs
+default do ingest e compara, por extensão:
+- chunks: quantos vetores cada modo gera;
+- texto: caracteres guardados nos payloads (a sobreposição das janelas
+  duplica texto);
+- tempo: só o chunking, melhor de ``--repeat`` execuções.
+
+Com ``--ingest`` roda também handle_ingest completo nos dois modos
+(embeddings de make_embeddings(), ou seja, o EMBEDDING_PROVIDER do .env)
+numa coleção em memória, e compara o tempo de ingest de ponta a ponta.
+
+Uso:
+    python bench_chunking.py [diretório] [--chunk-size 800] [--overlap 100]
+                             [--repeat 3] [--ingest]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import server
+
+
+def load_files(base_dir: str):
+    include = ["**/*.py", "**/*.md", "**/*.txt", "**/*.json", "**/*.yaml",
+               "**/*.yml"]
+    exclude = ["**/.git/**", "**/.hg/**", "**/node_modules/**",
+               "**/.venv/**", "**/*.ipynb"]
+    files = []
+    for path in server.iter_files(base_dir, include, exclude):
+        with open(path, "rb") as f:
+            data = f.read()
+        if server.looks_binary(data[:server.SNIFF_SIZE]):
+            continue
+        files.append((os.path.relpath(path, base_dir),
+                      server.decode_text(data)))
+    return files
+
+
+def chunk_chars(rel, text, chunk_size, overlap):
+    return list(server.iter_chunks(text, chunk_size, overlap))
+
+
+def chunk_syntax(rel, text, chunk_size, overlap):
+    return list(server.iter_syntax_chunks(rel, text, chunk_size, overlap))
+
+
+def measure(fn, files, args):
+    """Chunks/caracteres por extensão e melhor tempo total."""
+    best = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        for rel, text in files:
+            fn(rel, text, args.chunk_size, args.overlap)
+        best = min(best, time.perf_counter() - t0)
+    stats = defaultdict(lambda: [0, 0, 0])
+    for rel, text in files:
+        ext = os.path.splitext(rel)[1].lower() or "(sem)"
+        chunks = fn(rel, text, args.chunk_size, args.overlap)
+        stats[ext][0] += 1
+        stats[ext][1] += len(chunks)
+        stats[ext][2] += sum(len(c) for _, c in chunks)
+    return stats, best
+
+
+def run_ingest(base_dir, mode, args, embeddings):
+    """Segundos de handle_ingest num Qdrant em memória, e o resultado."""
+    from qdrant_client import QdrantClient
+
+    # O cliente em memória não é thread-safe: um único upsert por vez
+    os.environ["INGEST_UPSERT_WORKERS"] = "1"
+    index = server.QdrantIndex(QdrantClient(":memory:"), "bench")
+    with tempfile.TemporaryDirectory() as state_dir:
+        manifest = server.IngestManifest("bench", state_dir)
+        t0 = time.perf_counter()
+        result = server.handle_ingest(
+            {
+                "directory": base_dir, "chunk_mode": mode,
+                "chunk_size": args.chunk_size, "overlap": args.overlap,
+                "force": True,
+            },
+            embeddings, index, manifest,
+        )
+        return time.perf_counter() - t0, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "directory", nargs="?",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", ".."),
+    )
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--overlap", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--ingest", action="store_true")
+    args = parser.parse_args()
+    base_dir = os.path.abspath(args.directory)
+
+    files = load_files(base_dir)
+    print(f"{len(files)} arquivos em {base_dir} "
+          f"(chunk_size={args.chunk_size}, overlap={args.overlap})")
+    chars, t_chars = measure(chunk_chars, files, args)
+    syntax, t_syntax = measure(chunk_syntax, files, args)
+    print(
+        f"{'ext':<8} {'arquivos':>8} {'chunks chars':>13} "
+        f"{'chunks syntax':>14} {'texto chars':>12} {'texto syntax':>13}"
+    )
+    for ext in sorted(chars):
+        n, c1, s1 = chars[ext]
+        _, c2, s2 = syntax[ext]
+        print(f"{ext:<8} {n:>8} {c1:>13} {c2:>14} {s1:>12} {s2:>13}")
+    total = [sum(v[i] for v in chars.values()) for i in (1, 2)]
+    total_syntax = [sum(v[i] for v in syntax.values()) for i in (1, 2)]
+    print(
+        f"{'total':<8} {len(files):>8} {total[0]:>13} {total_syntax[0]:>14} "
+        f"{total[1]:>12} {total_syntax[1]:>13}"
+    )
+    print(
+        f"chunks: {(total_syntax[0] / max(total[0], 1) - 1) * 100:+.1f}%, "
+        f"texto: {(total_syntax[1] / max(total[1], 1) - 1) * 100:+.1f}%, "
+        f"chunking: {t_chars:.3f} s (chars) × {t_syntax:.3f} s (syntax)"
+    )
+
+    if args.ingest:
+        embeddings = server.make_embeddings()
+        # Aquece o modelo fora da medição
+        embeddings.embed(["warmup"])
+        for mode in ("chars", "syntax"):
+            secs, result = run_ingest(base_dir, mode, args, embeddings)
+            print(
+                f"ingest {mode:<6} {secs:>8.2f} s  "
+                f"{result['chunks']} chunks, "
+                f"{result['files_indexed']} arquivos"
+            )
+
+
+if __name__ == "__main__":
+    main()
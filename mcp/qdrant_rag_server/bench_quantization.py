@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Relatório recall × latência da quantização (none / scalar int8 / binary).
+
+Cria uma coleção temporária por modo com os mesmos vetores e compara cada
+busca com a busca exata em float32 (``exact=True`` na coleção sem
+quantização), que é o gabarito:
+- recall@k: fração do top-k exato que a busca devolveu;
+- p50/p95: latência por consulta (ms), medida no cliente;
+- RAM/vetor: bytes do vetor que a busca percorre (float32, int8 ou 1 bit
+  por dimensão; sem o grafo HNSW).
+
+Para scalar/binary varia ``oversampling`` (candidatos = top_k ×
+oversampling) e ``rescore`` (reordena os candidatos com os vetores
+originais) — os mesmos parâmetros de qdrant_query (rescore/oversampling).
+
+Os vetores vêm de uma coleção existente (``--source-collection``; as
+últimas ``--queries`` ficam de fora e viram consultas) ou são sintéticos,
+agrupados em clusters como embeddings de texto.
+
+Precisa de um servidor Qdrant: o modo local (``:memory:``) aceita a
+configuração mas ignora a quantização, então os números só valem contra
+um servidor. Sem servidor, ``--simulate`` reproduz em numpy o que o
+Qdrant calcula (int8 pelo quantil, 1 bit por dimensão com distância de
+Hamming, candidatos = top_k × oversampling, rescore em float32) numa
+busca bruta, sem HNSW: mede o recall que a quantização custa, e a
+latência p50/p95 é a dessa busca bruta em numpy (custo relativo do score
+e do rescore), não a do Qdrant.
+
+Uso:
+    python bench_quantization.py [--url http://localhost:6333]
+                                 [--source-collection project_docs]
+                                 [--points 20000] [--dim 384]
+                                 [--queries 200] [--top-k 10]
+                                 [--oversampling 1,2,4] [--keep]
+                                 [--simulate]
+"""
+
+import argparse
+import os
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
+
+import server
+
+BYTES_PER_DIM = {"exato": 4.0, "none": 4.0, "scalar": 1.0, "binary": 1 / 8}
+
+
+def make_client(url: str) -> QdrantClient:
+    if url == ":memory:":
+        return QdrantClient(":memory:")
+    if "localhost" in url or "127.0.0.1" in url:
+        return QdrantClient(url=url)
+    return QdrantClient(url=url, api_key=os.getenv("QDRANT_API_KEY"))
+
+
+def synthetic_vectors(n: int, dim: int) -> np.ndarray:
+    """Vetores normalizados em torno de centróides (embeddings de texto
+    não são uniformes na esfera, e a quantização depende disso)."""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(n // 200, 1), dim), dtype=np.float32)
+    labels = rng.integers(0, len(centers), n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal(
+        (n, dim), dtype=np.float32
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def source_vectors(client: QdrantClient, collection: str, n: int):
+    """Até ``n`` vetores de uma coleção existente, e a distância dela."""
+    info = client.get_collection(collection)
+    rows, offset = [], None
+    while len(rows) < n:
+        points, offset = client.scroll(
+            collection_name=collection, limit=min(1024, n - len(rows)),
+            offset=offset, with_vectors=True, with_payload=False,
+        )
+        rows.extend(p.vector for p in points)
+        if offset is None:
+            break
+    return (np.asarray(rows, dtype=np.float32),
+            info.config.params.vectors.distance)
+
+
+def create(client: QdrantClient, name: str, mode: str, vectors, ids,
+           distance):
+    client.create_collection(
+        collection_name=name,
+        vectors_config=qm.VectorParams(
+            size=vectors.shape[1], distance=distance,
+        ),
+        quantization_config=server.quantization_config(mode, True),
+        # Indexa (e quantiza) mesmo coleções pequenas: o limiar default
+        # deixaria os segmentos em busca bruta, sem HNSW
+        optimizers_config=qm.OptimizersConfigDiff(indexing_threshold=1),
+    )
+    for start in range(0, len(vectors), 1024):
+        batch = vectors[start:start + 1024]
+        client.upsert(
+            collection_name=name,
+            points=qm.Batch(
+                ids=ids[start:start + 1024],
+                vectors=batch.tolist(),
+            ),
+            wait=True,
+        )
+
+
+def wait_green(client: QdrantClient, name: str, timeout: float = 600.0):
+    """Espera o otimizador terminar (índice e vetores quantizados)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if client.get_collection(name).status == qm.CollectionStatus.GREEN:
+            return
+        time.sleep(0.5)
+    print(f"[aviso] {name} não ficou green em {timeout:.0f} s")
+
+
+def run(client, name, queries, top_k, params=None):
+    """Ids devolvidos por consulta e latências (ms)."""
+    ids, latencies = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        hits = client.search(
+            collection_name=name, query_vector=query, limit=top_k,
+            search_params=params,
+        )
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ids.append([hit.id for hit in hits])
+    return ids, latencies
+
+
+def quantized_scorer(mode: str, data: np.ndarray):
+    """Função consulta → scores aproximados de todos os pontos, como o
+    Qdrant os calcula com os vetores quantizados."""
+    if mode == "scalar":
+        quantile = server.quantization_config("scalar").scalar.quantile
+        lo, hi = np.quantile(data, [(1 - quantile) / 2, (1 + quantile) / 2])
+        scale = 255 / (hi - lo)
+
+        def dequantize(x):
+            codes = np.clip(np.rint((x - lo) * scale), 0, 255)
+            return (codes / scale + lo).astype(np.float32)
+
+        points = dequantize(data)
+        return lambda query: points @ dequantize(query)
+    # binary: 1 bit por dimensão (sinal); score = -distância de Hamming
+    bits = np.packbits(data > 0, axis=1)
+    return lambda query: -np.bitwise_count(
+        bits ^ np.packbits(query > 0)
+    ).sum(axis=1, dtype=np.int32)
+
+
+def simulate(data, queries, scorer, top_k, oversampling, rescore):
+    """Top-k de cada consulta e latências (ms): ``top_k × oversampling``
+    candidatos pelos scores quantizados e, com ``rescore``, reordenados em
+    float32."""
+    found, latencies = [], []
+    limit = int(top_k * oversampling) if rescore else top_k
+    for query in queries:
+        t0 = time.perf_counter()
+        scores = scorer(query)
+        candidates = np.argpartition(-scores, limit)[:limit]
+        if rescore:
+            exact = data[candidates] @ query
+            order = candidates[np.argsort(-exact)]
+        else:
+            order = candidates[np.argsort(-scores[candidates])]
+        found.append(order[:top_k].tolist())
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return found, latencies
+
+
+def run_simulated(data, queries, args, oversampling):
+    """Relatório sem Qdrant: recall e latência da busca bruta em numpy."""
+    dim = data.shape[1]
+    truth, exact_ms = simulate(
+        data, queries, lambda query: data @ query, args.top_k, 1, False
+    )
+    print(
+        f"\n{'modo':<7} {'oversampling':>12} {'rescore':>8} "
+        f"{'recall@' + str(args.top_k):>10} {'p50 ms':>7} "
+        f"{'p95 ms':>7} {'RAM/vetor':>10}"
+    )
+
+    def report(mode, over, rescore, found, ms):
+        p50, p95 = np.percentile(ms, [50, 95])
+        print(
+            f"{mode:<7} {over:>12} {rescore:>8} "
+            f"{recall(found, truth):>10.3f} {p50:>7.2f} {p95:>7.2f} "
+            f"{BYTES_PER_DIM[mode] * dim:>8.0f} B"
+        )
+
+    report("none", "-", "-", truth, exact_ms)
+    for mode in ("scalar", "binary"):
+        scorer = quantized_scorer(mode, data)
+        for over in oversampling:
+            for rescore in (False, True):
+                found, ms = simulate(data, queries, scorer, args.top_k,
+                                     over, rescore)
+                report(mode, f"{over:g}", "sim" if rescore else "não",
+                       found, ms)
+
+
+def recall(found, truth) -> float:
+    return float(np.mean([
+        len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)
+    ]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--url", default=os.getenv("QDRANT_URL", "http://localhost:6333")
+    )
+    parser.add_argument("--source-collection")
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--oversampling", default="1,2,4")
+    parser.add_argument("--keep", action="store_true",
+                        help="não apaga as coleções temporárias")
+    parser.add_argument("--simulate", action="store_true",
+                        help="sem Qdrant: busca bruta em numpy")
+    args = parser.parse_args()
+    oversampling = [float(x) for x in args.oversampling.split(",")]
+
+    client = None
+    if not args.simulate or args.source_collection:
+        client = make_client(args.url)
+    if args.url == ":memory:" and not args.simulate:
+        print("[aviso] modo local: a quantização é ignorada; os números "
+              "abaixo não medem nada além da busca em float32")
+    if args.source_collection:
+        vectors, distance = source_vectors(
+            client, args.source_collection, args.points + args.queries
+        )
+        if len(vectors) <= args.queries:
+            raise SystemExit(
+                f"{args.source_collection}: só {len(vectors)} vetores"
+            )
+    else:
+        vectors = synthetic_vectors(args.points + args.queries, args.dim)
+        distance = qm.Distance.COSINE
+    data, queries = vectors[:-args.queries], vectors[-args.queries:].tolist()
+    dim = vectors.shape[1]
+    print(f"{len(data)} pontos x {dim} dims, {len(queries)} consultas, "
+          f"top_k={args.top_k}, "
+          f"{'simulação numpy' if args.simulate else args.url}")
+    if args.simulate:
+        run_simulated(data, np.asarray(queries, dtype=np.float32), args,
+                      oversampling)
+        return
+
+    # Mesmos ids em todas as coleções: o recall compara ids
+    ids = [str(uuid.uuid4()) for _ in range(len(data))]
+    prefix = f"bench_quant_{uuid.uuid4().hex[:8]}"
+    names = {mode: f"{prefix}_{mode}" for mode in server.QUANTIZATION_MODES}
+    try:
+        for mode, name in names.items():
+            t0 = time.perf_counter()
+            create(client, name, mode, data, ids, distance)
+            wait_green(client, name)
+            print(f"[ok] {name}: {time.perf_counter() - t0:.1f} s")
+
+        truth, exact_ms = run(client, names["none"], queries, args.top_k,
+                              qm.SearchParams(exact=True))
+        print(
+            f"\n{'modo':<7} {'oversampling':>12} {'rescore':>8} "
+            f"{'recall@' + str(args.top_k):>10} {'p50 ms':>7} "
+            f"{'p95 ms':>7} {'RAM/vetor':>10}"
+        )
+
+        def report(mode, over, rescore, found, ms):
+            p50, p95 = np.percentile(ms, [50, 95])
+            print(
+                f"{mode:<7} {over:>12} {rescore:>8} "
+                f"{recall(found, truth):>10.3f} {p50:>7.2f} {p95:>7.2f} "
+                f"{BYTES_PER_DIM[mode] * dim:>8.0f} B"
+            )
+
+        report("exato", "-", "-", truth, exact_ms)
+        report("none", "-", "-",
+               *run(client, names["none"], queries, args.top_k))
+        for mode in ("scalar", "binary"):
+            for over in oversampling:
+                for rescore in (False, True):
+                    found, ms = run(
+                        client, names[mode], queries, args.top_k,
+                        server.search_params(rescore, over),
+                    )
+                    report(mode, f"{over:g}", "sim" if rescore else "não",
+                           found, ms)
+    finally:
+        if not args.keep:
+            for name in names.values():
+                if client.collection_exists(name):
+                    client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    main()
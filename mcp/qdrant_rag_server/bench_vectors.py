@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark do caminho de vetores embedder → Qdrant (não precisa de Qdrant
+nem de modelo: usa vetores float32 sintéticos, como os que o fastembed gera).
+
+Compara, por N chunks, as duas etapas do caminho:
+- embed: o que Embeddings.embed devolve e fica retido nas filas do pipeline
+  até o upsert. "lista" = [float(x) for x in vec] por vetor (caminho
+  antigo); "numpy" = uma matriz float32 contígua (as_numpy=True).
+- upsert: montar e serializar o corpo JSON da requisição, como o cliente
+  HTTP faz. "lista" = um qm.PointStruct por ponto; "numpy" = um qm.Batch
+  colunar. Nos dois a matriz vira floats Python (``tolist``, em C) antes
+  do pydantic, que valida e serializa cada elemento: passar o ndarray
+  direto ao qm.Batch é ~8x mais lento, porque o pydantic o percorre
+  elemento a elemento em Python.
+
+Uso:
+    python bench_vectors.py [--chunks 10000] [--dim 384] [--repeat 3]
+"""
+
+import argparse
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+from qdrant_client.http import models as qm
+
+
+def make_rows(n: int, dim: int):
+    rng = np.random.default_rng(0)
+    # fastembed devolve um ndarray float32 por texto
+    return list(rng.standard_normal((n, dim), dtype=np.float32))
+
+
+def embed_list(rows):
+    return [[float(x) for x in vec] for vec in rows]
+
+
+def embed_numpy(rows):
+    return np.ascontiguousarray(np.stack(rows), dtype=np.float32)
+
+
+def upsert_list(vectors, ids, payloads):
+    points = qm.PointsList(points=[
+        qm.PointStruct(id=id_, vector=vec, payload=payload)
+        for id_, vec, payload in zip(ids, vectors, payloads)
+    ])
+    return points.model_dump_json(exclude_unset=True, exclude_none=True)
+
+
+def upsert_numpy(mat, ids, payloads):
+    batch = qm.PointsBatch(
+        batch=qm.Batch(ids=ids, vectors=mat.tolist(), payloads=payloads)
+    )
+    return batch.model_dump_json(exclude_unset=True, exclude_none=True)
+
+
+def measure(fn, *args, repeat: int = 3):
+    """Melhor tempo em ``repeat`` execuções e bytes retidos/pico alocado."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    result = fn(*args)
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, held, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = make_rows(args.chunks, args.dim)
+    ids = [str(uuid.uuid4()) for _ in range(args.chunks)]
+    payloads = [{"path": "a.py", "text": "x"} for _ in range(args.chunks)]
+
+    mib = 2 ** 20
+    print(f"{args.chunks} chunks x {args.dim} dims")
+    print(
+        f"{'etapa':<7} {'caminho':<7} {'tempo (s)':>10} "
+        f"{'retido (MiB)':>13} {'pico (MiB)':>11}"
+    )
+    totals = {}
+    for name, embed, upsert in (
+        ("lista", embed_list, upsert_list),
+        ("numpy", embed_numpy, upsert_numpy),
+    ):
+        vectors = embed(rows)
+        e = measure(embed, rows, repeat=args.repeat)
+        u = measure(upsert, vectors, ids, payloads, repeat=args.repeat)
+        for stage, (secs, held, peak) in (("embed", e), ("upsert", u)):
+            print(
+                f"{stage:<7} {name:<7} {secs:>10.3f} "
+                f"{held / mib:>13.1f} {peak / mib:>11.1f}"
+            )
+        totals[name] = e, u
+    (e_old, u_old), (e_new, u_new) = totals["lista"], totals["numpy"]
+    # A conversão para floats Python muda de etapa (embed -> upsert), não
+    # some: o upsert numpy é mais lento e tem pico maior que o de listas
+    print(
+        f"upsert numpy vs lista: {u_new[0] - u_old[0]:+.3f} s, "
+        f"{(u_new[2] - u_old[2]) / mib:+.1f} MiB de pico"
+    )
+    print(
+        f"embed numpy vs lista: {e_new[0] - e_old[0]:+.3f} s, "
+        f"{(e_new[1] - e_old[1]) / mib:+.1f} MiB retidos entre embed e "
+        "upsert"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ Usa o servidor MCP diretamente para indexação eficiente.
 import os
 import sys
 import logging
+import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -55,13 +56,51 @@ def check_environment():
     return True
 
 
-def ingest_documents():
-    """Indexa todos os documentos do projeto."""
+def build_params(collection_name):
+    """Parâmetros de ingestão do projeto (usados pelo ingest e pelo --watch)."""
+    return {
+        'directory': str(project_root),
+        'include_globs': [
+            "**/*.py",
+            "**/*.md",
+            "**/*.txt",
+            "**/*.yaml",
+            "**/*.yml",
+            "**/*.json"
+        ],
+        'exclude_globs': [
+            "**/.git/**",
+            "**/.venv/**",
+            "**/node_modules/**",
+            "**/__pycache__/**",
+            "**/reports/**",
+            "**/export/**"
+        ],
+        'chunk_size': 800,
+        'overlap': 100,
+        'collection': collection_name,
+        # Respeita .gitignore/.ignore (dist/, target/, gerados...)
+        'respect_gitignore': os.getenv(
+            "INGEST_RESPECT_GITIGNORE", "true"
+        ).lower() in ("1", "true", "yes"),
+    }
+
+
+def ingest_documents(git_delta=False, revisions=None, bulk_load=False):
+    """Indexa todos os documentos do projeto.
+
+    Com ``git_delta``, reindexa só os arquivos alterados/apagados desde o
+    último commit indexado na coleção (``git diff --name-status``). Com
+    ``revisions``, indexa cada revisão git (branch/tag/SHA) direto do
+    repositório, sem checkout, em vez da árvore de trabalho. Com
+    ``bulk_load``, a indexação HNSW fica desligada durante todas as
+    revisões e é religada uma vez no fim.
+    """
     logger.info("📚 Iniciando indexação de documentos...")
     
     try:
         # Import do servidor MCP
-        from server import Embeddings, QdrantIndex, handle_ingest
+        from server import make_embeddings, QdrantIndex, handle_ingest
         from qdrant_client import QdrantClient
         
         # Obter configurações do .env
@@ -71,50 +110,56 @@ def ingest_documents():
         # Inicializar componentes
         logger.info("🔧 Inicializando componentes...")
         client = QdrantClient(url=qdrant_url)
-        embeddings = Embeddings()
+        embeddings = make_embeddings()
         index = QdrantIndex(client, collection_name)
         
         # Parâmetros de ingestão
-        params = {
-            'directory': str(project_root),
-            'include_globs': [
-                "**/*.py",
-                "**/*.md",
-                "**/*.txt",
-                "**/*.yaml",
-                "**/*.yml",
-                "**/*.json"
-            ],
-            'exclude_globs': [
-                "**/.git/**",
-                "**/.venv/**",
-                "**/node_modules/**",
-                "**/__pycache__/**",
-                "**/reports/**",
-                "**/export/**"
-            ],
-            'chunk_size': 800,
-            'overlap': 100,
-            'collection': collection_name
-        }
+        params = build_params(collection_name)
+        params['git_delta'] = git_delta
         
         logger.info(f"📁 Diretório: {params['directory']}")
         logger.info(f"📄 Padrões incluídos: {params['include_globs']}")
         logger.info(f"🚫 Padrões excluídos: {params['exclude_globs']}")
         logger.info(f"📏 Tamanho do chunk: {params['chunk_size']}")
         logger.info(f"🔗 Overlap: {params['overlap']}")
+        logger.info(f"🙈 Respeitar .gitignore: {params['respect_gitignore']}")
+        logger.info(f"🌿 Delta por commit git: {params['git_delta']}")
         
         # Executar ingestão
-        logger.info("🚀 Executando ingestão...")
-        result = handle_ingest(params, embeddings, index)
+        results = []
+        if bulk_load:
+            logger.info("🚚 Carga em massa: indexação HNSW desligada")
+            index.begin_bulk_load()
+        try:
+            for revision in revisions or [None]:
+                if revision:
+                    logger.info(
+                        f"🚀 Executando ingestão da revisão {revision}..."
+                    )
+                    results.append(handle_ingest(
+                        {**params, 'revision': revision}, embeddings, index
+                    ))
+                else:
+                    logger.info("🚀 Executando ingestão...")
+                    results.append(handle_ingest(params, embeddings, index))
+        finally:
+            if hasattr(embeddings, "close"):
+                embeddings.close()
+            if bulk_load:
+                threshold = index.end_bulk_load()
+                logger.info(
+                    f"🏗️ Indexação religada (indexing_threshold={threshold}"
+                    "); o Qdrant constrói o índice em segundo plano"
+                )
         
         # Exibir resultado
-        logger.info("📊 Resultado da indexação:")
-        if isinstance(result, dict):
-            for key, value in result.items():
-                logger.info(f"  {key}: {value}")
-        else:
-            logger.info(f"  {result}")
+        for result in results:
+            logger.info("📊 Resultado da indexação:")
+            if isinstance(result, dict):
+                for key, value in result.items():
+                    logger.info(f"  {key}: {value}")
+            else:
+                logger.info(f"  {result}")
         
         logger.info("✅ Indexação concluída com sucesso!")
         return True
@@ -130,6 +175,56 @@ def ingest_documents():
         return False
 
 
+def watch_documents():
+    """Mantém o índice em dia: reindexa só os arquivos alterados (inotify)."""
+    import threading
+
+    from server import (
+        make_embeddings, QdrantIndex, IngestManifest, DirectoryWatcher,
+        handle_ingest,
+    )
+    from qdrant_client import QdrantClient
+
+    qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
+    collection_name = os.getenv("QDRANT_COLLECTION", "project_docs")
+    client = QdrantClient(url=qdrant_url)
+    embeddings = make_embeddings()
+    index = QdrantIndex(client, collection_name)
+    manifest = IngestManifest(collection_name)
+    params = build_params(collection_name)
+
+    def on_change(paths):
+        if paths is None:
+            logger.info("🔄 Varredura completa (incremental)...")
+            result = handle_ingest(params, embeddings, index, manifest)
+        else:
+            logger.info(f"🔄 {len(paths)} caminho(s) alterado(s)")
+            result = handle_ingest(
+                {**params, 'paths': paths}, embeddings, index, manifest
+            )
+        logger.info(f"📊 {result}")
+
+    watcher = DirectoryWatcher(
+        params['directory'], on_change,
+        params['include_globs'], params['exclude_globs'],
+        respect_gitignore=params['respect_gitignore'],
+        debounce=float(os.getenv("WATCH_DEBOUNCE", "2")),
+        max_delay=float(os.getenv("WATCH_MAX_DELAY", "30")),
+        max_pending=int(os.getenv("WATCH_MAX_PENDING", "10000")),
+        poll_interval=float(os.getenv("WATCH_POLL_INTERVAL", "30")),
+    )
+    stop = threading.Event()
+    logger.info(f"👀 Observando {params['directory']} (Ctrl+C para sair)")
+    try:
+        watcher.run(stop)
+    except KeyboardInterrupt:
+        logger.info("🛑 Watch interrompido")
+    finally:
+        stop.set()
+        if hasattr(embeddings, "close"):
+            embeddings.close()
+
+
 def get_collection_stats():
     """Obtém estatísticas da coleção após indexação."""
     logger.info("📈 Obtendo estatísticas da coleção...")
@@ -157,6 +252,35 @@ def get_collection_stats():
 
 def main():
     """Função principal."""
+    parser = argparse.ArgumentParser(
+        description="Indexa os documentos do projeto no Qdrant"
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="após a indexação inicial, reindexa arquivos alterados "
+             "continuamente (inotify)",
+    )
+    parser.add_argument(
+        "--git-delta", action="store_true",
+        default=os.getenv("INGEST_GIT_DELTA", "false").lower()
+        in ("1", "true", "yes"),
+        help="reindexa só os arquivos do git diff desde o último commit "
+             "indexado na coleção (CI); sem commit anterior, indexa tudo",
+    )
+    parser.add_argument(
+        "--revision", action="append", metavar="REV",
+        help="indexa esta revisão git (branch, tag ou SHA) direto do "
+             "repositório, sem checkout; pode ser repetido",
+    )
+    parser.add_argument(
+        "--bulk-load", action="store_true",
+        default=os.getenv("INGEST_BULK_LOAD", "false").lower()
+        in ("1", "true", "yes"),
+        help="desliga a indexação HNSW durante a carga e a religa no fim "
+             "(primeira ingestão de um repositório grande)",
+    )
+    args = parser.parse_args()
+
     print("🎯 MCP Vector Project - Indexação de Documentos")
     print("=" * 50)
     
@@ -164,8 +288,15 @@ def main():
     if not check_environment():
         sys.exit(1)
     
+    if args.watch:
+        watch_documents()
+        return
+    
     # Executar indexação
-    if not ingest_documents():
+    if not ingest_documents(
+        git_delta=args.git_delta, revisions=args.revision,
+        bulk_load=args.bulk_load,
+    ):
         sys.exit(1)
     
     # Mostrar estatísticas
@@ -8,13 +8,29 @@ Variáveis de ambiente:
 - QDRANT_COLLECTION     (ex.: project_docs)
 - VECTOR_SIZE           (ex.: 384 para FastEmbed / MiniLM; 1536 para OpenAI text-embedding-3-small)
 - DISTANCE              (COSINE | DOT | EUCLID) — default: COSINE
+- QDRANT_QUANTIZATION   (none | scalar | binary) — default: none
+- QDRANT_QUANTIZATION_ALWAYS_RAM (true | false) — default: true
+- QDRANT_HNSW_M, QDRANT_HNSW_EF_CONSTRUCT (grafo HNSW; Qdrant: 16, 100)
+- QDRANT_ON_DISK, QDRANT_ON_DISK_PAYLOAD (vetores/payloads em disco, mmap)
+- QDRANT_INDEXING_THRESHOLD (KB por segmento antes do HNSW; 0 desliga)
+- QDRANT_DEFAULT_SEGMENT_NUMBER, QDRANT_MAX_SEGMENT_SIZE (otimizador)
 
 Uso:
 - Ajuste as variáveis de ambiente e execute este script.
 - Ele cria a coleção se não existir. Use `force_recreate=True` abaixo para recriar do zero.
+- Numa coleção existente, HNSW/armazenamento/otimizador diferentes dos
+  configurados são aplicados com update_collection (sem recriar).
+- Carga em massa: `--bulk-load` desliga a indexação (indexing_threshold=0)
+  antes de um primeiro ingest grande e `--bulk-load-done` a religa no fim
+  com o valor que a coleção tinha antes (guardado em INGEST_STATE_DIR;
+  sem ele, QDRANT_INDEXING_THRESHOLD ou o default do Qdrant). O ingest faz o mesmo sozinho com bulk_load / INGEST_BULK_LOAD.
 """
 
+import argparse
+import json
 import os
+from typing import Any, Dict, Optional
+
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 
@@ -25,8 +41,33 @@ def ensure_collection(
     vector_size: int,
     distance: str = "COSINE",
     force_recreate: bool = False,
+    quantization: Optional[str] = None,
+    hnsw_m: Optional[int] = None,
+    hnsw_ef_construct: Optional[int] = None,
+    on_disk: Optional[bool] = None,
+    on_disk_payload: Optional[bool] = None,
+    indexing_threshold: Optional[int] = None,
+    default_segment_number: Optional[int] = None,
+    max_segment_size: Optional[int] = None,
 ) -> None:
-    """Garante que a coleção exista com o tamanho e distância informados."""
+    """Garante que a coleção exista com o tamanho, distância, quantização
+    e layout (HNSW, armazenamento, otimizador) informados; o que não for
+    informado vem das variáveis QDRANT_* e, sem elas, do default do
+    Qdrant. Numa coleção existente, quantização e layout diferentes são
+    atualizados sem recriar (o Qdrant reindexa em segundo plano)."""
+    from server import (
+        collection_layout, collection_params, quantization_config,
+        quantization_name,
+    )
+
+    quant = quantization_config(quantization)
+    layout = collection_layout(
+        hnsw_m=hnsw_m, hnsw_ef_construct=hnsw_ef_construct,
+        on_disk=on_disk, on_disk_payload=on_disk_payload,
+        indexing_threshold=indexing_threshold,
+        default_segment_number=default_segment_number,
+        max_segment_size=max_segment_size,
+    )
     distance_enum = {
         "COSINE": qm.Distance.COSINE,
         "DOT": qm.Distance.DOT,
@@ -36,35 +77,169 @@ def ensure_collection(
     def create():
         client.create_collection(
             collection_name=collection_name,
-            vectors_config=qm.VectorParams(
-                size=vector_size,
-                distance=distance_enum,
-            ),
+            quantization_config=quant,
+            **collection_params(vector_size, distance_enum, layout),
         )
 
     try:
         info = client.get_collection(collection_name)
-        if force_recreate:
-            client.recreate_collection(
-                collection_name=collection_name,
-                vectors_config=qm.VectorParams(
-                    size=vector_size,
-                    distance=distance_enum,
-                ),
-            )
-            print(f"[ok] Coleção '{collection_name}' recriada.")
-        else:
-            # Já existe — apenas informa
-            print(f"[ok] Coleção '{collection_name}' já existe.")
-            # Opcional: você pode validar se o 'size' e 'distance' batem
-            # com o desejado e, se não, usar recreate_collection.
     except Exception:
         # Não existe — criar
         create()
         print(f"[ok] Coleção '{collection_name}' criada.")
+        return
+
+    if force_recreate:
+        client.recreate_collection(
+            collection_name=collection_name,
+            quantization_config=quant,
+            **collection_params(vector_size, distance_enum, layout),
+        )
+        print(f"[ok] Coleção '{collection_name}' recriada.")
+        return
+
+    # Já existe — apenas informa
+    print(f"[ok] Coleção '{collection_name}' já existe.")
+    # Opcional: você pode validar se o 'size' e 'distance' batem
+    # com o desejado e, se não, usar recreate_collection.
+    current = quantization_name(info.config.quantization_config)
+    # Compara a config inteira: mudar só always_ram/quantil também vale
+    if quantization is not None and info.config.quantization_config != quant:
+        # Troca a quantização sem reenviar os vetores
+        client.update_collection(
+            collection_name=collection_name,
+            quantization_config=quant or qm.Disabled.DISABLED,
+        )
+        print(f"[ok] Quantização: {current} → {quantization_name(quant)}.")
+    existing = current_layout(info)
+    changed = {
+        key: value for key, value in layout.items()
+        if existing.get(key) != value
+    }
+    if changed:
+        client.update_collection(
+            collection_name=collection_name, **layout_update(changed)
+        )
+        print(f"[ok] Layout atualizado: {changed}")
+
+
+def current_layout(info: Any) -> Dict[str, Any]:
+    """Layout (chaves de server.LAYOUT_ENV) de uma coleção existente."""
+    vectors = info.config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors.get("") or next(iter(vectors.values()), None)
+    hnsw = info.config.hnsw_config
+    optimizers = info.config.optimizer_config
+    return {
+        "hnsw_m": hnsw.m,
+        "hnsw_ef_construct": hnsw.ef_construct,
+        "on_disk": bool(getattr(vectors, "on_disk", None)),
+        "on_disk_payload": bool(info.config.params.on_disk_payload),
+        "indexing_threshold": optimizers.indexing_threshold,
+        "default_segment_number": optimizers.default_segment_number,
+        "max_segment_size": optimizers.max_segment_size,
+    }
+
+
+def layout_update(changed: Dict[str, Any]) -> Dict[str, Any]:
+    """``update_collection`` kwargs que aplicam ``changed``."""
+    from server import OPTIMIZER_FIELDS
+
+    update: Dict[str, Any] = {}
+    hnsw = {
+        key[len("hnsw_"):]: changed[key]
+        for key in ("hnsw_m", "hnsw_ef_construct") if key in changed
+    }
+    if hnsw:
+        update["hnsw_config"] = qm.HnswConfigDiff(**hnsw)
+    optimizers = {key: changed[key] for key in OPTIMIZER_FIELDS
+                  if key in changed}
+    if optimizers:
+        update["optimizers_config"] = qm.OptimizersConfigDiff(**optimizers)
+    if "on_disk" in changed:
+        # Vetor sem nome
+        update["vectors_config"] = {
+            "": qm.VectorParamsDiff(on_disk=changed["on_disk"])
+        }
+    if "on_disk_payload" in changed:
+        update["collection_params"] = qm.CollectionParamsDiff(
+            on_disk_payload=changed["on_disk_payload"]
+        )
+    return update
+
+
+def bulk_load_state_path(
+    collection_name: str, state_dir: Optional[str] = None
+) -> str:
+    """Arquivo (em INGEST_STATE_DIR, ao lado do manifest da coleção) com o
+    indexing_threshold de antes do ``--bulk-load``. Fica fora do manifest
+    porque o servidor regrava o manifest inteiro a cada ingest."""
+    from server import default_state_dir
+
+    safe_name = "".join(
+        c if c.isalnum() or c in "-_." else "_" for c in collection_name
+    )
+    return os.path.join(
+        state_dir or default_state_dir(), f"{safe_name}.bulk_load.json"
+    )
+
+
+def bulk_load_threshold(
+    client: QdrantClient, collection_name: str, done: bool,
+    state_dir: Optional[str] = None,
+) -> int:
+    """indexing_threshold para ``--bulk-load`` (0) ou ``--bulk-load-done``.
+
+    ``--bulk-load`` guarda o valor que a coleção tinha (inclusive 0, se a
+    indexação já estava desligada de propósito); ``--bulk-load-done``
+    devolve esse valor e apaga o registro. Sem valor guardado (coleção
+    nova, registro apagado) vale QDRANT_INDEXING_THRESHOLD ou o default do
+    Qdrant."""
+    from server import DEFAULT_INDEXING_THRESHOLD, collection_layout
+
+    path = bulk_load_state_path(collection_name, state_dir)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f).get("indexing_threshold")
+    except (OSError, ValueError):
+        saved = None
+    if done:
+        if saved is None:
+            saved = collection_layout().get("indexing_threshold")
+        if os.path.exists(path):
+            os.remove(path)
+        return DEFAULT_INDEXING_THRESHOLD if saved is None else saved
+    # --bulk-load repetido: não troca o valor guardado pelo 0 da carga
+    if saved is None:
+        try:
+            info = client.get_collection(collection_name)
+        except Exception:
+            info = None
+        if info is not None:
+            saved = current_layout(info)["indexing_threshold"]
+        if saved is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"indexing_threshold": saved}, f)
+    return 0
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Cria (ou atualiza) a coleção do Qdrant"
+    )
+    bulk = parser.add_mutually_exclusive_group()
+    bulk.add_argument(
+        "--bulk-load", action="store_true",
+        help="desliga a indexação HNSW para uma carga inicial grande",
+    )
+    bulk.add_argument(
+        "--bulk-load-done", action="store_true",
+        help="religa a indexação depois da carga (o Qdrant indexa em "
+             "segundo plano)",
+    )
+    args = parser.parse_args()
+
     qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
     qdrant_key = os.getenv("QDRANT_API_KEY")
     collection = os.getenv("QDRANT_COLLECTION", "project_docs")
@@ -82,6 +257,12 @@ def main():
     else:
         client = QdrantClient(url=qdrant_url, api_key=qdrant_key)
 
+    indexing_threshold = None
+    if args.bulk_load or args.bulk_load_done:
+        indexing_threshold = bulk_load_threshold(
+            client, collection, done=args.bulk_load_done
+        )
+
     # force_recreate=False cria apenas se não existir; troque para True se quiser recriar do zero
     ensure_collection(
         client=client,
@@ -89,6 +270,8 @@ def main():
         vector_size=vector_size,
         distance=distance,
         force_recreate=False,
+        quantization=os.getenv("QDRANT_QUANTIZATION"),
+        indexing_threshold=indexing_threshold,
     )
 
     # (Opcional) Mostra status da coleção
@@ -1,14 +1,49 @@
+import io
 import os
+import ast
+import re
 import sys
 import json
+import mmap
+import codecs
 import uuid
+import time
+import queue
+import random
+import tarfile
+import zipfile
+import hashlib
+import zlib
 import logging
-from typing import List, Dict, Any, Optional, Iterable
+import select
+import sqlite3
+import struct
+import array
+import subprocess
+import functools
+import threading
+import ctypes
+import ctypes.util
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+)
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import (
+    List, Dict, Any, Optional, Iterable, Iterator, Callable, Set, Tuple
+)
 
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 from dotenv import load_dotenv
 
+try:
+    import numpy as np
+except ImportError:  # opcional: vem junto com fastembed/sentence-transformers
+    np = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,6 +64,7 @@ class Embeddings:
         self.model_name = os.getenv("MODEL_NAME", "all-MiniLM-L6-v2")
         self._model = None
         self._fe_model = None
+        self._tokenizer: Optional[ChunkTokenizer] = None
 
         if self.provider == "openai":
             try:
@@ -69,6 +105,7 @@ class Embeddings:
             if fe_model == "all-MiniLM-L6-v2":
                 # Ajuste para um modelo padrão compatível com fastembed
                 fe_model = "BAAI/bge-small-en-v1.5"
+            self._fe_name = fe_model
             self._fe_model = TextEmbedding(model_name=fe_model)
         else:
             raise ValueError(
@@ -76,13 +113,34 @@ class Embeddings:
                 "'fastembed' ou 'openai'."
             )
 
-    def embed(self, texts: List[str]) -> List[List[float]]:
+    def embed(self, texts: List[str], as_numpy: bool = False) -> Any:
+        """Embed texts as lists of floats.
+
+        With ``as_numpy`` the result is a single C-contiguous float32 matrix
+        (n, dim) instead, with no per-element Python conversion.
+        """
+        if as_numpy and np is None:
+            raise ImportError(
+                "as_numpy requer numpy. Instale com: pip install numpy"
+            )
         if self.provider == "openai":
             resp = self._client.embeddings.create(
                 model=self.openai_model, input=texts
             )
-            return [d.embedding for d in resp.data]
+            vectors = [d.embedding for d in resp.data]
+            if as_numpy:
+                return np.asarray(vectors, dtype=np.float32)
+            return vectors
         elif self.provider == "sentence-transformers":
+            if as_numpy:
+                vecs = self._model.encode(
+                    texts,
+                    batch_size=32,
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                    normalize_embeddings=True,
+                )
+                return np.ascontiguousarray(vecs, dtype=np.float32)
             # Evita dependência de numpy: retorna listas de floats nativos
             vecs = self._model.encode(
                 texts,
@@ -93,121 +151,2899 @@ class Embeddings:
             )
             return [list(map(float, v)) for v in vecs]
         else:  # fastembed
+            if as_numpy:
+                rows = list(self._fe_model.embed(texts))
+                if not rows:
+                    return np.empty((0, 0), dtype=np.float32)
+                return np.ascontiguousarray(np.stack(rows), dtype=np.float32)
             # fastembed: converte gerador em lista de listas de float
             vectors: List[List[float]] = []
             for vec in self._fe_model.embed(texts):
                 vectors.append([float(x) for x in vec])
             return vectors
 
+    def tokenizer(self) -> Optional["ChunkTokenizer"]:
+        """The model's own tokenizer, for token-aware chunking.
+
+        None when it isn't reachable (slow tokenizer, tiktoken missing...).
+        """
+        if self._tokenizer is None:
+            self._tokenizer = self._load_tokenizer()
+        return self._tokenizer
+
+    def _load_tokenizer(self) -> Optional["ChunkTokenizer"]:
+        if self.provider == "sentence-transformers":
+            tok = getattr(self._model, "tokenizer", None)
+            if tok is None or not getattr(tok, "is_fast", False):
+                return None
+            return ChunkTokenizer.from_transformers(
+                self.model_name, tok,
+                self._model.max_seq_length - tok.num_special_tokens_to_add(),
+            )
+        if self.provider == "fastembed":
+            tok = getattr(
+                getattr(self._fe_model, "model", None), "tokenizer", None
+            )
+            if tok is None:
+                return None
+            return ChunkTokenizer.from_tokenizers(self._fe_name, tok)
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning(
+                "Chunking por tokens com openai requer tiktoken: "
+                "pip install tiktoken"
+            )
+            return None
+        try:
+            enc = tiktoken.encoding_for_model(self.openai_model)
+        except KeyError:
+            enc = tiktoken.get_encoding("cl100k_base")
+        return ChunkTokenizer.from_tiktoken(
+            self.openai_model, enc,
+            int(os.getenv("OPENAI_EMBEDDING_MAX_TOKENS", "8191")),
+        )
+
+
+def _embeddings_worker(tasks: Any, results: Any) -> None:
+    """Worker process: holds its own model and embeds task batches.
+
+    Vectors go back through a SharedMemory block of float32 (only its name
+    and shape are pickled); the parent copies and unlinks it.
+    """
+    try:
+        emb = Embeddings()
+    except Exception as e:
+        results.put(("init", None, repr(e)))
+        return
+    results.put(("init", (emb.provider, emb.model_name), None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, texts = task
+        try:
+            mat = emb.embed(texts, as_numpy=True)
+            shm = SharedMemory(create=True, size=max(1, mat.nbytes))
+            view = np.ndarray(mat.shape, dtype=np.float32, buffer=shm.buf)
+            view[:] = mat
+            del view
+            # O processo pai passa a ser o dono do bloco (ele faz o unlink)
+            resource_tracker.unregister(shm._name, "shared_memory")
+            shm.close()
+            results.put((task_id, (shm.name, mat.shape), None))
+        except Exception as e:
+            results.put((task_id, None, repr(e)))
+
+
+class EmbeddingsPool:
+    """EMBEDDINGS_WORKERS=N: N processes, each with its own local model.
+
+    Drop-in for Embeddings: embed() splits the texts across the workers and
+    returns the vectors in input order. Safe to call from several threads.
+    Queries (``embed_query``) skip the workers' FIFO and run on a model in
+    this process, so they don't wait behind the batches of an ingest.
+    """
+
+    MIN_SLICE = 16
+
+    def __init__(self, workers: int):
+        ctx = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._futures: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._local: Optional[Embeddings] = None
+        self._local_lock = threading.Lock()
+        self._procs = [
+            ctx.Process(
+                target=_embeddings_worker,
+                args=(self._tasks, self._results),
+                name=f"embeddings-{n}", daemon=True,
+            )
+            for n in range(workers)
+        ]
+        for p in self._procs:
+            p.start()
+        for _ in self._procs:
+            _, info, err = self._results.get()
+            if err:
+                self.close()
+                raise RuntimeError(
+                    f"Falha ao iniciar worker de embeddings: {err}"
+                )
+            self.provider, self.model_name = info
+        self._reader = threading.Thread(
+            target=self._read_results, name="embeddings-results", daemon=True
+        )
+        self._reader.start()
+        logger.info(f"Embeddings pool ready ({workers} processes)")
+
+    def _read_results(self) -> None:
+        while True:
+            try:
+                msg = self._results.get()
+            except (OSError, EOFError):
+                break
+            if msg is None:
+                break
+            task_id, info, err = msg
+            with self._lock:
+                fut = self._futures.pop(task_id, None)
+            if fut is None:
+                continue
+            if err:
+                fut.set_exception(RuntimeError(err))
+                continue
+            name, shape = info
+            shm = SharedMemory(name=name)
+            try:
+                view = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                mat = view.copy()
+                del view
+            finally:
+                shm.close()
+                shm.unlink()
+            fut.set_result(mat)
+
+    def _submit(self, texts: List[str]) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            task_id = self._next_id
+            self._next_id += 1
+            self._futures[task_id] = fut
+        self._tasks.put((task_id, texts))
+        return fut
+
+    def _wait(self, fut: Future) -> Any:
+        while True:
+            try:
+                return fut.result(timeout=1.0)
+            except FutureTimeout:
+                if not all(p.is_alive() for p in self._procs):
+                    raise RuntimeError("Worker de embeddings encerrou")
+
+    def embed(self, texts: List[str], as_numpy: bool = False) -> Any:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32) if as_numpy else []
+        step = max(self.MIN_SLICE, -(-len(texts) // self.workers))
+        futs = [
+            self._submit(texts[i:i + step])
+            for i in range(0, len(texts), step)
+        ]
+        mat = np.concatenate([self._wait(fut) for fut in futs])
+        return mat if as_numpy else mat.tolist()
+
+    def _local_model(self) -> Embeddings:
+        # Os modelos vivem nos workers: carrega um local (uma vez) para
+        # tokenizar e para as queries
+        with self._local_lock:
+            if self._local is None:
+                self._local = Embeddings()
+            return self._local
+
+    def embed_query(self, text: str) -> List[float]:
+        """One query vector, computed in this process: never queued behind
+        the ingest batches the workers are busy with."""
+        return self._local_model().embed([text])[0]
+
+    def tokenizer(self) -> Optional["ChunkTokenizer"]:
+        return self._local_model().tokenizer()
+
+    def close(self) -> None:
+        for p in self._procs:
+            if p.is_alive():
+                self._tasks.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+        self._results.put(None)
+        if getattr(self, "_reader", None) is not None:
+            self._reader.join(timeout=5)
+
+
+def embed_query(embeddings: Any, text: str) -> List[float]:
+    """Vector of one query; uses ``embeddings.embed_query`` when there is
+    one (EmbeddingsPool: ahead of the ingest batches)."""
+    embed = getattr(embeddings, "embed_query", None)
+    if embed is not None:
+        return embed(text)
+    return embeddings.embed([text])[0]
+
+
+def make_embeddings() -> Any:
+    """Embeddings, or an EmbeddingsPool when EMBEDDINGS_WORKERS > 1."""
+    load_dotenv()
+    workers = int(os.getenv("EMBEDDINGS_WORKERS", "1"))
+    provider = os.getenv("EMBEDDINGS_PROVIDER", "fastembed").lower()
+    if workers > 1 and provider != "openai" and np is not None:
+        return EmbeddingsPool(workers)
+    if workers > 1:
+        logger.warning("EMBEDDINGS_WORKERS ignorado para o provider openai")
+    return Embeddings()
+
 
 # -------------------- Chunking --------------------
-def chunk_text(
+# Arquivos a partir deste tamanho são lidos em streaming via mmap
+MMAP_MIN_SIZE = 1 << 20
+# Janela de bytes decodificada por vez no streaming
+MMAP_WINDOW = 1 << 20
+# Bytes inspecionados para detectar conteúdo binário
+SNIFF_SIZE = 8192
+
+
+def iter_chunks(
     text: str, chunk_size: int = 800, overlap: int = 100
-) -> List[str]:
+) -> Iterator[Tuple[int, str]]:
+    """Fixed windows of ``chunk_size`` chars as (char offset, chunk)."""
     if chunk_size <= 0:
-        return [text]
-    chunks: List[str] = []
+        yield 0, text
+        return
     i = 0
     n = len(text)
     while i < n:
-        chunk = text[i:i + chunk_size]
-        chunks.append(chunk)
+        yield i, text[i:i + chunk_size]
         if i + chunk_size >= n:
             break
         i += max(1, chunk_size - overlap)
-    return chunks
 
 
-# -------------------- File traversal --------------------
-def match_globs(path: str, patterns: List[str]) -> bool:
-    import fnmatch
-    return any(fnmatch.fnmatch(path, pat) for pat in patterns)
+def chunk_text(
+    text: str, chunk_size: int = 800, overlap: int = 100
+) -> List[str]:
+    if chunk_size <= 0:
+        return [text]
+    return [chunk for _, chunk in iter_chunks(text, chunk_size, overlap)]
+
+
+def iter_chunks_stream(
+    pieces: Iterable[str], chunk_size: int = 800, overlap: int = 100
+) -> Iterator[Tuple[int, str]]:
+    """Same output as ``iter_chunks("".join(pieces))``, holding only about
+    one piece plus one chunk of text at a time."""
+    if chunk_size <= 0:
+        yield 0, "".join(pieces)
+        return
+    step = max(1, chunk_size - overlap)
+    it = iter(pieces)
+    buf, base, i = "", 0, 0  # buf == text[base:base + len(buf)]
+    exhausted = False
+    while True:
+        # Precisa de um caractere além do chunk para saber se é o último
+        while not exhausted and base + len(buf) <= i + chunk_size:
+            piece = next(it, None)
+            if piece is None:
+                exhausted = True
+            else:
+                buf += piece
+        n = base + len(buf)
+        if i >= n:
+            return
+        yield i, buf[i - base:i - base + chunk_size]
+        if exhausted and i + chunk_size >= n:
+            return
+        i += step
+        # Descarta o texto já consumido sem recopiar o buffer a cada chunk
+        if i - base > len(buf) // 2:
+            buf, base = buf[i - base:], i
+
+
+# Extensão → chunker(text, chunk_size, overlap) -> (offset, chunk)
+CHUNKERS: Dict[str, Callable[[str, int, int], Iterable[Tuple[int, str]]]] = {}
+
+
+def register_chunker(*exts: str) -> Callable[[Any], Any]:
+    """Register a syntax-aware chunker for the given file extensions."""
+    def deco(fn: Any) -> Any:
+        for ext in exts:
+            CHUNKERS[ext.lower()] = fn
+        return fn
+    return deco
+
+
+def pack_units(
+    text: str, bounds: Iterable[int], chunk_size: int, overlap: int = 0
+) -> Iterator[Tuple[int, str]]:
+    """Greedily fill chunks of up to ``chunk_size`` chars with consecutive
+    units ``text[b_i:b_i+1]``.
+
+    A chunk closes at a unit boundary once it holds at least a window
+    step (``chunk_size - overlap``, or 7/8 of it without overlap), so it
+    never adds fewer new chars than a fixed window would; a chunk still
+    below that is topped up with whole lines of the next unit, whose
+    remainder opens the next chunk. Only a line longer than ``chunk_size``
+    is cut into fixed windows (with ``overlap``). Whitespace-only chunks
+    are dropped.
+    """
+    n = len(text)
+    edges = sorted({b for b in bounds if 0 < b < n} | {n})
+    floor = chunk_size - max(overlap, chunk_size // 8)
+    start = end = 0  # chunk aberto text[start:end], end numa fronteira
+    for b in edges:
+        while b - start > chunk_size:
+            limit = start + chunk_size
+            if end > start and end - start >= floor:
+                cut = nxt = end
+            else:
+                cut = text.rfind("\n", max(start, end), limit) + 1
+                if cut > start:
+                    nxt = cut
+                elif end > start:
+                    cut = nxt = end
+                else:
+                    # Uma linha maior que o chunk: janelas fixas
+                    cut, nxt = limit, max(start + 1, limit - overlap)
+            if text[start:cut].strip():
+                yield start, text[start:cut]
+            start = end = nxt
+        end = b
+    if end > start and text[start:end].strip():
+        yield start, text[start:end]
+
+
+def iter_syntax_chunks(
+    rel: str, text: str, chunk_size: int = 800, overlap: int = 100
+) -> Iterator[Tuple[int, str]]:
+    """Chunks cut at syntactic boundaries by the chunker registered for
+    the file's extension; fixed windows for everything else."""
+    chunker = CHUNKERS.get(os.path.splitext(rel)[1].lower())
+    if chunker is None or chunk_size <= 0:
+        return iter_chunks(text, chunk_size, overlap)
+    return iter(chunker(text, chunk_size, overlap))
+
+
+def _line_offsets(text: str) -> List[int]:
+    return [0] + [m.end() for m in re.finditer("\n", text)]
+
+
+@register_chunker(".py", ".pyi")
+def chunk_python(
+    text: str, chunk_size: int, overlap: int
+) -> Iterable[Tuple[int, str]]:
+    """Top-level statements, functions and classes (with their decorators
+    and the comments right above them) are the units; the body of one
+    that doesn't fit in a chunk is split at its own statements."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return iter_chunks(text, chunk_size, overlap)
+    lines = text.splitlines(keepends=True)
+    offsets = _line_offsets(text)
+
+    def line_start(lineno: int) -> int:
+        return offsets[lineno - 1] if lineno <= len(offsets) else len(text)
+
+    bounds: List[int] = []
+
+    def visit(body: List[Any]) -> None:
+        for node in body:
+            first = min(
+                [node.lineno]
+                + [d.lineno for d in getattr(node, "decorator_list", [])]
+            )
+            while first > 1 and lines[first - 2].lstrip().startswith("#"):
+                first -= 1
+            begin = line_start(first)
+            bounds.append(begin)
+            if line_start(node.end_lineno + 1) - begin > chunk_size:
+                for field in ("body", "handlers", "orelse", "finalbody"):
+                    visit(getattr(node, field, None) or [])
+
+    visit(tree.body)
+    return pack_units(text, bounds, chunk_size, overlap)
+
+
+_MD_FENCE = re.compile(r"^\s{0,3}(```|~~~)")
+_MD_HEADING = re.compile(r"^\s{0,3}#{1,6}(\s|$)")
+
+
+@register_chunker(".md", ".markdown")
+def chunk_markdown(
+    text: str, chunk_size: int, overlap: int
+) -> Iterable[Tuple[int, str]]:
+    """Sections start at ATX headings (outside code fences); a section
+    that doesn't fit in a chunk is split at its paragraphs."""
+    offsets = _line_offsets(text)
+    lines = text.splitlines(keepends=True)
+    headings: List[int] = []
+    paragraphs: List[int] = []
+    fenced = False
+    for i, line in enumerate(lines):
+        if _MD_FENCE.match(line):
+            fenced = not fenced
+            if fenced and i and not lines[i - 1].strip():
+                paragraphs.append(offsets[i])
+            continue
+        if fenced:
+            continue
+        if _MD_HEADING.match(line):
+            headings.append(offsets[i])
+        elif line.strip() and i and not lines[i - 1].strip():
+            paragraphs.append(offsets[i])
+    sections = [0] + headings + [len(text)]
+    bounds = list(headings)
+    p = 0
+    for begin, end in zip(sections, sections[1:]):
+        while p < len(paragraphs) and paragraphs[p] <= begin:
+            p += 1
+        if end - begin > chunk_size:
+            while p < len(paragraphs) and paragraphs[p] < end:
+                bounds.append(paragraphs[p])
+                p += 1
+    return pack_units(text, bounds, chunk_size, overlap)
+
+
+@register_chunker(".json", ".yaml", ".yml")
+def chunk_document(
+    text: str, chunk_size: int, overlap: int
+) -> Iterable[Tuple[int, str]]:
+    """Small config/data files stay whole: up to 2x chunk_size, one
+    chunk reads better than two overlapping halves."""
+    if len(text) <= 2 * chunk_size:
+        return [(0, text)] if text.strip() else []
+    return iter_chunks(text, chunk_size, overlap)
+
+
+# Caracteres por entrada do tokenizer e entradas por chamada em lote
+TOKEN_SEGMENT = 8192
+TOKEN_BATCH = 64
+
+
+class ChunkTokenizer:
+    """Token start offsets (in chars) from an embedding model's tokenizer.
+
+    ``max_tokens`` is the model window minus the special tokens the model
+    adds: the most a chunk can hold without being truncated. Calls are
+    serialized (the transformers wrapper isn't safe to share across
+    threads).
+    """
+
+    def __init__(
+        self, name: str, max_tokens: int,
+        starts: Callable[[List[str]], List[List[int]]],
+    ):
+        self.name = name
+        self.max_tokens = max(1, int(max_tokens))
+        self._starts = starts
+        self._lock = threading.Lock()
+
+    def starts(self, segments: List[str]) -> List[List[int]]:
+        """One batched call: token start offsets of each segment."""
+        with self._lock:
+            return self._starts(segments)
+
+    @classmethod
+    def from_tokenizers(cls, name: str, tok: Any) -> "ChunkTokenizer":
+        """A ``tokenizers.Tokenizer`` (fastembed); its truncation length is
+        the model window."""
+        max_len = (tok.truncation or {}).get("max_length", 512)
+        # Cópia sem truncamento/padding: o do modelo corta em max_len
+        tok = type(tok).from_str(tok.to_str())
+        tok.no_truncation()
+        tok.no_padding()
+        specials = len(tok.encode("", add_special_tokens=True).ids)
+
+        def starts(segments: List[str]) -> List[List[int]]:
+            encs = tok.encode_batch(segments, add_special_tokens=False)
+            return [[a for a, _ in enc.offsets] for enc in encs]
+
+        return cls(name, max_len - specials, starts)
+
+    @classmethod
+    def from_transformers(
+        cls, name: str, tok: Any, max_tokens: int
+    ) -> "ChunkTokenizer":
+        """A transformers fast tokenizer (sentence-transformers)."""
+        def starts(segments: List[str]) -> List[List[int]]:
+            out = tok(
+                segments, add_special_tokens=False, truncation=False,
+                return_offsets_mapping=True, return_attention_mask=False,
+                verbose=False,
+            )
+            return [[a for a, _ in offs] for offs in out["offset_mapping"]]
+
+        return cls(name, max_tokens, starts)
+
+    @classmethod
+    def from_tiktoken(
+        cls, name: str, enc: Any, max_tokens: int
+    ) -> "ChunkTokenizer":
+        """A tiktoken encoding (OpenAI models, no special tokens)."""
+        def starts(segments: List[str]) -> List[List[int]]:
+            batch = enc.encode_batch(segments, disallowed_special=())
+            return [enc.decode_with_offsets(ids)[1] for ids in batch]
+
+        return cls(name, max_tokens, starts)
+
+
+def _segments(pieces: Iterable[str], size: int) -> Iterator[str]:
+    """Re-cut text pieces into ~``size`` chars, after a newline if any."""
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        pos = 0
+        while len(buf) - pos >= size:
+            cut = buf.rfind("\n", pos + size // 2, pos + size)
+            cut = cut + 1 if cut >= 0 else pos + size
+            yield buf[pos:cut]
+            pos = cut
+        buf = buf[pos:]
+    if buf:
+        yield buf
+
+
+def iter_token_chunks(
+    pieces: Iterable[str], tokenizer: ChunkTokenizer,
+    max_tokens: int = 0, overlap: int = 0,
+) -> Iterator[Tuple[int, str]]:
+    """Chunks of ``max_tokens`` model tokens as (char offset, chunk).
+
+    A chunk runs from its first token to the start of the token after its
+    last one, so the whitespace in between is kept and, without overlap,
+    chunks tile the text exactly. Windows are closed (and, with overlap,
+    reopened) at word starts when one is near, so that a chunk tokenized
+    on its own doesn't come out longer than the window. The text is
+    tokenized in batches of segments (TOKEN_BATCH x TOKEN_SEGMENT chars)
+    and only the tokens not yet emitted are held, so ``pieces`` may stream
+    a large file. ``max_tokens`` defaults to the model window.
+    """
+    max_tokens = max_tokens or tokenizer.max_tokens
+    overlap = min(max(0, overlap), max_tokens - 1)
+    reach = max(1, max_tokens // 8)
+    text, base, pos = "", 0, 0  # text == full[base:pos]
+    starts: List[int] = []  # tokens a partir de starts[k] ainda não saíram
+    k = 0
+    first = True
+    tail = 0  # offset do primeiro token ainda não coberto
+
+    def word_start(j: int) -> bool:
+        c = starts[j] - base
+        return c <= 0 or text[c].isspace() or text[c - 1].isspace()
+
+    def back_to_word(j: int, floor: int) -> int:
+        for i in range(j, max(floor, j - reach), -1):
+            if word_start(i):
+                return i
+        return j
+    batch: List[Tuple[int, str]] = []
+    segments = _segments(pieces, TOKEN_SEGMENT)
+    while True:
+        seg = next(segments, None)
+        if seg is not None:
+            batch.append((pos, seg))
+            text += seg
+            pos += len(seg)
+            if len(batch) < TOKEN_BATCH:
+                continue
+        for (off, _), offs in zip(
+            batch, tokenizer.starts([s for _, s in batch]) if batch else []
+        ):
+            starts.extend(off + a for a in offs)
+        batch = []
+        # Uma janela só fecha quando o token seguinte já é conhecido
+        while len(starts) - k > max_tokens:
+            end = back_to_word(k + max_tokens, k)
+            begin = 0 if first else starts[k]
+            yield begin, text[begin - base:starts[end] - base]
+            first = False
+            tail = starts[end]
+            nxt = end
+            if overlap:
+                nxt = back_to_word(max(k + 1, end - overlap), k)
+            k = nxt
+            if k > len(starts) // 2:
+                starts, k = starts[k:], 0
+            if starts[k] - base > len(text) // 2:
+                text, base = text[starts[k] - base:], starts[k]
+        if seg is None:
+            break
+    # Resto: tokens ainda não cobertos por uma janela, até o fim do texto
+    if starts and (first or starts[-1] >= tail):
+        begin = 0 if first else starts[k]
+        yield begin, text[begin - base:]
+
+
+def looks_binary(head: bytes) -> bool:
+    """NUL byte in the first bytes: images, archives, compiled files..."""
+    return b"\0" in head
+
+
+def _text_decoder() -> Any:
+    # Mesma semântica do open(..., "r", errors="ignore"): \r\n e \r viram \n
+    return io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder("utf-8")(errors="ignore"),
+        translate=True,
+    )
+
+
+def decode_text(data: bytes) -> str:
+    return _text_decoder().decode(data, final=True)
+
+
+def iter_file_text(path: str, window: int = MMAP_WINDOW) -> Iterator[str]:
+    """Decoded text of a file in pieces, reading it through mmap.
+
+    Only one ``window`` of bytes is copied out of the mapping at a time
+    and pages already read are released, so memory doesn't grow with the
+    file size. The file must not be
+    truncated while it is being read (SIGBUS on the mapping).
+    """
+    decoder = _text_decoder()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            for pos in range(0, len(mm), window):
+                data = mm[pos:pos + window]
+                if hasattr(mm, "madvise"):
+                    # Páginas já copiadas saem do RSS (seguem no page cache)
+                    mm.madvise(mmap.MADV_DONTNEED, pos, len(data))
+                yield decoder.decode(data)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_stream_text(
+    f: Any, head: bytes = b"", window: int = MMAP_WINDOW
+) -> Iterator[str]:
+    """Decoded text of a binary file object (archive member, git blob) in
+    pieces, read ``window`` bytes at a time; ``head`` is what was already
+    read from it."""
+    decoder = _text_decoder()
+    data = head
+    while data:
+        piece = decoder.decode(data)
+        if piece:
+            yield piece
+        data = f.read(window)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+# -------------------- File traversal --------------------
+# Diretórios pesados nunca percorridos, independente dos globs
+SKIP_DIRS = frozenset({
+    ".git",
+    ".hg",
+    ".svn",
+    "node_modules",
+    ".venv",
+    "venv",
+    "__pycache__",
+})
+
+
+def glob_to_regex(pat: str) -> str:
+    """Translate a glob to a regex (fnmatch semantics, '/'-separated).
+
+    As in fnmatch, ``*`` also crosses ``/``; in addition ``**/`` matches
+    zero or more directories, so ``**/*.md`` matches ``README.md`` too.
+    """
+    i, n, out = 0, len(pat), []
+    while i < n:
+        c = pat[i]
+        if pat.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if c == "*":
+            while i < n and pat[i] == "*":
+                i += 1
+            out.append(".*")
+            continue
+        if c == "?":
+            out.append(".")
+        elif c == "[":
+            j = i + 1
+            if j < n and pat[j] == "!":
+                j += 1
+            if j < n and pat[j] == "]":
+                j += 1
+            j = pat.find("]", j)
+            if j < 0:
+                out.append("\\[")
+            else:
+                stuff = pat[i + 1:j].replace("\\", "\\\\")
+                if stuff.startswith("!"):
+                    stuff = "^" + stuff[1:]
+                elif stuff.startswith("^"):
+                    stuff = "\\" + stuff
+                out.append(f"[{stuff}]")
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_globs(patterns: Tuple[str, ...]) -> Optional["re.Pattern[str]"]:
+    """All patterns as one alternation regex (None if there are none)."""
+    if not patterns:
+        return None
+    return re.compile(
+        "|".join(f"(?:{glob_to_regex(p)})" for p in patterns), re.DOTALL
+    )
+
+
+def match_globs(path: str, patterns: List[str]) -> bool:
+    rx = compile_globs(tuple(patterns))
+    return rx is not None and rx.fullmatch(path) is not None
+
+
+class GlobMatcher:
+    """Include/exclude globs compiled once, plus directory pruning.
+
+    A directory is pruned when an exclude pattern ending in ``*`` matches
+    ``dir/``: the trailing ``*`` then matches everything below it, so no
+    file inside could be included anyway.
+    """
+
+    def __init__(self, include_globs: List[str], exclude_globs: List[str]):
+        self._include = compile_globs(tuple(include_globs or ()))
+        self._exclude = compile_globs(tuple(exclude_globs or ()))
+        self._prune = compile_globs(
+            tuple(p for p in exclude_globs or () if p.endswith("*"))
+        )
+
+    def match_file(self, rel: str) -> bool:
+        if self._include is not None and not self._include.fullmatch(rel):
+            return False
+        return self._exclude is None or not self._exclude.fullmatch(rel)
+
+    def prune_dir(self, rel_dir: str) -> bool:
+        return self._prune is not None and bool(
+            self._prune.fullmatch(rel_dir + "/")
+        )
+
+
+def gitignore_to_regex(pat: str) -> str:
+    """Translate one gitignore pattern (already stripped of '!' and a
+    trailing '/') to a regex over paths relative to the ignore file."""
+    anchored = "/" in pat
+    pat = pat.lstrip("/")
+    i, n, out = 0, len(pat), []
+    while i < n:
+        c = pat[i]
+        if pat.startswith("**/", i) and (i == 0 or pat[i - 1] == "/"):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pat.startswith("**", i) and i + 2 == n and (
+            i == 0 or pat[i - 1] == "/"
+        ):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pat[i]))
+        elif c == "[":
+            j = pat.find("]", i + 2)
+            if j < 0:
+                out.append("\\[")
+            else:
+                stuff = pat[i + 1:j].replace("\\", "\\\\")
+                if stuff.startswith("!"):
+                    stuff = "^" + stuff[1:]
+                out.append(f"[{stuff}]")
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    body = "".join(out)
+    return body if anchored else f"(?:.*/)?{body}"
+
+
+class IgnoreRules:
+    """Patterns of one .gitignore/.ignore file (last match wins)."""
+
+    FILES = (".gitignore", ".ignore")
+
+    def __init__(self, lines: Iterable[str]):
+        self.rules: List[Tuple["re.Pattern[str]", bool, bool]] = []
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.endswith("\\ "):
+                line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            self.rules.append(
+                (re.compile(gitignore_to_regex(line)), negate, dir_only)
+            )
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["IgnoreRules"]:
+        lines: List[str] = []
+        for name in cls.FILES:
+            try:
+                with open(
+                    os.path.join(directory, name), "r",
+                    encoding="utf-8", errors="ignore",
+                ) as f:
+                    lines.extend(f)
+            except OSError:
+                continue
+        rules = cls(lines)
+        return rules if rules.rules else None
+
+    def match(self, rel: str, is_dir: bool) -> Optional[bool]:
+        """True = ignored, False = re-included ('!'), None = no match."""
+        result = None
+        for rx, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if rx.fullmatch(rel):
+                result = not negate
+        return result
+
+
+# (strip, prefix, rules): o caminho relativo ao arquivo de ignore é
+# prefix + rel[strip:], com rel relativo ao diretório ingerido
+IgnoreChain = Tuple[Tuple[int, str, IgnoreRules], ...]
+
+
+def _ignored(chain: IgnoreChain, rel: str, is_dir: bool) -> bool:
+    ignored = False
+    for strip, prefix, rules in chain:
+        res = rules.match(prefix + rel[strip:], is_dir)
+        if res is not None:
+            ignored = res
+    return ignored
+
+
+def _root_ignore_chain(base_dir: str) -> IgnoreChain:
+    """Ignore files between the enclosing git repo root and base_dir."""
+    ancestors = []
+    cur = base_dir
+    while True:
+        ancestors.append(cur)
+        if os.path.exists(os.path.join(cur, ".git")):
+            break
+        parent = os.path.dirname(cur)
+        if parent == cur:
+            # Fora de um repositório: só os arquivos do próprio diretório
+            ancestors = [base_dir]
+            break
+        cur = parent
+    chain = []
+    repo_root = ancestors[-1]
+    exclude = os.path.join(repo_root, ".git", "info", "exclude")
+    if os.path.isfile(exclude):
+        with open(exclude, "r", encoding="utf-8", errors="ignore") as f:
+            rules = IgnoreRules(f)
+        if rules.rules:
+            prefix = os.path.relpath(base_dir, repo_root).replace(os.sep, "/")
+            chain.append((0, "" if prefix == "." else prefix + "/", rules))
+    for directory in reversed(ancestors):
+        rules = IgnoreRules.load(directory)
+        if rules is not None:
+            prefix = os.path.relpath(base_dir, directory).replace(os.sep, "/")
+            chain.append((0, "" if prefix == "." else prefix + "/", rules))
+    return tuple(chain)
+
+
+def _scan_dir(
+    base_dir: str, rel_root: str, matcher: GlobMatcher,
+    chain: Optional[IgnoreChain],
+) -> Tuple[List[Tuple[str, str]], List[Tuple[str, Optional[IgnoreChain]]]]:
+    """One directory: matching files and the subdirectories to descend."""
+    root = os.path.join(base_dir, rel_root) if rel_root else base_dir
+    try:
+        with os.scandir(root) as it:
+            entries = list(it)
+    except OSError:
+        return [], []
+    if chain is not None and rel_root:
+        rules = IgnoreRules.load(root)
+        if rules is not None:
+            chain = chain + ((len(rel_root) + 1, "", rules),)
+    files, subdirs = [], []
+    for entry in entries:
+        rel = f"{rel_root}/{entry.name}" if rel_root else entry.name
+        try:
+            # d_type do scandir: sem stat extra; não segue symlinks
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        if is_dir:
+            if (
+                entry.name not in SKIP_DIRS
+                and not matcher.prune_dir(rel)
+                and not (chain and _ignored(chain, rel, True))
+            ):
+                subdirs.append((rel, chain))
+        elif not (entry.is_symlink() and entry.is_dir()):
+            if matcher.match_file(rel) and not (
+                chain and _ignored(chain, rel, False)
+            ):
+                files.append((entry.path, rel))
+    return files, subdirs
+
+
+def _walk_tree(
+    base_dir: str, start: List[Tuple[str, Optional[IgnoreChain]]],
+    matcher: GlobMatcher,
+) -> Iterator[Tuple[str, str]]:
+    """Depth-first os.scandir walk from the given subdirs: (path, rel)."""
+    stack = list(reversed(start))
+    while stack:
+        rel_root, chain = stack.pop()
+        files, subdirs = _scan_dir(base_dir, rel_root, matcher, chain)
+        yield from files
+        stack.extend(reversed(subdirs))
+
+
+def walk_files(
+    base_dir: str, include_globs: List[str], exclude_globs: List[str],
+    workers: int = 1, respect_gitignore: bool = False,
+) -> Iterator[Tuple[str, str]]:
+    """Yield (absolute path, '/'-separated relative path) of matching files.
+
+    With ``workers`` > 1 the top-level subtrees are walked in parallel
+    threads (order is then not deterministic). ``respect_gitignore``
+    applies .gitignore/.ignore files hierarchically (including those of
+    the enclosing repository above base_dir), pruning ignored directories.
+    """
+    base_dir = os.path.abspath(base_dir)
+    matcher = GlobMatcher(include_globs, exclude_globs)
+    chain = _root_ignore_chain(base_dir) if respect_gitignore else None
+    if workers <= 1:
+        yield from _walk_tree(base_dir, [("", chain)], matcher)
+        return
+    files, subtrees = _scan_dir(base_dir, "", matcher, chain)
+    yield from files
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="walk"
+    ) as pool:
+        futures = [
+            pool.submit(
+                lambda d: list(_walk_tree(base_dir, [d], matcher)), d
+            )
+            for d in subtrees
+        ]
+        for fut in as_completed(futures):
+            yield from fut.result()
+
+
+def _descend_to(
+    base_dir: str, rel_dir: str, matcher: GlobMatcher,
+    chain: Optional[IgnoreChain], load_last: bool = True,
+) -> Tuple[bool, Optional[IgnoreChain]]:
+    """Apply the walker's directory rules along base_dir -> rel_dir.
+
+    Returns (False, _) when the walker would never reach rel_dir, else the
+    ignore chain in effect inside it (without rel_dir's own ignore files
+    when ``load_last`` is False, as _scan_dir loads those itself).
+    """
+    parts = [p for p in rel_dir.split("/") if p]
+    cur = ""
+    for n, part in enumerate(parts, 1):
+        cur = f"{cur}/{part}" if cur else part
+        if (
+            part in SKIP_DIRS
+            or matcher.prune_dir(cur)
+            or (chain and _ignored(chain, cur, True))
+        ):
+            return False, chain
+        if chain is not None and (load_last or n < len(parts)):
+            rules = IgnoreRules.load(os.path.join(base_dir, cur))
+            if rules is not None:
+                chain = chain + ((len(cur) + 1, "", rules),)
+    return True, chain
+
+
+def walk_paths(
+    base_dir: str, rels: Iterable[str], include_globs: List[str],
+    exclude_globs: List[str], respect_gitignore: bool = False,
+) -> Iterator[Tuple[str, str]]:
+    """Like walk_files, restricted to the given relative files/directories.
+
+    Missing paths are skipped; the same globs, skip dirs and ignore rules
+    as a full walk apply.
+    """
+    base_dir = os.path.abspath(base_dir)
+    matcher = GlobMatcher(include_globs, exclude_globs)
+    root_chain = _root_ignore_chain(base_dir) if respect_gitignore else None
+    for rel in sorted(set(rels)):
+        rel = rel.strip("/")
+        path = os.path.join(base_dir, rel)
+        if os.path.isdir(path) and not os.path.islink(path):
+            ok, chain = _descend_to(
+                base_dir, rel, matcher, root_chain, load_last=False
+            )
+            if ok:
+                yield from _walk_tree(base_dir, [(rel, chain)], matcher)
+        elif os.path.isfile(path):
+            ok, chain = _descend_to(
+                base_dir, os.path.dirname(rel), matcher, root_chain
+            )
+            if (
+                ok and matcher.match_file(rel)
+                and not (chain and _ignored(chain, rel, False))
+            ):
+                yield path, rel
+
+
+def _in_skipped_dir(matcher: GlobMatcher, rel: str) -> bool:
+    """For listings without a directory walk (git trees, archives): whether
+    a parent of ``rel`` is in SKIP_DIRS or pruned by the excludes."""
+    parts = rel.split("/")[:-1]
+    return any(
+        name in SKIP_DIRS or matcher.prune_dir("/".join(parts[:i + 1]))
+        for i, name in enumerate(parts)
+    )
+
+
+def iter_files(
+    base_dir: str, include_globs: List[str], exclude_globs: List[str]
+) -> Iterable[str]:
+    for path, _ in walk_files(base_dir, include_globs, exclude_globs):
+        yield path
+
+
+# -------------------- Git --------------------
+def _git(base_dir: str, *args: str) -> Optional[str]:
+    """Run ``git -C base_dir args``; None if git is missing or fails.
+
+    The output is decoded like file names from ``os.walk``
+    (``os.fsdecode``): a path that isn't valid UTF-8 keeps its bytes as
+    surrogates instead of failing the whole call. Pass ``-z`` so git
+    doesn't quote such names.
+    """
+    try:
+        proc = subprocess.run(
+            ["git", "-C", base_dir, *args],
+            capture_output=True, timeout=120,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if proc.returncode != 0:
+        logger.debug(
+            "git %s: %s", " ".join(args),
+            proc.stderr.decode("utf-8", "replace").strip(),
+        )
+        return None
+    return os.fsdecode(proc.stdout)
+
+
+def git_head(base_dir: str, revision: str = "HEAD") -> Optional[str]:
+    """Commit SHA of ``revision`` (default HEAD) for the repo containing
+    ``base_dir``; None if not a repo or the revision doesn't exist."""
+    if revision.startswith("-"):
+        return None
+    out = _git(
+        base_dir, "rev-parse", "--verify", "--quiet", f"{revision}^{{commit}}"
+    )
+    return out.strip() if out else None
+
+
+def git_changed_paths(
+    base_dir: str, since: str, until: str = "HEAD"
+) -> Optional[Tuple[List[str], List[str]]]:
+    """Files changed between two commits, relative to ``base_dir``.
+
+    Returns ``(changed, deleted)`` from ``git diff --name-status`` (renames
+    are split into delete + add), or None when the diff can't be computed
+    (``since`` unknown after a force-push, shallow clone...): the caller
+    falls back to a full walk.
+    """
+    out = _git(
+        base_dir, "diff", "--name-status", "--no-renames", "--relative",
+        "-z", since, until, "--",
+    )
+    if out is None:
+        return None
+    changed: List[str] = []
+    deleted: List[str] = []
+    fields = out.split("\0")
+    for status, rel in zip(fields[0::2], fields[1::2]):
+        (deleted if status.startswith("D") else changed).append(rel)
+    return changed, deleted
+
+
+def walk_revision(
+    base_dir: str, revision: str, include_globs: List[str],
+    exclude_globs: List[str],
+) -> Iterator[Tuple[str, str, int]]:
+    """Files of ``revision`` under ``base_dir`` as (blob oid, rel, size).
+
+    Reads the tree with one ``git ls-tree`` (no checkout); the same globs,
+    skip dirs and directory pruning as walk_files apply. Submodules and
+    symlinks are skipped. Raises ValueError for an unknown revision.
+    """
+    out = _git(base_dir, "ls-tree", "-r", "-z", "--long", revision, "--")
+    if out is None:
+        raise ValueError(f"Revisão git inválida: {revision}")
+    matcher = GlobMatcher(include_globs, exclude_globs)
+    for record in out.split("\0"):
+        if not record:
+            continue
+        meta, rel = record.split("\t", 1)
+        mode, kind, oid, size = meta.split()
+        if kind != "blob" or mode == "120000":
+            continue
+        if not _in_skipped_dir(matcher, rel) and matcher.match_file(rel):
+            yield oid, rel, int(size)
+
+
+class GitBlobStream:
+    """One blob read in blocks from its own ``git cat-file blob`` process,
+    so a large blob is never whole in memory and doesn't hold the shared
+    ``--batch`` pipe while it is chunked."""
+
+    def __init__(
+        self, base_dir: str, oid: str,
+        on_close: Optional[Callable[["GitBlobStream"], None]] = None,
+    ):
+        self._proc = subprocess.Popen(
+            ["git", "-C", base_dir, "cat-file", "blob", oid],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self._on_close = on_close
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._proc.stdout.read(size)
+        if not data and size != 0 and self._proc.wait() != 0:
+            raise OSError(
+                f"git cat-file blob saiu com {self._proc.returncode}"
+            )
+        return data
+
+    def close(self) -> None:
+        # Fechar antes do fim (binário, erro) encerra o git por SIGPIPE
+        self._proc.stdout.close()
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def __enter__(self) -> "GitBlobStream":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class GitBlobReader:
+    """Blob contents from one long-lived ``git cat-file --batch`` process.
+
+    Thread-safe: requests are serialized over the process pipes, so the
+    read stage workers share a single process instead of spawning one per
+    file. Large blobs are streamed by ``open()`` instead.
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._proc = subprocess.Popen(
+            ["git", "-C", base_dir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._lock = threading.Lock()
+        self._streams: Set[GitBlobStream] = set()
+
+    def _request(self, oid: str) -> Optional[int]:
+        # Chamado com o lock: tamanho do blob, ou None se não existe
+        self._proc.stdin.write(oid.encode("ascii") + b"\n")
+        self._proc.stdin.flush()
+        header = self._proc.stdout.readline().split()
+        if not header:
+            raise RuntimeError("git cat-file --batch terminou")
+        if len(header) < 3 or header[1] == b"missing":
+            return None
+        return int(header[2])
+
+    def read(self, oid: str) -> Optional[bytes]:
+        with self._lock:
+            size = self._request(oid)
+            if size is None:
+                return None
+            data = self._proc.stdout.read(size)
+            self._proc.stdout.read(1)  # \n após o conteúdo
+            return data
+
+    def open(self, oid: str) -> GitBlobStream:
+        """Stream of one blob; closed by close() if still open then."""
+        stream = GitBlobStream(self.base_dir, oid, self._discard)
+        with self._lock:
+            self._streams.add(stream)
+        return stream
+
+    def _discard(self, stream: GitBlobStream) -> None:
+        with self._lock:
+            self._streams.discard(stream)
+
+    def close(self) -> None:
+        # Streams que um ingest abortado não chegou a consumir
+        with self._lock:
+            streams, self._streams = self._streams, set()
+        for stream in streams:
+            stream.close()
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=5)
+        except Exception:
+            self._proc.kill()
+            self._proc.wait()
+
+    def __enter__(self) -> "GitBlobReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+# -------------------- Archives --------------------
+ARCHIVE_SUFFIXES = (
+    ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".zip",
+)
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _member_rel(name: str) -> Optional[str]:
+    """Normalized member name; None for absolute/``..`` escapes."""
+    rel = name.replace("\\", "/").lstrip("/")
+    while rel.startswith("./"):
+        rel = rel[2:]
+    if not rel or ".." in rel.split("/"):
+        return None
+    return rel
+
+
+def walk_archive(
+    archive: str, include_globs: List[str], exclude_globs: List[str],
+) -> Iterator[Tuple[str, Tuple[Any, int], Callable[[], Any]]]:
+    """Regular-file members of a tar/zip as (rel, (mtime, size), open).
+
+    ``open()`` returns a binary file object with the member's contents;
+    nothing is extracted to disk. Tars (compressed or not) are read as a
+    stream (``r|*``), so it only works until the generator advances;
+    for zips the "mtime" is the member CRC. Member names get the same globs,
+    skip dirs and pruning as walk_files.
+    """
+    matcher = GlobMatcher(include_globs, exclude_globs)
+
+    def wanted(name: str) -> Optional[str]:
+        rel = _member_rel(name)
+        if rel is None or _in_skipped_dir(matcher, rel):
+            return None
+        return rel if matcher.match_file(rel) else None
+
+    if archive.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                rel = None if info.is_dir() else wanted(info.filename)
+                if rel is not None:
+                    yield (
+                        rel, (info.CRC, info.file_size),
+                        functools.partial(zf.open, info),
+                    )
+        return
+    try:
+        tf = tarfile.open(archive, mode="r|*")
+    except tarfile.TarError as e:
+        raise ValueError(f"Arquivo compactado inválido: {archive}: {e}")
+    with tf:
+        for member in tf:
+            rel = wanted(member.name) if member.isfile() else None
+            if rel is not None:
+                yield (
+                    rel, (member.mtime, member.size),
+                    functools.partial(tf.extractfile, member),
+                )
+
+
+# -------------------- Watch mode --------------------
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+    | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding (ctypes, Linux only)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify indisponível nesta plataforma")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """Pending events as (wd, mask, name); [] after ``timeout``."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events, pos = [], 0
+        while pos + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Calls ``on_change(paths)`` for files touched under base_dir.
+
+    Events are coalesced into a set of relative paths (files or
+    directories) and flushed once the tree has been quiet for ``debounce``
+    seconds, or at most ``max_delay`` after the first event, so a branch
+    switch becomes one call. ``paths`` is None when a full (incremental)
+    rescan is needed instead: at startup, on inotify queue overflow, when
+    more than ``max_pending`` distinct paths are pending, or on every
+    ``poll_interval`` when inotify is not available.
+    """
+
+    def __init__(
+        self, base_dir: str, on_change: Callable[[Optional[List[str]]], Any],
+        include_globs: List[str], exclude_globs: List[str],
+        respect_gitignore: bool = False, debounce: float = 2.0,
+        max_delay: float = 30.0, max_pending: int = 10000,
+        poll_interval: float = 30.0,
+    ):
+        self.base_dir = os.path.abspath(base_dir)
+        self.on_change = on_change
+        self.matcher = GlobMatcher(include_globs, exclude_globs)
+        self.respect_gitignore = respect_gitignore
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self._wds: Dict[int, str] = {}
+        self._pending: set = set()
+        self._rescan = True
+        self._first = self._last = 0.0
+
+    def _watch_tree(self, inotify: Inotify, rel_dir: str) -> None:
+        """Watch rel_dir and every subdirectory the walker would descend."""
+        chain = None
+        if self.respect_gitignore:
+            chain = _root_ignore_chain(self.base_dir)
+        ok, chain = _descend_to(
+            self.base_dir, rel_dir, self.matcher, chain, load_last=False
+        )
+        if not ok:
+            return
+        stack = [(rel_dir, chain)]
+        while stack:
+            rel, chain = stack.pop()
+            path = os.path.join(self.base_dir, rel) if rel else self.base_dir
+            try:
+                self._wds[inotify.add_watch(path)] = rel
+            except FileNotFoundError:
+                continue
+            _, subdirs = _scan_dir(self.base_dir, rel, self.matcher, chain)
+            stack.extend(subdirs)
+
+    def _add(self, rel: str) -> None:
+        if self._rescan:
+            return
+        now = time.monotonic()
+        if not self._pending:
+            self._first = now
+        self._last = now
+        self._pending.add(rel)
+        if len(self._pending) > self.max_pending:
+            # Fila limitada: muitos caminhos viram um rescan completo
+            self._pending.clear()
+            self._rescan = True
+
+    def _handle(self, inotify: Inotify, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._pending.clear()
+            self._rescan = True
+            return
+        if mask & IN_IGNORED:
+            self._wds.pop(wd, None)
+            return
+        rel_dir = self._wds.get(wd)
+        if rel_dir is None or not name:
+            return
+        rel = f"{rel_dir}/{name}" if rel_dir else name
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            try:
+                self._watch_tree(inotify, rel)
+            except OSError as e:
+                logger.warning(f"Watch: não foi possível observar {rel}: {e}")
+                self._rescan = True
+        self._add(rel)
+
+    def _flush(self) -> None:
+        paths = None if self._rescan else sorted(self._pending)
+        self._pending.clear()
+        self._rescan = False
+        try:
+            self.on_change(paths)
+        except Exception as e:
+            logger.error(f"Watch: reindexação falhou: {e}")
+
+    def _due(self) -> bool:
+        if self._rescan:
+            return True
+        if not self._pending:
+            return False
+        now = time.monotonic()
+        return (
+            now - self._last >= self.debounce
+            or now - self._first >= self.max_delay
+        )
+
+    def run(self, stop: threading.Event) -> None:
+        try:
+            inotify = Inotify()
+            self._watch_tree(inotify, "")
+        except OSError as e:
+            logger.warning(
+                f"Watch: inotify indisponível ({e}); "
+                f"varrendo a cada {self.poll_interval:.0f}s"
+            )
+            while not stop.is_set():
+                self._flush()
+                stop.wait(self.poll_interval)
+            return
+        logger.info(
+            f"Watch: observando {len(self._wds)} diretórios em {self.base_dir}"
+        )
+        try:
+            while not stop.is_set():
+                for wd, mask, name in inotify.read(min(self.debounce, 0.5)):
+                    self._handle(inotify, wd, mask, name)
+                if self._due():
+                    self._flush()
+        finally:
+            inotify.close()
+
+
+# -------------------- Ingest manifest --------------------
+# Namespace fixo: o mesmo (path, índice, conteúdo) gera sempre o mesmo id
+POINT_ID_NAMESPACE = uuid.UUID("6f1c5a2e-3b7d-4f0a-9c6e-2d8b1e4a7f35")
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def sha256_pieces(pieces: Iterable[str]) -> str:
+    """sha256_text of the concatenation, without building it."""
+    h = hashlib.sha256()
+    for _ in hashed_pieces(pieces, h):
+        pass
+    return h.hexdigest()
+
+
+def hashed_pieces(pieces: Iterable[str], h: Any) -> Iterator[str]:
+    """Pass ``pieces`` through, feeding them to the hash ``h`` the way
+    sha256_text does."""
+    for piece in pieces:
+        h.update(piece.encode("utf-8", errors="ignore"))
+        yield piece
+
+
+def payload_path(rel: str) -> str:
+    """``rel`` as valid UTF-8, for point ids and payloads: the bytes of a
+    file name that isn't UTF-8 (surrogates from ``os.fsdecode``/``os.walk``)
+    become ``\\xNN`` escapes. Other names are returned unchanged."""
+    if rel.isascii():
+        return rel
+    return rel.encode("utf-8", "surrogateescape").decode(
+        "utf-8", "backslashreplace"
+    )
+
+
+def point_id(rel_path: str, chunk_index: int, chunk_hash: str) -> str:
+    """Deterministic point id for a chunk (uuid5 of path, index, hash)."""
+    name = f"{rel_path}:{chunk_index}:{chunk_hash}"
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, name))
+
+
+def shared_point_id(prefix: str, chunk_hash: str) -> str:
+    """Content-addressed id: every copy of a chunk text maps to one point."""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{prefix}sha256:{chunk_hash}"))
+
+
+def default_state_dir() -> str:
+    return os.path.expanduser(
+        os.getenv("INGEST_STATE_DIR", "~/.cache/qdrant_rag_server")
+    )
+
+
+class IngestManifest:
+    """Per-collection record of indexed files (mtime, size, hash, point ids).
+
+    Stored as JSON in INGEST_STATE_DIR, grouped by the ingested base
+    directory so that different roots in the same collection don't purge
+    each other's files.
+    """
+
+    VERSION = 1
+
+    def __init__(self, collection: str, state_dir: Optional[str] = None):
+        self.collection = collection
+        self.state_dir = state_dir or default_state_dir()
+        safe_name = "".join(
+            c if c.isalnum() or c in "-_." else "_" for c in collection
+        )
+        self.path = os.path.join(self.state_dir, f"{safe_name}.manifest.json")
+        self.data: Dict[str, Any] = {"version": self.VERSION, "roots": {}}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Manifest ilegível ({self.path}), ignorando: {e}")
+            return
+        if data.get("version") == self.VERSION:
+            self.data = data
+
+    def save(self) -> None:
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def root(self, base_dir: str) -> Dict[str, Any]:
+        return self.data["roots"].setdefault(
+            base_dir, {"chunking": None, "files": {}}
+        )
+
+    def reset(self) -> None:
+        self.data = {"version": self.VERSION, "roots": {}}
+
+
+# -------------------- Ingest pipeline --------------------
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class Stage:
+    """One pipeline step: ``fn(item)`` returns an iterable of outputs.
+
+    ``flush`` (optional) runs once after every worker of the stage finished
+    and may return trailing outputs (e.g. a partial batch).
+    """
+
+    def __init__(
+        self, name: str, fn: Callable[[Any], Iterable[Any]],
+        workers: int = 1, queue_size: int = 64,
+        flush: Optional[Callable[[], Iterable[Any]]] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.flush = flush
+
+
+class Pipeline:
+    """Worker threads per stage connected by bounded queues.
+
+    Memory is bounded by the queue sizes. run() yields the outputs of the
+    last stage in the caller's thread; the first error raised by any stage
+    aborts all of them and is re-raised from run(). Single use.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self._abort = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+
+    def _put(self, q: "queue.Queue[Any]", item: Any) -> None:
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: "queue.Queue[Any]") -> Any:
+        while True:
+            if self._abort.is_set():
+                raise PipelineAborted()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    @property
+    def aborted(self) -> bool:
+        return self._abort.is_set()
+
+    def _fail(self, exc: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = exc
+        self._abort.set()
+
+    def _feed(self, source: Iterable[Any], out: "queue.Queue[Any]") -> None:
+        try:
+            for item in source:
+                self._put(out, item)
+            self._put(out, _DONE)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _work(
+        self, stage: Stage, in_q: "queue.Queue[Any]",
+        out: "queue.Queue[Any]", remaining: List[int],
+    ) -> None:
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _DONE:
+                    # Devolve o marcador para os demais workers do estágio
+                    self._put(in_q, _DONE)
+                    break
+                for res in stage.fn(item):
+                    self._put(out, res)
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                if stage.flush is not None:
+                    for res in stage.flush():
+                        self._put(out, res)
+                self._put(out, _DONE)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            logger.error(f"Pipeline stage '{stage.name}' failed: {e}")
+            self._fail(e)
+
+    def run(self, source: Iterable[Any]) -> Iterator[Any]:
+        queues: List["queue.Queue[Any]"] = [
+            queue.Queue(maxsize=s.queue_size) for s in self.stages
+        ]
+        queues.append(queue.Queue(maxsize=self.stages[-1].queue_size))
+        threads = [
+            threading.Thread(
+                target=self._feed, args=(source, queues[0]),
+                name="ingest-source", daemon=True,
+            )
+        ]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[i], queues[i + 1], remaining),
+                    name=f"ingest-{stage.name}-{n}", daemon=True,
+                ))
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        except PipelineAborted:
+            pass
+        finally:
+            self._abort.set()
+            for t in threads:
+                t.join()
+        if self._error is not None:
+            raise self._error
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) for batch budgeting."""
+    return len(text) // 4 + 1
+
+
+class EmbedBatcher:
+    """Packs chunks from many files into fixed-size embedding batches.
+
+    add() takes a file item, or one part of a large file (with ``points``),
+    and returns the batches that became full. Each batch keeps ``refs`` =
+    (item, point index) so vectors can be mapped back to their payloads;
+    items without points travel in ``done``. ``max_tokens`` optionally
+    closes a batch early once its estimated token count would exceed the
+    budget.
+    """
+
+    def __init__(self, batch_size: int = 64, max_tokens: int = 0):
+        self.batch_size = max(1, int(batch_size))
+        self.max_tokens = max(0, int(max_tokens))
+        self.sizes: Dict[int, int] = {}
+        self._new()
+
+    def _new(self) -> None:
+        self._refs: List[Any] = []
+        self._texts: List[str] = []
+        self._tokens = 0
+
+    def _emit(self) -> Dict[str, Any]:
+        batch = {"refs": self._refs, "texts": self._texts, "done": []}
+        n = len(self._texts)
+        self.sizes[n] = self.sizes.get(n, 0) + 1
+        self._new()
+        return batch
+
+    def add(self, item: Dict[str, Any]) -> List[Dict[str, Any]]:
+        points = item.get("points") or []
+        if not points:
+            return [{"refs": [], "texts": [], "done": [item]}]
+        out = []
+        item["remaining"] = len(points)
+        for j, (_, payload) in enumerate(points):
+            text = payload["text"]
+            tokens = estimate_tokens(text)
+            if self._texts and self.max_tokens and (
+                self._tokens + tokens > self.max_tokens
+            ):
+                out.append(self._emit())
+            self._refs.append((item, j))
+            self._texts.append(text)
+            self._tokens += tokens
+            if len(self._texts) >= self.batch_size:
+                out.append(self._emit())
+        return out
+
+    def flush(self) -> List[Dict[str, Any]]:
+        return [self._emit()] if self._texts else []
+
+    def histogram(self) -> Dict[str, int]:
+        """Number of embedding calls per batch size."""
+        return {str(n): self.sizes[n] for n in sorted(self.sizes)}
+
+
+class ChunkDeduper:
+    """Run-scoped memo of chunk sha256 -> vector.
+
+    Identical chunks (vendored code, license headers, copied configs) are
+    embedded once per ingest even when they land in different batches or
+    embed workers: a copy whose original is still being embedded waits for
+    it. Bounded LRU; a copy seen after its original was evicted is simply
+    embedded again.
+    """
+
+    def __init__(self, max_size: int = 20000):
+        self.max_size = max(0, int(max_size))
+        self.reused = 0
+        self._memo: "OrderedDict[str, Any]" = OrderedDict()
+        self._pending: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def embed(
+        self, embed_fn: Callable[[List[str]], Any], texts: List[str]
+    ) -> List[Any]:
+        """One vector per text; ``embed_fn`` only sees unseen texts."""
+        shas = [sha256_text(t) for t in texts]
+        mine: Dict[str, str] = {}
+        waits: List[threading.Event] = []
+        with self._lock:
+            for sha, text in zip(shas, texts):
+                if sha in self._memo or sha in mine:
+                    continue
+                event = self._pending.get(sha)
+                if event is not None:
+                    waits.append(event)
+                    continue
+                mine[sha] = text
+            for sha in mine:
+                self._pending[sha] = threading.Event()
+        fresh: Dict[str, Any] = {}
+        try:
+            if mine:
+                fresh = dict(zip(mine, embed_fn(list(mine.values()))))
+        finally:
+            with self._lock:
+                self._memo.update(fresh)
+                while len(self._memo) > self.max_size:
+                    self._memo.popitem(last=False)
+                for sha in mine:
+                    self._pending.pop(sha).set()
+        for event in waits:
+            event.wait()
+        out: List[Any] = []
+        with self._lock:
+            for sha in shas:
+                vec = fresh.get(sha)
+                if vec is None and sha in self._memo:
+                    self._memo.move_to_end(sha)
+                    vec = self._memo[sha]
+                out.append(vec)
+        # Original falhou em outro worker ou já saiu do LRU: embedda aqui
+        missing = {
+            sha: text for sha, text, vec in zip(shas, texts, out)
+            if vec is None
+        }
+        if missing:
+            again = dict(zip(missing, embed_fn(list(missing.values()))))
+            out = [
+                again[sha] if vec is None else vec
+                for sha, vec in zip(shas, out)
+            ]
+        with self._lock:
+            self.reused += len(texts) - len(mine) - len(missing)
+        return out
+
+
+class NearDuplicateIndex:
+    """MinHash signatures + LSH over the chunks of one ingest run.
+
+    Each chunk is shingled into word 3-grams and summarized by
+    ``num_perm`` min-hashes; the signature is split into bands and chunks
+    sharing any band bucket are compared by estimated Jaccard similarity.
+    ``add`` returns the id of an earlier chunk at or above ``threshold``
+    (the chunk is then a near-duplicate, counted in ``suppressed``), or
+    registers the chunk and returns None. Needs numpy; about
+    ``4 * num_perm`` bytes per registered chunk, up to ``max_chunks``
+    (CHUNK_NEAR_DEDUPE_MAX, default 200000): past it, chunks are still
+    matched against the registered ones but not added.
+    """
+
+    PRIME = (1 << 61) - 1
+    SHINGLE = 3
+
+    def __init__(
+        self, threshold: float = 0.9, num_perm: int = 128,
+        max_chunks: Optional[int] = None,
+    ):
+        if np is None:
+            raise ValueError("near_dedupe requer numpy")
+        if not 0 < threshold <= 1:
+            raise ValueError(f"near_dedupe inválido: {threshold} (0..1]")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = self._bands(threshold, num_perm)
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.max_chunks = int(
+            os.getenv("CHUNK_NEAR_DEDUPE_MAX", "200000")
+            if max_chunks is None else max_chunks
+        )
+        self.suppressed = 0
+        self._sigs: Dict[str, Any] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [
+            {} for _ in range(self.bands)
+        ]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+        """(bands, rows) whose S-curve midpoint (1/b)^(1/r) is closest to
+        the threshold, a little below it to favour recall."""
+        best = (num_perm, 1)
+        err = float("inf")
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows:
+                continue
+            bands = num_perm // rows
+            mid = (1 / bands) ** (1 / rows)
+            e = abs(mid - (threshold - 0.05))
+            if e < err:
+                best, err = (bands, rows), e
+        return best
+
+    def signature(self, text: str) -> Any:
+        """MinHash of the word 3-grams, or None when there are no words
+        (the chunk is then never a near-duplicate)."""
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return None
+        k = self.SHINGLE
+        shingles = {
+            " ".join(words[i:i + k])
+            for i in range(max(1, len(words) - k + 1))
+        }
+        h = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64, count=len(shingles),
+        )
+        perm = (self._a[:, None] * h[None, :] + self._b[:, None]) % self.PRIME
+        return (perm.min(axis=1) & 0xFFFFFFFF).astype(np.uint32)
+
+    def add(self, cid: str, text: str) -> Optional[str]:
+        sig = self.signature(text)
+        if sig is None:
+            return None
+        keys = [
+            sig[i * self.rows:(i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+        with self._lock:
+            seen: Set[str] = set()
+            for band, key in zip(self._buckets, keys):
+                for other in band.get(key, ()):
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    if other == cid:
+                        return other
+                    if (
+                        np.count_nonzero(self._sigs[other] == sig)
+                        >= self.threshold * self.num_perm
+                    ):
+                        self.suppressed += 1
+                        return other
+            if len(self._sigs) >= self.max_chunks:
+                return None
+            self._sigs[cid] = sig
+            for band, key in zip(self._buckets, keys):
+                band.setdefault(key, []).append(cid)
+        return None
+
+
+def ingest_workers() -> Dict[str, int]:
+    """Per-stage concurrency from INGEST_*_WORKERS / INGEST_QUEUE_SIZE.
+
+    ``walk`` is the number of top-level subtrees discovered in parallel.
+    """
+    return {
+        "walk": int(os.getenv("INGEST_WALK_WORKERS", "1")),
+        "read": int(os.getenv("INGEST_READ_WORKERS", "4")),
+        "chunk": int(os.getenv("INGEST_CHUNK_WORKERS", "2")),
+        "embed": int(os.getenv("INGEST_EMBED_WORKERS", "1")),
+        "upsert": int(os.getenv("INGEST_UPSERT_WORKERS", "2")),
+        "queue_size": int(os.getenv("INGEST_QUEUE_SIZE", "64")),
+    }
+
+
+# -------------------- Qdrant wrapper --------------------
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.lower() not in ("0", "false", "no", "off")
+
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def quantization_config(
+    mode: Optional[str] = None, always_ram: Optional[bool] = None
+) -> Optional[Any]:
+    """Quantization for new collections: ``scalar`` (int8, ~4x less RAM)
+    or ``binary`` (1 bit/dim, ~32x; best with high-dimensional models);
+    None for plain float32.
+
+    Defaults: QDRANT_QUANTIZATION (none), QDRANT_QUANTIZATION_ALWAYS_RAM
+    (true: quantized vectors stay in RAM while the originals can live on
+    disk) and QDRANT_QUANTIZATION_QUANTILE (scalar; 0.99).
+    """
+    mode = (mode or os.getenv("QDRANT_QUANTIZATION") or "none").lower()
+    if always_ram is None:
+        always_ram = _env_flag("QDRANT_QUANTIZATION_ALWAYS_RAM", True)
+    if mode == "none":
+        return None
+    if mode == "scalar":
+        quantile = float(os.getenv("QDRANT_QUANTIZATION_QUANTILE", "0.99"))
+        return qm.ScalarQuantization(scalar=qm.ScalarQuantizationConfig(
+            type=qm.ScalarType.INT8, quantile=quantile, always_ram=always_ram,
+        ))
+    if mode == "binary":
+        return qm.BinaryQuantization(
+            binary=qm.BinaryQuantizationConfig(always_ram=always_ram)
+        )
+    raise ValueError(
+        f"Quantização inválida: {mode} ({'|'.join(QUANTIZATION_MODES)})"
+    )
+
+
+def quantization_name(config: Any) -> str:
+    """``scalar``/``binary``/``product``/``none`` for a collection's
+    quantization_config."""
+    for name in ("scalar", "binary", "product"):
+        if getattr(config, name, None) is not None:
+            return name
+    return "none"
+
 
+def search_params(
+    rescore: Optional[bool] = None, oversampling: Optional[float] = None
+) -> Optional[Any]:
+    """Query-time quantization params; None leaves Qdrant's defaults.
 
-def iter_files(
-    base_dir: str, include_globs: List[str], exclude_globs: List[str]
-) -> Iterable[str]:
-    base_dir = os.path.abspath(base_dir)
-    for root, dirs, files in os.walk(base_dir):
-        # Apply directory-level excludes
-        rel_root = os.path.relpath(root, base_dir)
-        if rel_root == ".":
-            rel_root = ""
-        full_root = root
-        # filter out typical heavy dirs
-        skip_dirs = {
-            ".git",
-            ".hg",
-            ".svn",
-            "node_modules",
-            ".venv",
-            "venv",
-            "__pycache__",
-        }
-        dirs[:] = [d for d in dirs if d not in skip_dirs]
-        for f in files:
-            path = os.path.join(full_root, f)
-            rel = os.path.relpath(path, base_dir)
-            rel_for_match = rel.replace(os.sep, "/")
-            if include_globs and not match_globs(rel_for_match, include_globs):
-                continue
-            if exclude_globs and match_globs(rel_for_match, exclude_globs):
-                continue
-            yield path
+    ``oversampling`` fetches ``top_k * oversampling`` candidates with the
+    quantized vectors and ``rescore`` re-ranks them with the originals.
+    Defaults: QDRANT_RESCORE, QDRANT_OVERSAMPLING (unset).
+    """
+    if rescore is None and os.getenv("QDRANT_RESCORE"):
+        rescore = _env_flag("QDRANT_RESCORE", True)
+    if oversampling is None and os.getenv("QDRANT_OVERSAMPLING"):
+        oversampling = float(os.getenv("QDRANT_OVERSAMPLING", "1"))
+    if rescore is None and oversampling is None:
+        return None
+    return qm.SearchParams(quantization=qm.QuantizationSearchParams(
+        rescore=rescore, oversampling=oversampling,
+    ))
+
+
+# Layout de armazenamento/índice → variável de ambiente com o default
+LAYOUT_ENV = {
+    "hnsw_m": "QDRANT_HNSW_M",
+    "hnsw_ef_construct": "QDRANT_HNSW_EF_CONSTRUCT",
+    "on_disk": "QDRANT_ON_DISK",
+    "on_disk_payload": "QDRANT_ON_DISK_PAYLOAD",
+    "indexing_threshold": "QDRANT_INDEXING_THRESHOLD",
+    "default_segment_number": "QDRANT_DEFAULT_SEGMENT_NUMBER",
+    "max_segment_size": "QDRANT_MAX_SEGMENT_SIZE",
+}
+OPTIMIZER_FIELDS = (
+    "indexing_threshold", "default_segment_number", "max_segment_size",
+)
+# indexing_threshold (KB) do Qdrant quando a coleção não define um
+DEFAULT_INDEXING_THRESHOLD = 20000
+
+
+def collection_layout(**overrides: Any) -> Dict[str, Any]:
+    """HNSW, optimizer and storage settings for a collection.
+
+    Keys are those of LAYOUT_ENV: ``hnsw_m``/``hnsw_ef_construct`` (graph
+    degree and build-time beam; higher = better recall, more RAM and
+    slower indexing), ``on_disk``/``on_disk_payload`` (mmap the original
+    vectors/payloads instead of RAM), ``indexing_threshold`` (KB of
+    vectors per segment before an HNSW index is built; 0 disables
+    indexing), ``default_segment_number`` and ``max_segment_size`` (KB).
+    Explicit values win over the QDRANT_* env vars; unset keys are left
+    out, so Qdrant's defaults apply.
+    """
+    layout = {}
+    for key, env in LAYOUT_ENV.items():
+        value = overrides.get(key)
+        if value is None and os.getenv(env):
+            value = (
+                _env_flag(env, False) if key.startswith("on_disk")
+                else int(os.getenv(env, "0"))
+            )
+        if value is not None:
+            layout[key] = value
+    return layout
+
+
+def collection_params(
+    size: int, distance: Any, layout: Dict[str, Any]
+) -> Dict[str, Any]:
+    """``create_collection`` kwargs (besides name/quantization) for a
+    ``collection_layout()``."""
+    hnsw = {
+        key[len("hnsw_"):]: layout[key]
+        for key in ("hnsw_m", "hnsw_ef_construct") if key in layout
+    }
+    optimizers = {key: layout[key] for key in OPTIMIZER_FIELDS
+                  if key in layout}
+    return {
+        "vectors_config": qm.VectorParams(
+            size=size, distance=distance, on_disk=layout.get("on_disk"),
+        ),
+        "hnsw_config": qm.HnswConfigDiff(**hnsw) if hnsw else None,
+        "optimizers_config": (
+            qm.OptimizersConfigDiff(**optimizers) if optimizers else None
+        ),
+        "on_disk_payload": layout.get("on_disk_payload"),
+    }
 
 
-# -------------------- Qdrant wrapper --------------------
 class QdrantIndex:
+    """Qdrant collection wrapper with a per-process metadata cache.
+
+    Existence, vector size, distance and payload indexes are fetched once
+    and reused for COLLECTION_META_TTL seconds (default 60) or until
+    ``invalidate()``, so upserts don't pay a ``get_collection`` round-trip
+    per batch and vector sizes are checked locally.
+    """
+
+    # Índices keyword criados com a coleção: filtros por path/path_prefix
+    # e pela origem (diretório, revisão ou arquivo) dos pontos
+    KEYWORD_INDEXES = ("path", "path_prefixes", "source")
+
     def __init__(
         self, client: QdrantClient, collection: str,
-        vector_size: Optional[int] = None
+        vector_size: Optional[int] = None, meta_ttl: Optional[float] = None,
     ):
         self.client = client
         self.collection = collection
         self.vector_size = vector_size
+        # (modo, always_ram) usados ao criar a coleção; None = env
+        self.quantization: Optional[Tuple[str, Optional[bool]]] = None
+        # Overrides de collection_layout() usados ao criar a coleção
+        self.layout: Dict[str, Any] = {}
+        # indexing_threshold a restaurar no fim de uma carga em massa
+        self._bulk_restore: Optional[int] = None
+        self.meta_ttl = float(
+            os.getenv("COLLECTION_META_TTL", "60")
+            if meta_ttl is None else meta_ttl
+        )
+        # Incrementado a cada escrita: invalida o SearchResultCache
+        self.generation = 0
+        self._meta: Optional[Dict[str, Any]] = None
+        # Upserts concorrentes (pipeline) não podem criar a coleção duas vezes
+        self._lock = threading.Lock()
 
-    def ensure(self, vector_size: int) -> None:
-        """Ensure collection exists with the given vector size."""
-        exists = False
+    def invalidate(self) -> None:
+        """Drop the cached metadata; the next access refetches it."""
+        with self._lock:
+            self._meta = None
+
+    def _fetch_meta(self) -> Dict[str, Any]:
         try:
             info = self.client.get_collection(self.collection)
-            if info and getattr(info, "vectors_count", None) is not None:
-                exists = True
         except Exception:
-            exists = False
-        if not exists:
-            self.client.recreate_collection(
+            # Erro de rede/servidor propaga aqui; só "não existe" vira False
+            if self.client.collection_exists(self.collection):
+                raise
+            return {"exists": False, "fetched": time.monotonic()}
+        vectors = info.config.params.vectors
+        if isinstance(vectors, dict):  # vetores nomeados: o sem nome ou o 1º
+            vectors = vectors.get("") or next(iter(vectors.values()), None)
+        return {
+            "exists": True,
+            "size": getattr(vectors, "size", None),
+            "distance": getattr(vectors, "distance", None),
+            "payload_indexes": set(info.payload_schema or {}),
+            "quantization": info.config.quantization_config,
+            "indexing_threshold": getattr(
+                info.config.optimizer_config, "indexing_threshold", None
+            ),
+            "fetched": time.monotonic(),
+        }
+
+    def meta(self) -> Dict[str, Any]:
+        """Cached collection metadata (exists, size, distance,
+        payload_indexes)."""
+        with self._lock:
+            return self._meta_locked()
+
+    def _meta_locked(self) -> Dict[str, Any]:
+        meta = self._meta
+        if meta is None or time.monotonic() - meta["fetched"] > self.meta_ttl:
+            meta = self._meta = self._fetch_meta()
+        return meta
+
+    def ensure(self, vector_size: int) -> None:
+        """Ensure collection exists with the given vector size.
+
+        Never recreates an existing collection: a size mismatch raises
+        ValueError instead of wiping the points.
+        """
+        with self._lock:
+            meta = self._meta_locked()
+            if not meta["exists"]:
+                quantization = quantization_config(*(self.quantization or ()))
+                layout = collection_layout(**self.layout)
+                if self._bulk_restore is not None:
+                    # Carga em massa: sem HNSW até end_bulk_load()
+                    layout["indexing_threshold"] = 0
+                try:
+                    self.client.create_collection(
+                        collection_name=self.collection,
+                        quantization_config=quantization,
+                        **collection_params(
+                            vector_size, qm.Distance.COSINE, layout
+                        ),
+                    )
+                except Exception:
+                    # Criada por outro processo nesse meio tempo
+                    meta = self._meta = self._fetch_meta()
+                    if not meta["exists"]:
+                        raise
+                else:
+                    meta = self._meta = {
+                        "exists": True, "size": vector_size,
+                        "distance": qm.Distance.COSINE,
+                        "payload_indexes": set(),
+                        "quantization": quantization,
+                        "indexing_threshold": layout.get(
+                            "indexing_threshold"
+                        ),
+                        "fetched": time.monotonic(),
+                    }
+            if meta["size"] is not None and meta["size"] != vector_size:
+                raise ValueError(
+                    f"Vetores de dimensão {vector_size} não cabem na coleção "
+                    f"{self.collection} (dimensão {meta['size']}); use outra "
+                    "coleção ou apague esta para trocar de modelo"
+                )
+            # Coleções novas e as criadas antes dos índices: uma vez só
+            for field in self.KEYWORD_INDEXES:
+                self._payload_index(meta, field, qm.PayloadSchemaType.KEYWORD)
+            self.vector_size = vector_size
+
+    def set_quantization(
+        self, mode: str, always_ram: Optional[bool] = None
+    ) -> bool:
+        """Use this quantization: at creation for a new collection, via
+        ``update_collection`` for an existing one whose config differs in
+        anything (mode, always_ram, quantile); Qdrant re-quantizes in the
+        background. True if it changed."""
+        config = quantization_config(mode, always_ram)
+        with self._lock:
+            self.quantization = (mode, always_ram)
+            meta = self._meta_locked()
+            if not meta["exists"] or meta["quantization"] == config:
+                return False
+            self.client.update_collection(
                 collection_name=self.collection,
-                vectors_config=qm.VectorParams(
-                    size=vector_size, distance=qm.Distance.COSINE
-                ),
+                quantization_config=config or qm.Disabled.DISABLED,
             )
-        self.vector_size = vector_size
+            meta["quantization"] = config
+            return True
+
+    def begin_bulk_load(self) -> None:
+        """Disable HNSW indexing (``indexing_threshold=0``) until
+        ``end_bulk_load()``: points of a large first ingest land in plain
+        segments and the graph is built once at the end, instead of being
+        rebuilt while segments keep growing. A missing collection is
+        created that way."""
+        with self._lock:
+            if self._bulk_restore is not None:
+                return
+            self._meta = None
+            meta = self._meta_locked()
+            # Restaura exatamente o valor anterior, inclusive 0 (indexação
+            # desligada de propósito); só sem valor usa o layout/default
+            restore = meta.get("indexing_threshold") if meta["exists"] \
+                else None
+            if restore is None:
+                restore = collection_layout(**self.layout).get(
+                    "indexing_threshold"
+                )
+            self._bulk_restore = (
+                DEFAULT_INDEXING_THRESHOLD if restore is None else restore
+            )
+            if meta["exists"] and meta.get("indexing_threshold") != 0:
+                self.client.update_collection(
+                    collection_name=self.collection,
+                    optimizers_config=qm.OptimizersConfigDiff(
+                        indexing_threshold=0
+                    ),
+                )
+                meta["indexing_threshold"] = 0
+
+    @property
+    def bulk_loading(self) -> bool:
+        return self._bulk_restore is not None
+
+    def end_bulk_load(self) -> Optional[int]:
+        """Restore the indexing threshold saved by ``begin_bulk_load()``;
+        Qdrant then builds the index in the background. Returns the
+        restored threshold (None if no bulk load was active)."""
+        with self._lock:
+            restore, self._bulk_restore = self._bulk_restore, None
+            if restore is None:
+                return None
+            meta = self._meta_locked()
+            if meta["exists"]:
+                self.client.update_collection(
+                    collection_name=self.collection,
+                    optimizers_config=qm.OptimizersConfigDiff(
+                        indexing_threshold=restore
+                    ),
+                )
+                meta["indexing_threshold"] = restore
+            return restore
+
+    def ensure_payload_index(
+        self, field: str, schema: Any = qm.PayloadSchemaType.KEYWORD
+    ) -> None:
+        """Create a payload index on ``field`` unless the cache says it
+        already exists (the collection must exist)."""
+        with self._lock:
+            meta = self._meta_locked()
+            if meta["exists"]:
+                self._payload_index(meta, field, schema)
+
+    def _payload_index(
+        self, meta: Dict[str, Any], field: str, schema: Any
+    ) -> None:
+        if field in meta["payload_indexes"]:
+            return
+        self.client.create_payload_index(
+            collection_name=self.collection, field_name=field,
+            field_schema=schema, wait=True,
+        )
+        meta["payload_indexes"].add(field)
+
+    # Id fixo que nunca é gravado: alvo do delete usado como barreira
+    BARRIER_ID = "00000000-0000-0000-0000-000000000000"
 
     def upsert(
-        self, ids: List[str], vectors: List[List[float]],
-        payloads: List[Dict[str, Any]], vector_size: int
+        self, ids: List[str], vectors: Any,
+        payloads: List[Dict[str, Any]], vector_size: int,
+        wait: bool = True,
     ) -> None:
+        """Upsert one columnar batch.
+
+        ``vectors`` may be lists of floats, a float32 matrix or a list of
+        matrix rows. Arrays become Python floats here, in C (``tolist``):
+        the client validates and serializes every element with pydantic,
+        which is much slower on an ndarray. This conversion makes a numpy
+        batch slower to upsert than one already in lists (see
+        bench_vectors.py). With ``wait=False`` Qdrant acknowledges the batch
+        once it is in its WAL, before indexing it; call ``barrier()``
+        before relying on the points.
+        """
         self.ensure(vector_size)
-        points = [
-            qm.PointStruct(id=id_, vector=vec, payload=payload)
-            for id_, vec, payload in zip(ids, vectors, payloads)
-        ]
-        self.client.upsert(
-            collection_name=self.collection, points=points, wait=True
+        if hasattr(vectors, "tolist"):
+            vectors = vectors.tolist()
+        else:
+            vectors = [
+                v.tolist() if hasattr(v, "tolist") else v for v in vectors
+            ]
+        try:
+            self.client.upsert(
+                collection_name=self.collection,
+                points=qm.Batch(ids=ids, vectors=vectors, payloads=payloads),
+                wait=wait,
+            )
+        except Exception:
+            # Coleção apagada/recriada por fora: o cache não vale mais
+            self.invalidate()
+            raise
+        self.generation += 1
+
+    def barrier(self) -> None:
+        """Wait until every write sent before it has been applied.
+
+        Qdrant applies a collection's updates in WAL order, so a write with
+        ``wait=True`` (a delete matching only an id that never exists)
+        returns only after all the earlier ``wait=False`` upserts are
+        applied.
+        """
+        if not self.exists():
+            return
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=qm.FilterSelector(filter=qm.Filter(must=[
+                qm.HasIdCondition(has_id=[self.BARRIER_ID])
+            ])),
+            wait=True,
         )
+        self.generation += 1
+
+    def exists(self) -> bool:
+        """Whether the collection exists. False only when Qdrant confirms
+        it is missing; timeouts, refused connections and 5xx propagate
+        (callers reset state, like the ingest manifest, on False)."""
+        return self.meta()["exists"]
+
+    def delete(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        self.client.delete(
+            collection_name=self.collection,
+            points_selector=qm.PointIdsList(points=ids),
+            wait=True,
+        )
+        self.generation += 1
+
+    def set_paths(self, groups: Dict[Tuple[str, ...], List[str]]) -> None:
+        """Set ``paths`` (and ``path``, its first entry) on shared points.
+
+        ``groups`` maps each path list to the point ids that get it; ids
+        that no longer exist are ignored.
+        """
+        for paths, ids in groups.items():
+            paths = tuple(map(payload_path, paths))
+            for i in range(0, len(ids), 1000):
+                self.client.set_payload(
+                    collection_name=self.collection,
+                    payload={
+                        "path": paths[0], "paths": list(paths),
+                        "path_prefixes": path_ancestors(*paths),
+                    },
+                    points=qm.FilterSelector(filter=qm.Filter(must=[
+                        qm.HasIdCondition(has_id=ids[i:i + 1000])
+                    ])),
+                    wait=True,
+                )
+        if groups:
+            self.generation += 1
+
+    def delete_paths(self, paths: List[str], source: str) -> int:
+        """Delete every point of ``source`` (the ``source`` payload: the
+        ingest root) whose ``path`` payload is one of ``paths``; points of
+        other directories, revisions or archives are left alone.
+
+        Returns the number of points deleted.
+        """
+        deleted = 0
+        paths = [payload_path(p) for p in paths]
+        for i in range(0, len(paths), 1000):
+            filter_ = qm.Filter(must=[
+                qm.FieldCondition(
+                    key="path", match=qm.MatchAny(any=paths[i:i + 1000]),
+                ),
+                qm.FieldCondition(
+                    key="source", match=qm.MatchValue(value=source)
+                ),
+            ])
+            # O delete por filtro não devolve quantos pontos apagou
+            count = self.client.count(
+                collection_name=self.collection, count_filter=filter_,
+                exact=True,
+            ).count
+            if not count:
+                continue
+            self.client.delete(
+                collection_name=self.collection,
+                points_selector=qm.FilterSelector(filter=filter_),
+                wait=True,
+            )
+            deleted += count
+            self.generation += 1
+        return deleted
 
     def search(
         self, vector: List[float], top_k: int,
-        filter_: Optional[Any] = None
+        filter_: Optional[Any] = None, params: Optional[Any] = None,
     ) -> List[Any]:
+        size = self.meta().get("size")
+        if size is not None and len(vector) != size:
+            raise ValueError(
+                f"Consulta com dimensão {len(vector)}, mas a coleção "
+                f"{self.collection} tem dimensão {size}: o modelo de "
+                "embeddings mudou desde a ingestão?"
+            )
         return self.client.search(
             collection_name=self.collection,
             query_vector=vector,
             limit=top_k,
             query_filter=filter_,
+            search_params=params,
+        )
+
+
+# -------------------- Query caches --------------------
+def embeddings_key(embeddings: Any) -> str:
+    """Provider + effective model name: vectors are only reusable within it."""
+    model = getattr(embeddings, "openai_model", None) or getattr(
+        embeddings, "model_name", ""
+    )
+    return f"{getattr(embeddings, 'provider', '')}:{model}"
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU of query text -> vector, keyed by provider and model.
+
+    Optional JSON persistence (QUERY_CACHE_PATH) so the cache survives
+    restarts; it is written every ``persist_every`` new entries and on close.
+    """
+
+    def __init__(
+        self, max_size: int = 1024, path: Optional[str] = None,
+        persist_every: int = 64,
+    ):
+        self.max_size = max(0, int(max_size))
+        self.path = os.path.expanduser(path) if path else None
+        self.persist_every = persist_every
+        self.hits = 0
+        self.misses = 0
+        self._dirty = 0
+        self._data: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def from_env(cls) -> "QueryEmbeddingCache":
+        return cls(
+            int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+            os.getenv("QUERY_CACHE_PATH") or None,
+        )
+
+    def load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Cache de queries ilegível ({self.path}): {e}")
+            return
+        for key, vec in items[-self.max_size:] if self.max_size else []:
+            self._data[key] = vec
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            items = list(self._data.items())
+            self._dirty = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(items, f)
+        os.replace(tmp, self.path)
+
+    def embed(self, embeddings: Any, text: str) -> List[float]:
+        """Cached ``embed_query(embeddings, text)``."""
+        if not self.max_size:
+            return embed_query(embeddings, text)
+        key = f"{embeddings_key(embeddings)}:{sha256_text(text)}"
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return vec
+            self.misses += 1
+        vec = embed_query(embeddings, text)
+        with self._lock:
+            self._data[key] = vec
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self._dirty += 1
+            persist = self.path and self._dirty >= self.persist_every
+        if persist:
+            self.save()
+        return vec
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class EmbeddingCache:
+    """On-disk cache of chunk vectors for ingest, keyed by (provider:model,
+    sha256 of the chunk text).
+
+    SQLite in WAL mode, read through mmap, so ingesting the same files into
+    several collections (branches, teams) or processes embeds them once.
+    Vectors are stored as float32 blobs; once the blobs pass ``max_bytes``
+    the least recently used rows are evicted down to 90% of it.
+    """
+
+    _default: Optional["EmbeddingCache"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, path: str, max_bytes: int = 512 * 2 ** 20):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False,
+            isolation_level=None,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA mmap_size={max(self.max_bytes, 2 ** 26)}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " model TEXT NOT NULL, sha TEXT NOT NULL, vec BLOB NOT NULL,"
+            " used REAL NOT NULL, PRIMARY KEY (model, sha))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS vectors_used ON vectors (used)"
+        )
+        self._bytes = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM vectors"
+        ).fetchone()[0]
+
+    @classmethod
+    def from_env(cls) -> Optional["EmbeddingCache"]:
+        """EMBED_CACHE_PATH / EMBED_CACHE_MAX_MB; None if MAX_MB is 0."""
+        max_mb = float(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+        if max_mb <= 0:
+            return None
+        path = os.getenv("EMBED_CACHE_PATH") or os.path.join(
+            default_state_dir(), "embeddings.sqlite"
+        )
+        return cls(path, int(max_mb * 2 ** 20))
+
+    @classmethod
+    def default(cls) -> Optional["EmbeddingCache"]:
+        """Process-wide instance from the environment (opened once)."""
+        with cls._default_lock:
+            if cls._default is None:
+                try:
+                    cls._default = cls.from_env() or False  # type: ignore
+                except sqlite3.Error as e:
+                    logger.warning(f"Cache de embeddings indisponível: {e}")
+                    cls._default = False  # type: ignore
+            return cls._default or None
+
+    @staticmethod
+    def _pack(vec: Any) -> bytes:
+        if np is not None:
+            return np.asarray(vec, dtype=np.float32).tobytes()
+        return array.array("f", vec).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> Any:
+        if np is not None:
+            return np.frombuffer(blob, dtype=np.float32)
+        return array.array("f", blob).tolist()
+
+    def embed(
+        self, embeddings: Any, texts: List[str],
+        counts: Optional[Dict[str, int]] = None,
+    ) -> Any:
+        """``embeddings.embed(texts)`` computing only the cache misses.
+
+        Returns a float32 matrix when numpy is available (like
+        ``as_numpy=True``), else lists. ``counts`` gets hits/misses added.
+        """
+        model = embeddings_key(embeddings)
+        shas = [sha256_text(t) for t in texts]
+        found: Dict[str, Any] = {}
+        now = time.time()
+        with self._lock:
+            try:
+                for i in range(0, len(shas), 500):
+                    part = list(set(shas[i:i + 500]))
+                    marks = ",".join("?" * len(part))
+                    rows = self._db.execute(
+                        f"SELECT sha, vec FROM vectors WHERE model = ? "
+                        f"AND sha IN ({marks})", [model, *part],
+                    ).fetchall()
+                    found.update((sha, self._unpack(v)) for sha, v in rows)
+                if found:
+                    self._db.executemany(
+                        "UPDATE vectors SET used = ? WHERE model = ? "
+                        "AND sha = ?", [(now, model, sha) for sha in found],
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Cache de embeddings: {e}")
+        # Textos repetidos no lote também são embeddados uma vez só
+        missing: Dict[str, str] = {}
+        for sha, text in zip(shas, texts):
+            if sha not in found:
+                missing.setdefault(sha, text)
+        hits = len(texts) - sum(1 for sha in shas if sha not in found)
+        if missing:
+            vecs = embeddings.embed(
+                list(missing.values()), as_numpy=np is not None
+            )
+            fresh = dict(zip(missing, vecs))
+            found.update(fresh)
+            self._put(model, fresh, now)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+            if counts is not None:
+                counts["hits"] = counts.get("hits", 0) + hits
+                counts["misses"] = (
+                    counts.get("misses", 0) + len(texts) - hits
+                )
+        vectors = [found[sha] for sha in shas]
+        if np is not None:
+            if not vectors:
+                return np.empty((0, 0), dtype=np.float32)
+            return np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+        return [list(v) for v in vectors]
+
+    def _put(self, model: str, vectors: Dict[str, Any], now: float) -> None:
+        rows = [(model, sha, self._pack(v), now) for sha, v in vectors.items()]
+        with self._lock:
+            try:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO vectors (model, sha, vec, used) "
+                    "VALUES (?, ?, ?, ?)", rows,
+                )
+                self._db.execute("COMMIT")
+                self._bytes += sum(len(r[2]) for r in rows)
+                if self._bytes > self.max_bytes:
+                    self._evict()
+            except sqlite3.Error as e:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                logger.warning(f"Cache de embeddings: {e}")
+
+    def _evict(self) -> None:
+        """Drop least recently used rows down to 90% of max_bytes."""
+        # Outros processos também escrevem: recalcula antes de apagar
+        self._bytes = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM vectors"
+        ).fetchone()[0]
+        excess = self._bytes - int(self.max_bytes * 0.9)
+        if excess <= 0:
+            return
+        cutoff, freed = None, 0
+        for used, size in self._db.execute(
+            "SELECT used, LENGTH(vec) FROM vectors ORDER BY used"
+        ):
+            cutoff, freed = used, freed + size
+            if freed >= excess:
+                break
+        self._db.execute("DELETE FROM vectors WHERE used <= ?", (cutoff,))
+        self._bytes = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM vectors"
+        ).fetchone()[0]
+
+    @property
+    def size_mb(self) -> float:
+        return round(self._bytes / 2 ** 20, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            rows = self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()
+        return {
+            "path": self.path,
+            "entries": rows[0],
+            "size_mb": self.size_mb,
+            "max_mb": round(self.max_bytes / 2 ** 20, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class SearchResultCache:
+    """TTL + LRU cache of query results.
+
+    Keys include the collection's generation (QdrantIndex.generation), which
+    every upsert/delete in this process bumps, so a local reindex never
+    serves stale hits. Collections in RESULT_CACHE_DISABLED (comma list) or
+    switched off via set_enabled() are never cached.
+    """
+
+    def __init__(
+        self, max_size: int = 256, ttl: float = 300.0,
+        disabled: Iterable[str] = (),
+    ):
+        self.max_size = max(0, int(max_size))
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self._disabled = set(disabled)
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SearchResultCache":
+        disabled = os.getenv("RESULT_CACHE_DISABLED", "")
+        return cls(
+            int(os.getenv("RESULT_CACHE_SIZE", "256")),
+            float(os.getenv("RESULT_CACHE_TTL", "300")),
+            [c.strip() for c in disabled.split(",") if c.strip()],
         )
 
+    def set_enabled(self, collection: str, enabled: bool) -> None:
+        with self._lock:
+            if enabled:
+                self._disabled.discard(collection)
+            else:
+                self._disabled.add(collection)
+                for key in [k for k in self._data if k[0] == collection]:
+                    del self._data[key]
+
+    def enabled(self, collection: str) -> bool:
+        return bool(self.max_size) and collection not in self._disabled
+
+    def get(self, key: Any) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl,
+            "disabled": sorted(self._disabled),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
 
 # -------------------- MCP protocol (simplified) --------------------
 def mcp_response(
@@ -233,6 +3069,7 @@ def mcp_list_tools() -> List[Dict[str, Any]]:
                 "type": "object",
                 "properties": {
                     "directory": {"type": "string"},
+                    "archive": {"type": "string"},
                     "include_globs": {
                         "type": "array",
                         "items": {"type": "string"},
@@ -243,9 +3080,43 @@ def mcp_list_tools() -> List[Dict[str, Any]]:
                     },
                     "chunk_size": {"type": "integer"},
                     "overlap": {"type": "integer"},
+                    "chunk_mode": {
+                        "type": "string",
+                        "enum": ["chars", "tokens", "syntax"],
+                    },
+                    "chunk_tokens": {"type": "integer"},
+                    "overlap_tokens": {"type": "integer"},
                     "collection": {"type": "string"},
+                    "force": {"type": "boolean"},
+                    "embed_cache": {"type": "boolean"},
+                    "quantization": {
+                        "type": "string", "enum": list(QUANTIZATION_MODES),
+                    },
+                    "quantization_always_ram": {"type": "boolean"},
+                    "upsert_wait": {"type": "boolean"},
+                    "upsert_concurrency": {"type": "integer"},
+                    "upsert_retries": {"type": "integer"},
+                    "bulk_load": {"type": "boolean"},
+                    "dedupe": {
+                        "type": "string",
+                        "enum": ["off", "embed", "shared"],
+                    },
+                    "near_dedupe": {"type": "number"},
+                    "max_file_size": {"type": "integer"},
+                    "respect_gitignore": {"type": "boolean"},
+                    "paths": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                    },
+                    "revision": {"type": "string"},
+                    "git_delta": {"type": "boolean"},
+                    "batch_size": {"type": "integer"},
+                    "max_batch_tokens": {"type": "integer"},
                 },
-                "required": ["directory"],
+                "anyOf": [
+                    {"required": ["directory"]},
+                    {"required": ["archive"]},
+                ],
             },
         },
         {
@@ -258,29 +3129,109 @@ def mcp_list_tools() -> List[Dict[str, Any]]:
                     "top_k": {"type": "integer"},
                     "collection": {"type": "string"},
                     "path_prefix": {"type": "string"},
+                    "rescore": {"type": "boolean"},
+                    "oversampling": {"type": "number"},
                 },
                 "required": ["text"],
             },
         },
+        {
+            "name": "stats",
+            "description": "Estatísticas dos caches do servidor",
+            "input_schema": {"type": "object", "properties": {}},
+        },
     ]
 
 
+# Incrementado quando o payload dos pontos ganha campos usados em filtros
+# (ou quando os ids mudam de esquema)
+PAYLOAD_VERSION = 3
+
+
+def path_ancestors(*paths: str) -> List[str]:
+    """Directory ancestors of each path plus the path itself, e.g.
+    ``a/b/c.py`` -> ``["a", "a/b", "a/b/c.py"]``, deduplicated in order."""
+    out: Dict[str, None] = {}
+    for path in paths:
+        parts = path.strip("/").split("/")
+        for i in range(1, len(parts) + 1):
+            out["/".join(parts[:i])] = None
+    return list(out)
+
+
 def build_filter(path_prefix: Optional[str]) -> Optional[Any]:
+    """``path_prefix`` as an exact keyword match on the indexed
+    ``path_prefixes`` array: a directory (``src/api``) or a file, whole
+    path components only."""
     if not path_prefix:
         return None
-    return qm.Filter(
-        should=[
-            qm.FieldCondition(
-                key="path", match=qm.MatchText(text=path_prefix)
-            )
-        ]
+    prefix = "/".join(
+        p for p in path_prefix.strip().split("/") if p and p != "."
     )
+    if not prefix:
+        return None
+    return qm.Filter(must=[
+        qm.FieldCondition(
+            key="path_prefixes", match=qm.MatchValue(value=prefix)
+        )
+    ])
+
+
+def shared_refs(
+    known: Dict[str, Any], stale_ids: List[str], updated_ids: Set[str],
+    claimed: Dict[str, str],
+) -> Tuple[List[str], Dict[Tuple[str, ...], List[str]]]:
+    """Resolve shared (content-addressed) points after an ingest.
+
+    Returns the stale ids no file references anymore, and the ``paths``
+    lists to set on the touched points that are still referenced, grouped
+    by list. Points written in this run whose only reference is the file
+    that wrote them (``claimed``) already carry the right payload.
+    """
+    touched = set(stale_ids) | updated_ids
+    refs: Dict[str, Set[str]] = {}
+    for rel, entry in known.items():
+        for cid in entry["ids"]:
+            if cid in touched:
+                refs.setdefault(cid, set()).add(rel)
+    groups: Dict[Tuple[str, ...], List[str]] = {}
+    for cid, rels in refs.items():
+        if len(rels) == 1 and claimed.get(cid) in rels:
+            continue
+        groups.setdefault(tuple(sorted(rels)), []).append(cid)
+    gone = [cid for cid in dict.fromkeys(stale_ids) if cid not in refs]
+    return gone, groups
 
 
 def handle_ingest(
-    params: Dict[str, Any], embeddings: Embeddings, index: QdrantIndex
+    params: Dict[str, Any], embeddings: Embeddings, index: QdrantIndex,
+    manifest: Optional[IngestManifest] = None,
+    embed_cache: Optional[EmbeddingCache] = None,
+) -> Dict[str, Any]:
+    # Carga em massa: sem HNSW durante a ingestão, restaurado no fim mesmo
+    # se ela falhar (quem já abriu uma carga, como o ingest_documents.py
+    # com várias revisões, fecha a sua)
+    bulk_load = str(
+        params.get("bulk_load", os.getenv("INGEST_BULK_LOAD", "false"))
+    ).lower() in ("1", "true", "yes")
+    if not bulk_load or index.bulk_loading:
+        return _ingest(params, embeddings, index, manifest, embed_cache)
+    index.begin_bulk_load()
+    try:
+        result = _ingest(params, embeddings, index, manifest, embed_cache)
+    finally:
+        restored = index.end_bulk_load()
+    result["bulk_load"] = {"indexing_threshold": restored}
+    return result
+
+
+def _ingest(
+    params: Dict[str, Any], embeddings: Embeddings, index: QdrantIndex,
+    manifest: Optional[IngestManifest],
+    embed_cache: Optional[EmbeddingCache],
 ) -> Dict[str, Any]:
     directory = params.get("directory")
+    archive = params.get("archive")
     include_globs = params.get("include_globs") or [
         "**/*.py", "**/*.md", "**/*.txt", "**/*.json", "**/*.yaml", "**/*.yml"
     ]
@@ -293,60 +3244,749 @@ def handle_ingest(
     ]
     chunk_size = int(params.get("chunk_size") or 800)
     overlap = int(params.get("overlap") or 100)
+    force = bool(params.get("force"))
+    respect_gitignore = bool(params.get("respect_gitignore"))
+    # "tokens": chunks dimensionados pelo tokenizer do modelo de embeddings
+    chunk_mode = (
+        params.get("chunk_mode") or os.getenv("CHUNK_MODE", "chars")
+    ).lower()
+    tokenizer: Optional[ChunkTokenizer] = None
+    if chunk_mode == "tokens":
+        get_tokenizer = getattr(embeddings, "tokenizer", None)
+        tokenizer = get_tokenizer() if get_tokenizer else None
+        if tokenizer is None:
+            raise ValueError(
+                "chunk_mode=tokens: o modelo de embeddings não expõe um "
+                "tokenizer (fast) utilizável"
+            )
+        chunk_tokens = int(
+            params.get("chunk_tokens") or os.getenv("CHUNK_TOKENS", "0")
+        ) or tokenizer.max_tokens
+        overlap_tokens = int(
+            params.get("overlap_tokens")
+            or os.getenv("CHUNK_OVERLAP_TOKENS", "0")
+        )
+    elif chunk_mode not in ("chars", "syntax"):
+        raise ValueError(
+            f"chunk_mode inválido: {chunk_mode} (chars|tokens|syntax)"
+        )
+    # Chunks idênticos: "embed" = um embedding por texto distinto na
+    # execução; "shared" = também um só ponto, com todos os paths
+    dedupe = (
+        params.get("dedupe") or os.getenv("CHUNK_DEDUPE", "embed")
+    ).lower()
+    if dedupe not in ("off", "embed", "shared"):
+        raise ValueError(f"dedupe inválido: {dedupe} (off|embed|shared)")
+    shared = dedupe == "shared"
+    # Similaridade (Jaccard estimada) a partir da qual um chunk é quase
+    # cópia de outro desta execução; 0 = desligado
+    near_dedupe = float(
+        params.get("near_dedupe") or os.getenv("CHUNK_NEAR_DEDUPE", "0")
+    )
+    near = NearDuplicateIndex(near_dedupe) if near_dedupe else None
+    # Pontos que servem vários arquivos (cópias no modo "shared", quase
+    # cópias em qualquer modo): só somem quando nenhum arquivo os referencia
+    refs = shared or near is not None
+    # Bytes; 0 = sem limite
+    max_file_size = int(
+        params.get("max_file_size")
+        or os.getenv("INGEST_MAX_FILE_SIZE", "0")
+    )
+    # Upserts sem esperar a indexação (wait=False), vários em voo, com uma
+    # barreira no fim; lotes que falham são repetidos com backoff
+    upsert_wait = str(
+        params.get("upsert_wait", os.getenv("UPSERT_WAIT", "true"))
+    ).lower() not in ("0", "false", "no")
+    upsert_retries = int(
+        params.get("upsert_retries", os.getenv("UPSERT_RETRIES", "3"))
+    )
+    upsert_backoff = float(os.getenv("UPSERT_BACKOFF", "0.5"))
+    batcher = EmbedBatcher(
+        int(params.get("batch_size") or os.getenv("EMBED_BATCH_SIZE", "64")),
+        int(
+            params.get("max_batch_tokens")
+            or os.getenv("EMBED_MAX_BATCH_TOKENS", "0")
+        ),
+    )
+
+    assert isinstance(directory, str) or isinstance(archive, str), (
+        "directory or archive must be provided"
+    )
+    # Arquivo .tar*/.zip: membros lidos em streaming, sem extrair em disco;
+    # o caminho do arquivo faz o papel do diretório base no manifest
+    if archive and not is_archive(archive):
+        raise ValueError(
+            f"Formato não suportado: {archive} "
+            f"(use {', '.join(ARCHIVE_SUFFIXES)})"
+        )
+    base_dir = os.path.abspath(archive or directory)
+    if manifest is None:
+        manifest = IngestManifest(index.collection)
+    # Coleção apagada/recriada fora daqui: o manifest não vale mais (um
+    # get_collection por ingest, não por lote)
+    index.invalidate()
+    if params.get("quantization"):
+        # Coleção nova: criada assim; existente: requantizada pelo Qdrant
+        index.set_quantization(
+            params["quantization"], params.get("quantization_always_ram")
+        )
+    if not index.exists():
+        manifest.reset()
+    # Revisão git: lida do object store, sem checkout; cada revisão tem
+    # sua própria raiz no manifest (branches/tags lado a lado)
+    revision = params.get("revision")
+    commit = None
+    if revision and archive:
+        raise ValueError("revision e archive são mutuamente exclusivos")
+    if revision:
+        commit = git_head(base_dir, revision)
+        if commit is None:
+            raise ValueError(f"Revisão git inválida: {revision}")
+    root_key = f"{base_dir}@{revision}" if revision else base_dir
+    root = manifest.root(root_key)
+    # A origem entra no id: o mesmo arquivo em dois diretórios, dois
+    # branches ou no diretório e num .tar.gz são pontos distintos
+    id_prefix = f"{root_key}:"
+    paths = params.get("paths")
+    scope = [p.strip("/") for p in paths] if paths is not None else None
+    if tokenizer is not None:
+        chunking = {
+            "mode": "tokens", "tokenizer": tokenizer.name,
+            "chunk_tokens": chunk_tokens, "overlap_tokens": overlap_tokens,
+        }
+    elif chunk_mode == "syntax":
+        chunking = {
+            "mode": "syntax", "chunkers": sorted(CHUNKERS),
+            "chunk_size": chunk_size, "overlap": overlap,
+        }
+    else:
+        chunking = {"chunk_size": chunk_size, "overlap": overlap}
+    # Pontos gravados antes de ``path_prefixes``/``source`` existirem (e
+    # com ids sem a origem) não casam com os filtros: reindexa uma vez
+    chunking["payload"] = PAYLOAD_VERSION
+    if shared:
+        # Ids por conteúdo, não por (path, índice): outro esquema de ids
+        chunking["dedupe"] = "shared"
+    if near is not None:
+        # O índice LSH só vê os arquivos reindexados na execução: mudar o
+        # limiar recompara a árvore toda
+        chunking["near_dedupe"] = near_dedupe
+    if root.get("chunking") != chunking:
+        force = True
+        # Chunking mudou: vale para a árvore toda, não só para ``paths``
+        scope = None
+    root["chunking"] = chunking
+    known: Dict[str, Any] = root["files"]
+
+    # Delta por commit: só os arquivos do ``git diff`` desde o último
+    # commit indexado, sem varrer/hashear a árvore
+    git_commit = git_since = None
+    removed: List[str] = []
+    if params.get("git_delta") and paths is None and not archive:
+        git_commit = commit or git_head(base_dir)
+        since = root.get("git_commit")
+        delta = None
+        if git_commit and since and not force:
+            delta = git_changed_paths(base_dir, since, git_commit)
+        if delta is not None:
+            git_since = since
+            changed, removed = delta
+            # Incompletos (leitura ou upsert falhou) voltam em todo delta
+            # até serem gravados: o git_commit avança sem eles
+            scope = changed + [
+                rel for rel, e in known.items() if e.get("incomplete")
+            ]
 
-    assert isinstance(directory, str), "directory must be provided"
-    base_dir = os.path.abspath(directory)
-    files = list(iter_files(base_dir, include_globs, exclude_globs))
+    workers = ingest_workers()
+    if params.get("upsert_concurrency"):
+        workers["upsert"] = int(params["upsert_concurrency"])
+    started = time.monotonic()
+    seen = set()
     total_chunks = 0
-    batch_vectors: List[List[float]] = []
-    batch_payloads: List[Dict[str, Any]] = []
-    batch_ids: List[str] = []
+    skipped = 0
+    # Arquivos regravados nesta execução (files_updated)
+    updated: Set[str] = set()
+    rejected = {"binary": 0, "too_large": 0}
+    stale_ids: List[str] = []
+    # Arquivo regravado → ids antigos que não se repetem (apagados no fim)
+    replaced: Dict[str, List[str]] = {}
+    deduper = ChunkDeduper() if dedupe != "off" else None
+    # Modo "shared": ids já gravados (por qualquer arquivo) ou reivindicados
+    # nesta execução; uma cópia deles não vira outro ponto
+    stored: Set[str] = set()
+    if shared and not force:
+        stored.update(
+            cid for e in known.values() if not e.get("incomplete")
+            for cid in e["ids"]
+        )
+    stored_lock = threading.Lock()
+    # id → arquivo que gravou o ponto nesta execução (payload paths=[rel])
+    claimed: Dict[str, str] = {}
+    updated_ids: Set[str] = set()
+    folded = 0
+
+    def claim(cid: str, rel: str) -> bool:
+        nonlocal folded
+        with stored_lock:
+            if cid in stored:
+                folded += 1
+                return False
+            stored.add(cid)
+            claimed[cid] = rel
+            return True
 
-    for path in files:
+    # Membros de archive e blobs grandes seguem abertos (``stream``) até o
+    # chunk stage, que os decodifica em blocos direto no chunking, sem
+    # nada em disco; o archive só avança quando o membro foi consumido
+    def release(item: Dict[str, Any]) -> None:
+        stream = item.pop("stream", None)
+        item.pop("head", None)
         try:
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-        except Exception:
-            continue
-        chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
-        chunk_vectors = embeddings.embed(chunks)
-        rel = os.path.relpath(path, base_dir).replace(os.sep, "/")
-        for chunk_text_val, vec in zip(chunks, chunk_vectors):
-            cid = str(uuid.uuid4())
-            payload = {
-                "path": rel,
-                "text": chunk_text_val,
-            }
-            batch_ids.append(cid)
-            batch_vectors.append(vec)
-            batch_payloads.append(payload)
-            total_chunks += 1
-        if len(batch_ids) >= 256:
-            # Ensure collection and upsert batch
-            index.upsert(
-                batch_ids, batch_vectors, batch_payloads,
-                vector_size=len(batch_vectors[0])
+            if stream is not None:
+                stream.close()
+        finally:
+            consumed = item.pop("consumed", None)
+            if consumed is not None:
+                consumed.set()
+
+    # Escopo como conjunto: um caminho está nele se ele ou um diretório
+    # acima dele está, O(profundidade) por caminho; "" = a árvore toda
+    scope_set = None if scope is None or "" in scope else set(scope)
+
+    def in_scope(rel: str) -> bool:
+        if scope_set is None:
+            return True
+        while rel not in scope_set:
+            cut = rel.rfind("/")
+            if cut < 0:
+                return False
+            rel = rel[:cut]
+        return True
+
+    def source() -> Iterator[Dict[str, Any]]:
+        if archive:
+            for rel, stat, open_member in walk_archive(
+                base_dir, include_globs, exclude_globs
+            ):
+                if not in_scope(rel):
+                    continue
+                seen.add(rel)
+                item = {"rel": rel, "entry": known.get(rel), "stat": stat}
+                entry = item["entry"]
+                # Num tar em streaming o membro só pode ser lido agora
+                consumed = None
+                if (force or not entry or (
+                    (entry["mtime"], entry["size"]) != stat
+                )) and not (max_file_size and stat[1] > max_file_size):
+                    if stat[1] < MMAP_MIN_SIZE:
+                        with open_member() as member:
+                            item["data"] = member.read()
+                    else:
+                        item["stream"] = open_member()
+                        item["consumed"] = consumed = threading.Event()
+                yield item
+                # Membro grande: espera o chunk stage lê-lo até o fim
+                while consumed is not None and not consumed.wait(0.1):
+                    if pipeline.aborted:
+                        return
+            return
+        if revision:
+            for oid, rel, size in walk_revision(
+                base_dir, commit, include_globs, exclude_globs
+            ):
+                if in_scope(rel):
+                    seen.add(rel)
+                    yield {
+                        "oid": oid, "size": size, "rel": rel,
+                        "entry": known.get(rel),
+                    }
+            return
+        if scope is None:
+            found = walk_files(
+                base_dir, include_globs, exclude_globs, workers["walk"],
+                respect_gitignore,
+            )
+        else:
+            found = walk_paths(
+                base_dir, scope, include_globs, exclude_globs,
+                respect_gitignore,
+            )
+        for path, rel in found:
+            seen.add(rel)
+            yield {"path": path, "rel": rel, "entry": known.get(rel)}
+
+    def read(item: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        entry = item["entry"]
+        if reader is not None:
+            # Numa revisão, o oid do blob faz o papel do mtime
+            item["stat"] = (item["oid"], item["size"])
+        elif "stat" not in item:
+            try:
+                st = os.stat(item["path"])
+            except OSError:
+                return
+            item["stat"] = (st.st_mtime_ns, st.st_size)
+        size = item["stat"][1]
+        if max_file_size and size > max_file_size:
+            item["status"] = "rejected"
+            item["reason"] = "too_large"
+            yield item
+            return
+        if (
+            entry and not force
+            and (entry["mtime"], entry["size"]) == item["stat"]
+        ):
+            item["status"] = "skipped"
+            yield item
+            return
+        data = None
+        try:
+            if "data" in item:
+                data = item.pop("data")
+            elif reader is not None and size < MMAP_MIN_SIZE:
+                data = reader.read(item["oid"])
+                if data is None:
+                    raise ValueError(f"blob {item['oid']} não encontrado")
+            elif reader is not None:
+                item["stream"] = reader.open(item["oid"])
+            elif size < MMAP_MIN_SIZE:
+                with open(item["path"], "rb") as f:
+                    data = f.read()
+            if "stream" in item:
+                # Membro/blob grande: só o começo é lido aqui, o resto no
+                # chunk stage (o sha256 é calculado durante o chunking)
+                head = item["head"] = item["stream"].read(SNIFF_SIZE)
+            elif data is None:
+                # Arquivo grande: nunca inteiro na memória; o chunk stage
+                # relê em streaming
+                with open(item["path"], "rb") as f:
+                    head = f.read(SNIFF_SIZE)
+            else:
+                head = data[:SNIFF_SIZE]
+            # Binário: descartado antes de decodificar
+            if looks_binary(head):
+                item["status"] = "rejected"
+                item["reason"] = "binary"
+                yield item
+                return
+            if data is not None:
+                item["text"] = decode_text(data)
+                del data
+                item["sha256"] = sha256_text(item["text"])
+            elif "stream" not in item:
+                item["sha256"] = sha256_pieces(iter_file_text(item["path"]))
+        except Exception as e:
+            logger.warning(f"Falha ao ler {item['rel']}: {e}")
+            item["status"] = "failed"
+            yield item
+            return
+        # Só o mtime mudou (touch, checkout): nada a reindexar
+        unchanged = (
+            entry and not force and "sha256" in item
+            and entry["sha256"] == item["sha256"]
+        )
+        item["status"] = "touched" if unchanged else "changed"
+        yield item
+
+    extra: Dict[str, Any] = {"source": root_key}
+    if revision:
+        extra["revision"] = revision
+    elif archive:
+        extra["archive"] = base_dir
+    # Um arquivo grande segue em partes de até part_size pontos: as filas
+    # limitadas seguram o chunking, e o texto nunca fica todo na memória
+    part_size = 256
+
+    def chunk(item: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if item["status"] != "changed":
+            item.pop("text", None)
+            release(item)
+            item["parts"] = 1
+            yield {"file": item, "points": []}
+            return
+        rel, entry = item["rel"], item["entry"]
+        hasher = None
+        if "text" in item:
+            pieces: Iterable[str] = [item["text"]]
+        elif "stream" in item:
+            hasher = hashlib.sha256()
+            pieces = hashed_pieces(
+                iter_stream_text(item["stream"], item.pop("head")), hasher
             )
-            batch_vectors, batch_payloads, batch_ids = [], [], []
+        else:
+            pieces = iter_file_text(item["path"])
+        if tokenizer is not None:
+            item.pop("text", None)
+            chunks = iter_token_chunks(
+                pieces, tokenizer, chunk_tokens, overlap_tokens,
+            )
+        elif "text" in item and chunk_mode == "syntax":
+            chunks = iter_syntax_chunks(
+                rel, item.pop("text"), chunk_size, overlap
+            )
+        elif "text" in item:
+            chunks = iter_chunks(item.pop("text"), chunk_size, overlap)
+        else:
+            chunks = iter_chunks_stream(pieces, chunk_size, overlap)
+        # Upsert incompleto na execução anterior: reenvia todos os chunks
+        old_ids = (
+            set(entry["ids"])
+            if entry and not force and not entry.get("incomplete") else set()
+        )
+        # Nome gravado no Qdrant; ``rel`` segue como chave do manifest
+        name = payload_path(rel)
+        prefixes = path_ancestors(name)
+        item["ids"] = ids = []
+        item["n_embedded"] = 0
+        points: List[Tuple[str, Dict[str, Any]]] = []
+        parts = 0
+        try:
+            for i, (offset, text) in enumerate(chunks):
+                sha = sha256_text(text)
+                if shared:
+                    cid = shared_point_id(id_prefix, sha)
+                else:
+                    cid = point_id(id_prefix + name, i, sha)
+                # Quase cópia de um chunk já visto: some antes do embed e
+                # vira mais uma referência (``paths``) ao ponto original,
+                # que sobrevive enquanto qualquer um dos dois existir
+                similar = near.add(cid, text) if near is not None else None
+                if similar is not None and similar != cid:
+                    ids.append(similar)
+                    continue
+                ids.append(cid)
+                # Chunks idênticos na mesma posição mantêm o id: não
+                # reembedda
+                if cid in old_ids or (shared and not claim(cid, rel)):
+                    continue
+                if refs and not shared:
+                    # Gravado agora com paths=[rel]: só muda se outro
+                    # arquivo passar a referenciá-lo
+                    with stored_lock:
+                        claimed[cid] = rel
+                payload = {
+                    "path": name, "path_prefixes": prefixes,
+                    "chunk_index": i, "offset": offset, "text": text,
+                    **extra,
+                }
+                if refs:
+                    payload["paths"] = [name]
+                points.append((cid, payload))
+                if len(points) >= part_size:
+                    item["n_embedded"] += len(points)
+                    parts += 1
+                    yield {"file": item, "points": points}
+                    points = []
+        except OSError as e:
+            # Sumiu/mudou entre a leitura e o chunking: fica para a próxima
+            logger.warning(f"Falha ao ler {item['rel']}: {e}")
+            item["status"] = "failed"
+        else:
+            if hasher is not None:
+                item["sha256"] = hasher.hexdigest()
+        finally:
+            release(item)
+        item["n_embedded"] += len(points)
+        item["parts"] = parts + 1
+        yield {"file": item, "points": points}
+
+    def batch(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return batcher.add(item)
+
+    # Vetores já calculados (outra coleção, branch ou processo) vêm do
+    # cache em disco; só os que faltam vão para o modelo
+    if embed_cache is None and params.get("embed_cache", True):
+        embed_cache = EmbeddingCache.default()
+    cache_counts: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def embed_texts(texts: List[str]) -> Any:
+        if embed_cache is not None:
+            return embed_cache.embed(embeddings, texts, cache_counts)
+        return embeddings.embed(texts, as_numpy=np is not None)
+
+    def embed(batch: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if batch["texts"] and deduper is not None:
+            batch["vectors"] = deduper.embed(embed_texts, batch.pop("texts"))
+        elif batch["texts"]:
+            batch["vectors"] = embed_texts(batch.pop("texts"))
+        yield batch
+
+    pending: Dict[str, List[Any]] = {"ids": [], "vectors": [], "payloads": []}
+    pending_lock = threading.Lock()
+
+    def take_pending(min_size: int) -> Optional[Dict[str, List[Any]]]:
+        nonlocal pending
+        with pending_lock:
+            if not pending["ids"] or len(pending["ids"]) < min_size:
+                return None
+            batch = pending
+            pending = {"ids": [], "vectors": [], "payloads": []}
+            return batch
+
+    upsert_stats = {"retries": 0, "failed_batches": 0, "failed_points": 0}
+    failed_ids: Set[str] = set()
+
+    def send(batch: Optional[Dict[str, List[Any]]]) -> None:
+        if not batch:
+            return
+        for attempt in range(upsert_retries + 1):
+            try:
+                index.upsert(
+                    batch["ids"], batch["vectors"], batch["payloads"],
+                    vector_size=len(batch["vectors"][0]), wait=upsert_wait,
+                )
+                return
+            except ValueError:
+                # Dimensão errada etc.: repetir não adianta
+                raise
+            except Exception as e:
+                if attempt == upsert_retries:
+                    logger.error(
+                        f"Upsert de {len(batch['ids'])} pontos falhou "
+                        f"após {attempt + 1} tentativas: {e}"
+                    )
+                    with pending_lock:
+                        upsert_stats["failed_batches"] += 1
+                        upsert_stats["failed_points"] += len(batch["ids"])
+                        failed_ids.update(batch["ids"])
+                    return
+                with pending_lock:
+                    upsert_stats["retries"] += 1
+                delay = upsert_backoff * 2 ** attempt
+                logger.warning(
+                    f"Upsert falhou ({e}); nova tentativa em {delay:.1f}s"
+                )
+                time.sleep(delay * (0.5 + random.random()))
+
+    def upsert(batch: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        done = batch["done"]
+        if batch["refs"]:
+            with pending_lock:
+                for (item, j), vec in zip(batch["refs"], batch["vectors"]):
+                    cid, payload = item["points"][j]
+                    pending["ids"].append(cid)
+                    pending["vectors"].append(vec)
+                    pending["payloads"].append(payload)
+                    item["remaining"] -= 1
+                    if item["remaining"] == 0:
+                        del item["points"]
+                        done.append(item)
+            send(take_pending(256))
+        yield from done
+
+    def flush_upserts() -> List[Any]:
+        send(take_pending(1))
+        return []
+
+    reader = GitBlobReader(base_dir) if revision else None
+    pipeline = Pipeline([
+        Stage("read", read, workers["read"], workers["queue_size"]),
+        Stage("chunk", chunk, workers["chunk"], workers["queue_size"]),
+        # Um único worker: o acumulador de lotes tem estado
+        Stage("batch", batch, 1, workers["queue_size"], flush=batcher.flush),
+        # Com EmbeddingsPool, uma chamada em voo por processo de embeddings
+        Stage(
+            "embed", embed,
+            max(workers["embed"], getattr(embeddings, "workers", 1)),
+            workers["queue_size"],
+        ),
+        Stage(
+            "upsert", upsert, workers["upsert"], workers["queue_size"],
+            flush=flush_upserts,
+        ),
+    ])
+    # Manifest só é alterado aqui, na thread chamadora
+    try:
+        for part in pipeline.run(source()):
+            item = part["file"]
+            item["parts_done"] = item.get("parts_done", 0) + 1
+            # Arquivo em várias partes: só fecha quando todas chegaram
+            if item["parts_done"] != item.get("parts"):
+                continue
+            rel, entry = item["rel"], item["entry"]
+            mtime, size = item["stat"]
+            if item["status"] == "failed":
+                # Leitura falhou: incompleto, reindexado por inteiro na
+                # próxima execução; pontos já enviados ficam no manifest
+                ids = list(entry["ids"]) if entry else []
+                known_ids = set(ids)
+                ids += [i for i in item.get("ids", []) if i not in known_ids]
+                known[rel] = {
+                    "mtime": None, "size": size, "sha256": None,
+                    "ids": ids, "incomplete": True,
+                }
+                continue
+            if item["status"] == "rejected":
+                # Virou binário/grande demais: sai do índice
+                if entry:
+                    stale_ids.extend(known.pop(rel)["ids"])
+                rejected[item["reason"]] += 1
+                continue
+            if item["status"] == "changed" and entry and not force and (
+                entry["sha256"] == item["sha256"]
+            ):
+                # Stream (membro/blob grande) sem mudança no conteúdo: o
+                # sha256 só saiu no chunking, e nada foi reenviado
+                item["status"] = "touched"
+            if item["status"] != "changed":
+                if item["status"] == "touched":
+                    entry["mtime"], entry["size"] = mtime, size
+                skipped += 1
+                continue
+            if entry:
+                new_ids = set(item["ids"])
+                replaced[rel] = [i for i in entry["ids"] if i not in new_ids]
+            if refs:
+                updated_ids.update(item["ids"])
+            known[rel] = {
+                "mtime": mtime,
+                "size": size,
+                "sha256": item["sha256"],
+                "ids": item["ids"],
+            }
+            total_chunks += item["n_embedded"]
+            updated.add(rel)
+    finally:
+        if reader is not None:
+            reader.close()
+
+    # wait=False: só retorna depois que o Qdrant aplicou todos os upserts
+    if not upsert_wait:
+        index.barrier()
+    # Arquivos com pontos que não foram gravados: reindexados (todos os
+    # chunks) na próxima execução
+    failed_files = []
+    if failed_ids:
+        for rel, entry in known.items():
+            if not failed_ids.isdisjoint(entry["ids"]):
+                entry.update(mtime=None, sha256=None, incomplete=True)
+                failed_files.append(rel)
+        # Só em upsert_failed, não também em files_updated
+        updated.difference_update(failed_files)
+    # Pontos antigos de um arquivo regravado só saem se os novos foram
+    # gravados; senão seguem no manifest até a reindexação completar
+    failed_set = set(failed_files)
+    for rel, old in replaced.items():
+        if rel in failed_set:
+            known[rel]["ids"] = known[rel]["ids"] + old
+        else:
+            stale_ids.extend(old)
 
-    # Flush remaining
-    if batch_ids:
-        index.upsert(
-            batch_ids, batch_vectors, batch_payloads,
-            vector_size=len(batch_vectors[0])
+    # Arquivos que sumiram do diretório: remove seus pontos
+    deleted = [rel for rel in known if rel not in seen and in_scope(rel)]
+    for rel in deleted:
+        stale_ids.extend(known.pop(rel)["ids"])
+    shared_groups: Dict[Tuple[str, ...], List[str]] = {}
+    if refs:
+        # Um ponto pode servir vários arquivos: apagados no git saem pelo
+        # manifest (não por filtro de path) e só somem os pontos que
+        # nenhum arquivo referencia mais
+        for rel in removed:
+            entry = known.pop(rel, None)
+            if entry:
+                deleted.append(rel)
+                stale_ids.extend(entry["ids"])
+        removed = []
+        stale_ids, shared_groups = shared_refs(
+            known, stale_ids, updated_ids, claimed
         )
-    return {"files_indexed": len(files), "chunks": total_chunks}
+    if stale_ids and index.exists():
+        for i in range(0, len(stale_ids), 1000):
+            index.delete(stale_ids[i:i + 1000])
+    # Apagados no git: por filtro no payload ``path`` desta origem, o que
+    # também pega pontos que o manifest não conhece
+    points_deleted = len(stale_ids)
+    if removed:
+        deleted.extend(rel for rel in removed if known.pop(rel, None))
+        if index.exists():
+            points_deleted += index.delete_paths(removed, root_key)
+    if shared_groups and index.exists():
+        index.set_paths(shared_groups)
+    if git_commit:
+        root["git_commit"] = git_commit
+    manifest.save()
+
+    result = {
+        "files_indexed": len(seen),
+        "chunks": total_chunks,
+        "files_skipped": skipped,
+        "files_updated": len(updated),
+        "files_deleted": len(deleted),
+        "files_binary": rejected["binary"],
+        "files_too_large": rejected["too_large"],
+        "points_deleted": points_deleted,
+        "embed_batches": batcher.histogram(),
+        "elapsed_s": round(time.monotonic() - started, 3),
+    }
+    if tokenizer is not None:
+        result["chunk_tokens"] = chunk_tokens
+    if deduper is not None:
+        result["dedupe"] = dedupe
+        result["chunks_deduplicated"] = deduper.reused
+    if shared:
+        result["points_shared"] = folded
+    if near is not None:
+        result["chunks_near_duplicate"] = near.suppressed
+    if upsert_stats["retries"] or failed_ids:
+        result["upsert_retries"] = upsert_stats["retries"]
+    if failed_ids:
+        result["upsert_failed"] = {
+            "batches": upsert_stats["failed_batches"],
+            "points": upsert_stats["failed_points"],
+            "files": sorted(failed_files),
+        }
+    if embed_cache is not None:
+        looked_up = cache_counts["hits"] + cache_counts["misses"]
+        result["embed_cache"] = {
+            **cache_counts,
+            "hit_rate": (
+                round(cache_counts["hits"] / looked_up, 3)
+                if looked_up else 0.0
+            ),
+            "size_mb": embed_cache.size_mb,
+        }
+    if archive:
+        result["archive"] = base_dir
+    if revision:
+        result["revision"] = revision
+        result["commit"] = commit
+    if params.get("git_delta"):
+        result["git_commit"] = git_commit
+        result["git_delta_from"] = git_since
+    return result
 
 
 def handle_query(
-    params: Dict[str, Any], embeddings: Embeddings, index: QdrantIndex
+    params: Dict[str, Any], embeddings: Embeddings, index: QdrantIndex,
+    query_cache: Optional[QueryEmbeddingCache] = None,
+    result_cache: Optional[SearchResultCache] = None,
 ) -> Dict[str, Any]:
     text = params["text"]
     top_k = int(params.get("top_k") or 5)
     path_prefix = params.get("path_prefix")
-    vec = embeddings.embed([text])[0]
+    # Coleções quantizadas: candidatos extras pelos vetores quantizados e
+    # reordenação pelos originais
+    rescore = params.get("rescore")
+    oversampling = params.get("oversampling")
+    sp = search_params(
+        None if rescore is None else bool(rescore),
+        None if oversampling is None else float(oversampling),
+    )
+    key = None
+    if result_cache is not None and result_cache.enabled(index.collection):
+        key = (
+            index.collection, index.generation, embeddings_key(embeddings),
+            text, top_k, path_prefix, rescore, oversampling,
+        )
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+    if query_cache is not None:
+        vec = query_cache.embed(embeddings, text)
+    else:
+        vec = embed_query(embeddings, text)
     flt = build_filter(path_prefix)
-    hits = index.search(vec, top_k=top_k, filter_=flt)
+    hits = index.search(vec, top_k=top_k, filter_=flt, params=sp)
     out = []
     for h in hits:
         payload = h.payload or {}
@@ -356,6 +3996,10 @@ def handle_query(
             "path": payload.get("path"),
             "text": payload.get("text", "")[:600],
         })
+        if len(payload.get("paths") or ()) > 1:
+            out[-1]["paths"] = payload["paths"]
+    if key is not None:
+        result_cache.put(key, {"hits": out})
     return {"hits": out}
 
 
@@ -376,24 +4020,89 @@ def main():
     embeddings_provider = os.getenv('EMBEDDINGS_PROVIDER', 'fastembed')
     logger.info(f"Embeddings provider: {embeddings_provider}")
         
-    emb: Optional[Embeddings] = None
+    emb: Optional[Any] = None
     indexes: Dict[str, QdrantIndex] = {}
+    manifests: Dict[str, IngestManifest] = {}
+    # Handlers rodam em threads: estado compartilhado protegido por locks
+    state_lock = threading.Lock()
+    ingest_locks: Dict[str, threading.Lock] = {}
+    stdout_lock = threading.Lock()
+    query_cache = QueryEmbeddingCache.from_env()
+    result_cache = SearchResultCache.from_env()
 
-    def get_embeddings() -> Embeddings:
+    def get_embeddings() -> Any:
         nonlocal emb
-        if emb is None:
-            logger.info("Initializing embeddings model...")
-            emb = Embeddings()
-            logger.info("Embeddings model ready")
-        return emb
+        with state_lock:
+            if emb is None:
+                logger.info("Initializing embeddings model...")
+                emb = make_embeddings()
+                logger.info("Embeddings model ready")
+            return emb
 
     def get_index(coll: str) -> QdrantIndex:
-        idx = indexes.get(coll)
-        if idx is None:
-            logger.info(f"Creating index for collection: {coll}")
-            idx = QdrantIndex(client, coll)
-            indexes[coll] = idx
-        return idx
+        with state_lock:
+            idx = indexes.get(coll)
+            if idx is None:
+                logger.info(f"Creating index for collection: {coll}")
+                idx = QdrantIndex(client, coll)
+                indexes[coll] = idx
+                manifests[coll] = IngestManifest(coll)
+                ingest_locks[coll] = threading.Lock()
+            return idx
+
+    def write(resp: Dict[str, Any]) -> None:
+        line = json.dumps(resp) + "\n"
+        with stdout_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def call_tool(name: str, args: Dict[str, Any]) -> Any:
+        if name == "ingest":
+            coll = args.get("collection") or collection
+            idx = get_index(coll)
+            # Um ingest por vez por coleção (manifest compartilhado)
+            with ingest_locks[coll]:
+                return handle_ingest(
+                    args, get_embeddings(), idx, manifests[coll]
+                )
+        elif name == "query":
+            coll = args.get("collection") or collection
+            idx = get_index(coll)
+            return handle_query(
+                args, get_embeddings(), idx, query_cache, result_cache
+            )
+        elif name == "stats":
+            embed_cache = EmbeddingCache.default()
+            return {
+                "embedding_cache": (
+                    embed_cache.stats() if embed_cache else None
+                ),
+                "query_embedding_cache": query_cache.stats(),
+                "search_result_cache": result_cache.stats(),
+            }
+        logger.error(f"Tool not found: {name}")
+        raise ValueError(f"Tool not found: {name}")
+
+    def run_call(id_: Any, name: str, args: Dict[str, Any]) -> None:
+        try:
+            res = call_tool(name, args)
+            logger.debug(f"Tool '{name}' executed successfully")
+            write(mcp_response(id_, res))
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            write(mcp_response(id_, error=str(e)))
+
+    # Um pool por tipo de tool: um ingest longo não bloqueia as queries
+    executors = {
+        "ingest": ThreadPoolExecutor(
+            max_workers=int(os.getenv("MCP_INGEST_CONCURRENCY", "1")),
+            thread_name_prefix="mcp-ingest",
+        ),
+        "query": ThreadPoolExecutor(
+            max_workers=int(os.getenv("MCP_QUERY_CONCURRENCY", "4")),
+            thread_name_prefix="mcp-query",
+        ),
+    }
 
     # MCP stdio loop (jsonrpc 2.0 minimal)
     logger.info("MCP server ready - waiting for requests...")
@@ -411,44 +4120,16 @@ def main():
             method = req.get("method")
             params = req.get("params") or {}
 
-            try:
-                if method == "tools/list":
-                    res = mcp_list_tools()
-                    sys.stdout.write(json.dumps(mcp_response(id_, res)) + "\n")
-                    sys.stdout.flush()
-                elif method == "tools/call":
-                    name = params.get("name")
-                    args = params.get("arguments") or {}
-                    if name == "ingest":
-                        coll = args.get("collection") or collection
-                        idx = get_index(coll)
-                        res = handle_ingest(args, get_embeddings(), idx)
-                    elif name == "query":
-                        coll = args.get("collection") or collection
-                        idx = get_index(coll)
-                        res = handle_query(args, get_embeddings(), idx)
-                    else:
-                        logger.error(f"Tool not found: {name}")
-                        raise ValueError(f"Tool not found: {name}")
-                    
-                    logger.debug(f"Tool '{name}' executed successfully")
-                    sys.stdout.write(json.dumps(mcp_response(id_, res)) + "\n")
-                    sys.stdout.flush()
-                else:
-                    logger.warning(f"Method not supported: {method}")
-                    sys.stdout.write(
-                        json.dumps(
-                            mcp_response(id_, error="Method not supported")
-                        )
-                        + "\n"
-                    )
-                    sys.stdout.flush()
-            except Exception as e:
-                logger.error(f"Error processing request: {str(e)}")
-                sys.stdout.write(
-                    json.dumps(mcp_response(id_, error=str(e))) + "\n"
-                )
-                sys.stdout.flush()
+            if method == "tools/list":
+                write(mcp_response(id_, mcp_list_tools()))
+            elif method == "tools/call":
+                name = params.get("name")
+                args = params.get("arguments") or {}
+                pool = executors.get(name, executors["query"])
+                pool.submit(run_call, id_, name, args)
+            else:
+                logger.warning(f"Method not supported: {method}")
+                write(mcp_response(id_, error="Method not supported"))
     except (OSError, ValueError) as e:
         # stdin not available (running as daemon) - exit gracefully
         logger.info(f"MCP server stopping: {str(e)}")
@@ -459,7 +4140,15 @@ def main():
     except Exception as e:
         logger.error(f"Unexpected error in MCP server: {str(e)}")
         pass
-    
+
+    # EOF: responde o que ainda está em andamento antes de sair
+    for pool in executors.values():
+        pool.shutdown(wait=True)
+    if emb is not None and hasattr(emb, "close"):
+        emb.close()
+    query_cache.save()
+    logger.info(f"Query embedding cache: {query_cache.stats()}")
+    logger.info(f"Search result cache: {result_cache.stats()}")
     logger.info("MCP server shutdown complete")
 
 
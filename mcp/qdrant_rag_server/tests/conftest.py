@@ -0,0 +1,81 @@
+"""Fixtures compartilhados: Qdrant em memória e embeddings determinísticos
+(sem modelo nem servidor)."""
+
+import hashlib
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+class FakeEmbeddings:
+    """Vetor de 8 dimensões derivado do sha256 do texto."""
+
+    provider = "fake"
+    model_name = "fake"
+
+    def embed(self, texts, as_numpy=False):
+        rows = [
+            [b / 255.0 + 0.01 for b in hashlib.sha256(t.encode()).digest()[:8]]
+            for t in texts
+        ]
+        if as_numpy:
+            import numpy as np
+
+            return np.asarray(rows, dtype=np.float32)
+        return rows
+
+
+class LockedClient:
+    """O QdrantClient em memória não é thread-safe (o HTTP é)."""
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return locked
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    state = tmp_path / "state"
+    monkeypatch.setenv("INGEST_STATE_DIR", str(state))
+    monkeypatch.setenv("EMBED_CACHE_MAX_MB", "0")
+    return state
+
+
+@pytest.fixture
+def client():
+    from qdrant_client import QdrantClient
+
+    return LockedClient(QdrantClient(":memory:"))
+
+
+@pytest.fixture
+def index(client):
+    return server.QdrantIndex(client, "test")
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+def payloads(client, collection="test"):
+    """Payloads de todos os pontos da coleção."""
+    points, _ = client.scroll(collection, limit=10000)
+    return [p.payload for p in points]
@@ -0,0 +1,57 @@
+import pytest
+
+import server
+
+
+class ThresholdSpy:
+    """Simula o indexing_threshold do servidor (o modo em memória o
+    ignora) e registra cada update_collection."""
+
+    def __init__(self, client, threshold):
+        self._client = client
+        self.threshold = threshold
+        self.updates = []
+
+    def get_collection(self, collection_name):
+        info = self._client.get_collection(collection_name)
+        info.config.optimizer_config.indexing_threshold = self.threshold
+        return info
+
+    def update_collection(self, **kwargs):
+        self.threshold = kwargs["optimizers_config"].indexing_threshold
+        self.updates.append(self.threshold)
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+@pytest.mark.parametrize("original", [0, 500, 20000])
+def test_bulk_load_restores_original_threshold(client, original):
+    spy = ThresholdSpy(client, original)
+    server.QdrantIndex(spy, "test").ensure(8)
+    index = server.QdrantIndex(spy, "test")
+
+    index.begin_bulk_load()
+    assert spy.threshold == 0
+    assert index.end_bulk_load() == original
+    assert spy.threshold == original
+
+
+@pytest.mark.parametrize("original", [0, 500])
+def test_cli_bulk_load_done_restores_previous_threshold(
+    client, original, monkeypatch
+):
+    import qdrant_create_db
+
+    monkeypatch.setenv("QDRANT_INDEXING_THRESHOLD", "7000")
+    spy = ThresholdSpy(client, original)
+    server.QdrantIndex(spy, "test").ensure(8)
+
+    assert qdrant_create_db.bulk_load_threshold(spy, "test", False) == 0
+    spy.threshold = 0
+    # --bulk-load repetido não perde o valor de antes da carga
+    assert qdrant_create_db.bulk_load_threshold(spy, "test", False) == 0
+    assert qdrant_create_db.bulk_load_threshold(spy, "test", True) == original
+    # Sem registro (já restaurado): env/default
+    assert qdrant_create_db.bulk_load_threshold(spy, "test", True) == 7000
@@ -0,0 +1,136 @@
+import os
+import random
+import re
+
+import pytest
+
+import server
+
+
+def pieces(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def sample_text(n, seed=0):
+    rng = random.Random(seed)
+    words = ["a", "bb", "palavra", "subpalavras", "x" * 25, "é", "\n", "  "]
+    return "".join(rng.choice(words) + " " for _ in range(n))
+
+
+TEXTS = ["", "a", "abc", "0123456789" * 37, sample_text(400)]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("chunk_size, overlap", [
+    (1, 0), (7, 3), (10, 0), (10, 9), (100, 20), (0, 0), (5000, 100),
+])
+@pytest.mark.parametrize("piece", [1, 3, 64, 10 ** 6])
+def test_iter_chunks_stream_equals_iter_chunks(text, chunk_size, overlap,
+                                               piece):
+    expected = list(server.iter_chunks(text, chunk_size, overlap))
+    got = list(server.iter_chunks_stream(
+        pieces(text, piece), chunk_size, overlap
+    ))
+    assert got == expected
+
+
+def subword_tokenizer(max_tokens):
+    """Tokens de até 3 caracteres não brancos: palavras longas viram
+    vários tokens, nem todos no início de uma palavra."""
+    def starts(segments):
+        return [[m.start() for m in re.finditer(r"\S{1,3}", s)]
+                for s in segments]
+
+    return server.ChunkTokenizer("fake", max_tokens, starts)
+
+
+def n_tokens(text):
+    return len(re.findall(r"\S{1,3}", text))
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    # Vários lotes de segmentos mesmo em textos curtos
+    monkeypatch.setattr(server, "TOKEN_SEGMENT", 64)
+    monkeypatch.setattr(server, "TOKEN_BATCH", 3)
+
+
+@pytest.mark.parametrize("text", TEXTS[1:] + [sample_text(2000, seed=1)])
+@pytest.mark.parametrize("max_tokens, overlap", [
+    (4, 0), (16, 0), (16, 4), (64, 0), (64, 16), (10 ** 6, 0),
+])
+def test_iter_token_chunks(small_batches, text, max_tokens, overlap):
+    tokenizer = subword_tokenizer(max_tokens)
+    chunks = list(server.iter_token_chunks([text], tokenizer, 0, overlap))
+
+    assert chunks
+    offsets = [off for off, _ in chunks]
+    assert offsets == sorted(set(offsets)) and offsets[0] == 0
+    for off, chunk in chunks:
+        assert text[off:off + len(chunk)] == chunk
+        assert n_tokens(chunk) <= max_tokens
+    # Cada chunk vai até onde o próximo começa ou além (overlap)
+    for (off, chunk), (nxt, _) in zip(chunks, chunks[1:]):
+        assert off + len(chunk) >= nxt
+    assert chunks[-1][0] + len(chunks[-1][1]) == len(text)
+    if not overlap:
+        assert "".join(c for _, c in chunks) == text
+
+    for piece in (1, 5, 333):
+        streamed = server.iter_token_chunks(
+            pieces(text, piece), tokenizer, 0, overlap
+        )
+        assert list(streamed) == chunks, piece
+
+
+def test_iter_token_chunks_max_tokens_overrides_window(small_batches):
+    text = sample_text(300)
+    tokenizer = subword_tokenizer(10 ** 6)
+    chunks = list(server.iter_token_chunks([text], tokenizer, 8))
+    assert len(chunks) > 1
+    assert all(n_tokens(c) <= 8 for _, c in chunks)
+
+
+@pytest.mark.parametrize("text", ["", "   ", "\n\n"])
+def test_iter_token_chunks_without_tokens(text):
+    assert list(server.iter_token_chunks([text], subword_tokenizer(4))) == []
+
+
+PACK_CASES = [
+    # Unidades pequenas: agrupadas até chunk_size
+    ("a\n" * 10, [2, 4, 6, 8, 10, 12, 14, 16, 18], 8, 0,
+     ["a\na\na\na\n"] * 2 + ["a\na\n"]),
+    # Fecha na fronteira quando já passou do piso (8 - 1 = 7)
+    ("aaaaaaa\nbbbbbbb\n", [8], 10, 0, ["aaaaaaa\n", "bbbbbbb\n"]),
+    # Abaixo do piso: completa com linhas da próxima unidade
+    ("aa\nbbb\nccc\nddd\n", [3], 10, 2, ["aa\nbbb\n", "ccc\nddd\n"]),
+    # Linha maior que o chunk: janelas fixas com overlap
+    ("x" * 12, [], 5, 1, ["xxxxx", "xxxxx", "xxxx"]),
+    # Só espaço em branco: descartado
+    ("a\n   \n\n", [2], 3, 0, ["a\n"]),
+]
+
+
+@pytest.mark.parametrize("text, bounds, size, overlap, expected",
+                         PACK_CASES)
+def test_pack_units(text, bounds, size, overlap, expected):
+    chunks = list(server.pack_units(text, bounds, size, overlap))
+    assert [c for _, c in chunks] == expected
+    for off, chunk in chunks:
+        assert text[off:off + len(chunk)] == chunk
+
+
+def test_syntax_chunking_not_more_chunks_than_chars():
+    import bench_chunking
+
+    files = bench_chunking.load_files(
+        os.path.join(os.path.dirname(server.__file__), "..", "..")
+    )
+    chars = syntax = 0
+    for rel, text in files:
+        chars += len(list(server.iter_chunks(text, 800, 100)))
+        chunks = list(server.iter_syntax_chunks(rel, text, 800, 100))
+        syntax += len(chunks)
+        for off, chunk in chunks:
+            assert text[off:off + len(chunk)] == chunk
+    assert files and syntax <= chars
@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+from conftest import FakeEmbeddings
+
+import server
+
+
+@pytest.fixture
+def pool():
+    """EmbeddingsPool sem workers: a fila de tarefas falha se for usada."""
+    pool = server.EmbeddingsPool.__new__(server.EmbeddingsPool)
+    pool._local = FakeEmbeddings()
+    pool._local_lock = threading.Lock()
+
+    def submit(texts):
+        raise AssertionError("query enfileirada atrás do ingest")
+
+    pool._submit = submit
+    return pool
+
+
+def test_query_skips_the_worker_queue(pool):
+    expected = FakeEmbeddings().embed(["q"])[0]
+    assert server.embed_query(pool, "q") == expected
+
+
+def test_query_cache_uses_the_priority_path(pool):
+    cache = server.QueryEmbeddingCache(max_size=4)
+    assert cache.embed(pool, "q") == cache.embed(pool, "q")
+    assert cache.hits == 1
+
+
+def test_plain_embeddings_keep_embed():
+    assert server.embed_query(FakeEmbeddings(), "q") == \
+        FakeEmbeddings().embed(["q"])[0]
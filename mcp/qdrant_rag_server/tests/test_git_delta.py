@@ -0,0 +1,73 @@
+import os
+import subprocess
+
+from conftest import payloads
+
+import server
+
+
+def git(repo, *args):
+    subprocess.run(
+        ["git", "-C", str(repo), "-c", "user.name=t", "-c", "user.email=t@t",
+         *args],
+        check=True, capture_output=True,
+    )
+
+
+def make_repo(path):
+    (path / "docs").mkdir(parents=True)
+    (path / "docs" / "a.md").write_text("# A\n\nshared text\n")
+    (path / "keep.md").write_text("keep\n")
+    git(path, "init", "-q")
+    git(path, "add", ".")
+    git(path, "commit", "-qm", "1")
+
+
+def test_removed_file_only_deletes_points_of_its_root(
+    tmp_path, client, index, embeddings
+):
+    # Duas raízes na mesma coleção com o mesmo path relativo (e conteúdo)
+    repo, other = tmp_path / "repo", tmp_path / "other"
+    make_repo(repo)
+    make_repo(other)
+    server.handle_ingest({"directory": str(other)}, embeddings, index)
+    params = {"directory": str(repo), "git_delta": True}
+    server.handle_ingest(params, embeddings, index)
+    before = [p for p in payloads(client) if p["path"] == "docs/a.md"]
+    assert {p["source"] for p in before} == {str(repo), str(other)}
+
+    git(repo, "rm", "-q", "docs/a.md")
+    git(repo, "commit", "-qm", "2")
+    result = server.handle_ingest(params, embeddings, index)
+
+    assert result["files_deleted"] == 1
+    assert result["points_deleted"] == len(before) // 2
+    after = [p for p in payloads(client) if p["path"] == "docs/a.md"]
+    assert after and {p["source"] for p in after} == {str(other)}
+
+
+def test_non_utf8_path_names(tmp_path, client, index, embeddings):
+    repo = tmp_path / "repo"
+    make_repo(repo)
+    params = {"directory": str(repo), "git_delta": True}
+    server.handle_ingest(params, embeddings, index)
+
+    # Nome em latin-1: bytes que não são UTF-8 válido
+    name = b"caf\xe9.md"
+    with open(bytes(repo) + b"/" + name, "w") as f:
+        f.write("cafe\n")
+    git(repo, "add", ".")
+    git(repo, "commit", "-qm", "2")
+    result = server.handle_ingest(params, embeddings, index)
+
+    assert result["git_delta_from"] is not None
+    assert result["files_updated"] == 1
+    changed, _ = server.git_changed_paths(str(repo), "HEAD~1")
+    assert changed == [os.fsdecode(name)]
+    # No Qdrant o nome vira UTF-8 válido; apagar no git remove os pontos
+    assert "caf\\xe9.md" in {p["path"] for p in payloads(client)}
+    git(repo, "rm", "-q", os.fsdecode(name))
+    git(repo, "commit", "-qm", "3")
+    result = server.handle_ingest(params, embeddings, index)
+    assert result["files_deleted"] == 1
+    assert "caf\\xe9.md" not in {p["path"] for p in payloads(client)}
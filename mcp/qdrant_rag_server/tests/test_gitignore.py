@@ -0,0 +1,62 @@
+import shutil
+import subprocess
+
+import pytest
+
+import server
+
+PATHS = [
+    "x.log", "a/x.log", "build", "build/x.py", "src/build", "src/build/y",
+    "doc/a.txt", "doc/sub/a.txt", "a/doc/a.txt", "foo", "x/foo",
+    "x/foo/bar", "foo/bar", "a/b", "a/x/b", "a/x/y/b", "x.pyc", "x.pyo",
+    "a.md", "ab.md", "#x", "src/a/gen", "src/a/b/gen", "lib/a.js",
+    "lib/x/y/a.js", "b.c", "a.c", "debug1.log", "debuga.log", "abc",
+    "abc/d", "a b", "!x",
+]
+
+PATTERNS = [
+    "*.log", "build", "/build", "src/build", "doc/*.txt", "**/foo",
+    "foo/**", "a/**/b", "*.py[co]", "?.md", "\\#x", "src/*/gen",
+    "lib/**/*.js", "[!a]*.c", "debug[0-9].log", "abc/**", "**", "a\\ b",
+    "\\!x", "x/foo/*",
+]
+
+
+def ignored(line, path):
+    """Como o walker: o caminho ou um diretório acima dele casa."""
+    # A linha passa pelo parser de IgnoreRules ("\\" inicial, espaços)
+    ((rx, _, _),) = server.IgnoreRules([line]).rules
+    parts = path.split("/")
+    return any(
+        rx.fullmatch("/".join(parts[:i])) for i in range(1, len(parts) + 1)
+    )
+
+
+def git_ignored(repo, pattern):
+    (repo / ".gitignore").write_text(pattern + "\n")
+    out = subprocess.run(
+        ["git", "-C", str(repo), "check-ignore", "--no-index", "-v", "-n",
+         "--stdin"],
+        input="\n".join(PATHS) + "\n", capture_output=True, text=True,
+    ).stdout
+    # "<origem>:<linha>:<padrão>\t<path>"; "::\t<path>" se nada casou
+    return {
+        line.split("\t", 1)[1]: not line.startswith("::")
+        for line in out.splitlines()
+    }
+
+
+@pytest.fixture(scope="module")
+def repo(tmp_path_factory):
+    if shutil.which("git") is None:
+        pytest.skip("git não encontrado")
+    path = tmp_path_factory.mktemp("repo")
+    subprocess.run(["git", "init", "-q", str(path)], check=True)
+    return path
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_gitignore_to_regex_agrees_with_git(repo, pattern):
+    expected = git_ignored(repo, pattern)
+    assert set(expected) == set(PATHS) and any(expected.values())
+    assert {path: ignored(pattern, path) for path in PATHS} == expected
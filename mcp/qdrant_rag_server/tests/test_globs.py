@@ -0,0 +1,62 @@
+import fnmatch
+import re
+
+import pytest
+
+import server
+
+# Sem "**/": mesma semântica do fnmatch (o "*" atravessa "/")
+FNMATCH_CASES = [
+    ("*.md", ["README.md", "docs/a.md", "a.mdx", "md"]),
+    ("docs/*", ["docs/a.md", "docs/sub/a.md", "docs", "x/docs/a"]),
+    ("?.py", ["a.py", "ab.py", ".py", "a/b.py"]),
+    ("*.py[co]", ["a.pyc", "a.pyo", "a.py", "a.pyx"]),
+    ("data[!0-9].csv", ["dataa.csv", "data1.csv", "data.csv"]),
+    ("a[]]b", ["a]b", "ab"]),
+    ("[^a]x", ["^x", "ax", "bx"]),
+    ("a[b", ["a[b", "ab"]),
+    ("a+b(c).txt", ["a+b(c).txt", "aab(c).txt"]),
+    ("**", ["a", "a/b/c", ""]),
+]
+
+
+@pytest.mark.parametrize("pattern, paths", FNMATCH_CASES)
+def test_glob_to_regex_matches_fnmatch(pattern, paths):
+    rx = re.compile(server.glob_to_regex(pattern), re.DOTALL)
+    for path in paths:
+        expected = fnmatch.fnmatchcase(path, pattern)
+        assert bool(rx.fullmatch(path)) == expected, (pattern, path)
+
+
+# "**/" também casa zero diretórios
+DOUBLE_STAR_CASES = [
+    ("**/*.md", "README.md", True),
+    ("**/*.md", "docs/a/b.md", True),
+    ("**/*.md", "docs/a.txt", False),
+    ("docs/**/*.md", "docs/a.md", True),
+    ("docs/**/*.md", "docs/x/y/a.md", True),
+    ("docs/**/*.md", "other/a.md", False),
+    ("**/node_modules/**", "node_modules/x.js", True),
+    ("**/node_modules/**", "a/node_modules/b/x.js", True),
+    ("**/node_modules/**", "a/node_modules_x/b.js", False),
+    ("**/test_*.py", "tests/test_a.py", True),
+    ("**/test_*.py", "test_a.py", True),
+]
+
+
+@pytest.mark.parametrize("pattern, path, expected", DOUBLE_STAR_CASES)
+def test_glob_to_regex_double_star(pattern, path, expected):
+    assert server.match_globs(path, [pattern]) is expected
+
+
+@pytest.mark.parametrize("excludes, rel_dir, pruned", [
+    (["**/node_modules/**"], "node_modules", True),
+    (["**/node_modules/**"], "a/node_modules", True),
+    (["**/node_modules/**"], "a/node_modules_x", False),
+    (["build/*"], "build", True),
+    (["build/*"], "src/build", False),
+    # Sem "*" no fim algo dentro ainda poderia ser incluído
+    (["**/*.log"], "logs", False),
+])
+def test_glob_matcher_prune_dir(excludes, rel_dir, pruned):
+    assert server.GlobMatcher([], excludes).prune_dir(rel_dir) is pruned
@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import payloads
+
+import server
+
+
+class Unreachable(Exception):
+    pass
+
+
+class FlakyClient:
+    """Repassa ao cliente real até ``down`` ficar True; aí toda chamada
+    falha como um servidor fora do ar."""
+
+    def __init__(self, client):
+        self._client = client
+        self.down = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+
+        def call(*args, **kwargs):
+            if self.down:
+                raise Unreachable("connection refused")
+            return attr(*args, **kwargs)
+
+        return call
+
+
+def test_unreachable_server_does_not_reset_manifest(tmp_path, client,
+                                                    embeddings):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.md").write_text("# a\n\ntexto\n")
+    flaky = FlakyClient(client)
+    index = server.QdrantIndex(flaky, "test")
+    manifest = server.IngestManifest("test")
+    server.handle_ingest({"directory": str(src)}, embeddings, index, manifest)
+    files = dict(manifest.root(str(src))["files"])
+    assert files
+
+    flaky.down = True
+    with pytest.raises(Unreachable):
+        server.handle_ingest(
+            {"directory": str(src)}, embeddings, index, manifest
+        )
+
+    flaky.down = False
+    assert server.IngestManifest("test").root(str(src))["files"] == files
+    result = server.handle_ingest(
+        {"directory": str(src)}, embeddings, index, manifest
+    )
+    assert result["files_skipped"] == 1 and result["files_updated"] == 0
+    assert len(payloads(client)) == 1
+
+
+def test_missing_collection_resets_manifest(tmp_path, client, index,
+                                            embeddings):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.md").write_text("# a\n\ntexto\n")
+    server.handle_ingest({"directory": str(src)}, embeddings, index)
+    client.delete_collection("test")
+
+    result = server.handle_ingest({"directory": str(src)}, embeddings, index)
+
+    assert result["files_updated"] == 1
+    assert len(payloads(client)) == 1
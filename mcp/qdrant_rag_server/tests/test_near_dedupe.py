@@ -0,0 +1,75 @@
+from conftest import payloads
+
+import server
+
+BODY = " ".join(f"palavra{i}" for i in range(200))
+
+
+def write_pair(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "m1.txt").write_text(BODY + " original\n")
+    (src / "m2.txt").write_text(BODY + " copia\n")
+    return src
+
+
+def ingest(src, embeddings, index, **params):
+    return server.handle_ingest(
+        {"directory": str(src), "include_globs": ["*.txt"],
+         "near_dedupe": 0.8, "chunk_size": 4000, **params},
+        embeddings, index,
+    )
+
+
+def test_near_duplicate_references_original(tmp_path, client, index,
+                                            embeddings):
+    src = write_pair(tmp_path)
+    result = ingest(src, embeddings, index)
+
+    assert result["chunks_near_duplicate"] == 1
+    (point,) = payloads(client)
+    assert sorted(point["paths"]) == ["m1.txt", "m2.txt"]
+
+
+def test_deleting_original_keeps_duplicate_searchable(tmp_path, client,
+                                                      index, embeddings):
+    src = write_pair(tmp_path)
+    ingest(src, embeddings, index)
+    original = payloads(client)[0]["path"]
+    (src / original).unlink()
+
+    result = ingest(src, embeddings, index)
+
+    assert result["files_deleted"] == 1
+    (point,) = payloads(client)
+    survivor = ({"m1.txt", "m2.txt"} - {original}).pop()
+    assert point["path"] == survivor and point["paths"] == [survivor]
+
+
+def test_editing_original_keeps_duplicate(tmp_path, client, index,
+                                          embeddings):
+    src = write_pair(tmp_path)
+    ingest(src, embeddings, index)
+    original = payloads(client)[0]["path"]
+    (src / original).write_text("outro texto, nada a ver\n")
+
+    ingest(src, embeddings, index)
+
+    by_path = {p["path"]: p for p in payloads(client)}
+    assert set(by_path) == {"m1.txt", "m2.txt"}
+    assert by_path[original]["text"].startswith("outro texto")
+
+
+def test_signature_index_is_bounded():
+    near = server.NearDuplicateIndex(0.9, max_chunks=2)
+    for i in range(5):
+        near.add(str(i), f"texto {i} " + " ".join(map(str, range(i * 50))))
+    assert len(near._sigs) == 2
+
+
+def test_chunks_without_words_are_not_near_duplicates():
+    near = server.NearDuplicateIndex(0.9)
+    assert near.signature("  ---\n*** ...") is None
+    assert near.add("a", "----------\n") is None
+    assert near.add("b", "  ***  ;;\n") is None
+    assert near.suppressed == 0 and not near._sigs
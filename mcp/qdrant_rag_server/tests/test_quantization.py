@@ -0,0 +1,54 @@
+import pytest
+
+import server
+
+
+class UpdateSpy:
+    def __init__(self, client):
+        self._client = client
+        self.updates = []
+
+    def update_collection(self, **kwargs):
+        self.updates.append(kwargs["quantization_config"])
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+@pytest.mark.parametrize("mode, kind", [
+    ("none", type(None)),
+    ("scalar", server.qm.ScalarQuantization),
+    ("binary", server.qm.BinaryQuantization),
+])
+def test_quantization_config(mode, kind):
+    assert isinstance(server.quantization_config(mode), kind)
+
+
+def test_quantization_config_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        server.quantization_config("product")
+
+
+def test_set_quantization_compares_full_config(client):
+    spy = UpdateSpy(client)
+    index = server.QdrantIndex(spy, "test")
+    index.set_quantization("scalar", True)
+    index.ensure(8)
+
+    assert not index.set_quantization("scalar", True)
+    assert index.set_quantization("scalar", False)
+    assert spy.updates[-1].scalar.always_ram is False
+    assert not index.set_quantization("scalar", False)
+    assert index.set_quantization("none")
+    assert len(spy.updates) == 2
+
+
+def test_search_params(monkeypatch):
+    monkeypatch.delenv("QDRANT_RESCORE", raising=False)
+    monkeypatch.delenv("QDRANT_OVERSAMPLING", raising=False)
+    assert server.search_params() is None
+    params = server.search_params(True, 2.0).quantization
+    assert (params.rescore, params.oversampling) == (True, 2.0)
+    monkeypatch.setenv("QDRANT_OVERSAMPLING", "4")
+    assert server.search_params().quantization.oversampling == 4.0
@@ -0,0 +1,118 @@
+import tarfile
+import tempfile
+import zipfile
+
+import pytest
+
+from conftest import payloads
+from test_git_delta import git
+
+import server
+
+
+@pytest.fixture
+def tmp_dir(tmp_path, monkeypatch):
+    # Nada do archive ou da revisão vai para o disco
+    path = tmp_path / "tmp"
+    path.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(path))
+    return path
+
+
+def make_tree(path):
+    path.mkdir()
+    # Maior que MMAP_MIN_SIZE: lido em streaming
+    lines = (f"linha {i} do arquivo grande\n" for i in range(50000))
+    (path / "big.txt").write_text("".join(lines))
+    assert (path / "big.txt").stat().st_size > server.MMAP_MIN_SIZE
+    (path / "small.md").write_text("# pequeno\n\ntexto\n")
+
+
+def chunks(client, collection):
+    return sorted(
+        (p["path"], p["offset"], p["text"])
+        for p in payloads(client, collection)
+    )
+
+
+def ingest(params, client, collection, embeddings):
+    index = server.QdrantIndex(client, collection)
+    return server.handle_ingest(params, embeddings, index)
+
+
+def test_large_members_and_blobs_match_directory(
+    tmp_path, tmp_dir, client, embeddings
+):
+    src = tmp_path / "src"
+    make_tree(src)
+    ingest({"directory": str(src)}, client, "dir", embeddings)
+    expected = chunks(client, "dir")
+
+    tar, zf = tmp_path / "src.tar.gz", tmp_path / "src.zip"
+    with tarfile.open(tar, "w:gz") as t:
+        t.add(src, arcname=".")
+    with zipfile.ZipFile(zf, "w") as z:
+        for f in src.iterdir():
+            z.write(f, f.name)
+    git(src, "init", "-q")
+    git(src, "add", ".")
+    git(src, "commit", "-qm", "1")
+
+    for name, params in [
+        ("tar", {"archive": str(tar)}),
+        ("zip", {"archive": str(zf)}),
+        ("rev", {"directory": str(src), "revision": "HEAD"}),
+    ]:
+        result = ingest(params, client, name, embeddings)
+        assert result["files_updated"] == 2, name
+        assert chunks(client, name) == expected, name
+    assert not list(tmp_dir.iterdir())
+
+
+def test_unchanged_large_member_is_skipped(tmp_path, client, embeddings):
+    src = tmp_path / "src"
+    make_tree(src)
+    tar = tmp_path / "src.tar"
+    with tarfile.open(tar, "w") as t:
+        t.add(src, arcname=".")
+    ingest({"archive": str(tar)}, client, "tar", embeddings)
+    # Mesmo conteúdo, mtime novo: relido em streaming, mas nada reenviado
+    with tarfile.open(tar, "w") as t:
+        for f in sorted(src.iterdir()):
+            info = t.gettarinfo(f, f.name)
+            info.mtime += 60
+            with open(f, "rb") as fh:
+                t.addfile(info, fh)
+
+    result = ingest({"archive": str(tar)}, client, "tar", embeddings)
+
+    assert result["files_updated"] == 0 and result["files_skipped"] == 2
+    assert result["chunks"] == 0
+
+
+def test_git_blob_stream(tmp_path):
+    repo = tmp_path / "repo"
+    make_tree(repo)
+    git(repo, "init", "-q")
+    git(repo, "add", ".")
+    git(repo, "commit", "-qm", "1")
+    blobs = {
+        rel: oid for oid, rel, _ in server.walk_revision(
+            str(repo), "HEAD", ["**/*"], []
+        )
+    }
+    text = (repo / "big.txt").read_text()
+
+    with server.GitBlobReader(str(repo)) as reader:
+        with reader.open(blobs["big.txt"]) as stream:
+            head = stream.read(100)
+            assert "".join(
+                server.iter_stream_text(stream, head, window=4096)
+            ) == text
+        # Fechado antes do fim: o git sai por SIGPIPE, sem travar
+        reader.open(blobs["big.txt"]).close()
+        with reader.open("0" * 40) as stream:
+            with pytest.raises(OSError):
+                stream.read()
+        # O pipe do --batch segue em ordem
+        assert reader.read(blobs["small.md"]) == b"# pequeno\n\ntexto\n"
@@ -0,0 +1,66 @@
+from conftest import payloads
+from test_git_delta import git, make_repo
+
+import server
+
+
+class FailingUpserts:
+    """Cria a coleção normalmente, mas todo upsert falha."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def upsert(self, **kwargs):
+        raise ConnectionError("upsert recusado")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def test_failed_file_is_not_also_updated(tmp_path, client, embeddings):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.md").write_text("# a\n\ntexto\n")
+    (src / "b.md").write_text("# b\n\noutro texto\n")
+    server.handle_ingest({"directory": str(src)}, embeddings,
+                         server.QdrantIndex(client, "test"))
+    (src / "a.md").write_text("# a\n\ntexto novo\n")
+
+    index = server.QdrantIndex(FailingUpserts(client), "test")
+    result = server.handle_ingest(
+        {"directory": str(src), "upsert_retries": 0}, embeddings, index
+    )
+
+    assert result["upsert_failed"]["files"] == ["a.md"]
+    assert result["files_updated"] == 0
+    assert result["files_skipped"] == 1
+
+
+def test_git_delta_retries_a_file_whose_upsert_failed(tmp_path, client,
+                                                      embeddings):
+    repo = tmp_path / "repo"
+    make_repo(repo)
+    index = server.QdrantIndex(client, "test")
+    params = {"directory": str(repo), "git_delta": True}
+    server.handle_ingest(params, embeddings, index)
+    (repo / "docs" / "a.md").write_text("# A\n\nconteúdo novo\n")
+    git(repo, "commit", "-qam", "2")
+
+    failing = server.QdrantIndex(FailingUpserts(client), "test")
+    result = server.handle_ingest(
+        {**params, "upsert_retries": 0}, embeddings, failing
+    )
+    assert result["upsert_failed"]["files"] == ["docs/a.md"]
+    assert result["points_deleted"] == 0
+    # Os pontos antigos seguem no índice até os novos serem gravados
+    assert [p["text"] for p in payloads(client)
+            if p["path"] == "docs/a.md"] == ["# A\n\nshared text\n"]
+
+    # Nada mudou no git desde então, mas o arquivo volta no delta
+    result = server.handle_ingest(params, embeddings, index)
+    assert result["git_delta_from"] is not None
+    assert result["files_updated"] == 1 and result["points_deleted"] == 1
+    assert [p["text"] for p in payloads(client)
+            if p["path"] == "docs/a.md"] == ["# A\n\nconteúdo novo\n"]
+    result = server.handle_ingest(params, embeddings, index)
+    assert result["files_updated"] == 0